@@ -6,6 +6,12 @@
 #include <PacketWriter.h>
 
 
+#ifndef MAX_RESPONSE_PAYLOAD_SIZE
+/* Responses longer than this are sent as a sequence of packets. */
+#define MAX_RESPONSE_PAYLOAD_SIZE 0xFFFF
+#endif  // #ifndef MAX_RESPONSE_PAYLOAD_SIZE
+
+
 /* # `process_packet` # */
 template <typename Packet, typename Processor>
 UInt8Array process_packet_with_processor(Packet &packet,
@@ -40,6 +46,15 @@ UInt8Array process_packet_with_processor(Packet &packet,
 }
 
 
+/* # `apply_baud_rate` #
+ *
+ * Switch to the baud rate selected by the last request (see `CMD_LINK`), once
+ * the response is sent.  No-op by default; overloaded for command processors
+ * which support `CMD_LINK` (e.g., generated `CommandProcessor` classes). */
+template <typename Processor>
+inline void apply_baud_rate(Processor &processor) {}
+
+
 template <typename OStream, typename CommandProcessor>
 class CommandPacketHandler {
   /* # `CommandPacketHandler` #
@@ -55,7 +70,18 @@ class CommandPacketHandler {
    * data is no longer than `packet.buffer_size_`.
    *
    * If no response should be sent, the type of the packet must be set to
-   * `Packet::packet_type::NONE`. */
+   * `Packet::packet_type::NONE`.
+   *
+   * The response packet carries the interface unique identifier (`iuid_`) of
+   * the request packet.
+   *
+   * A response longer than `MAX_RESPONSE_PAYLOAD_SIZE` bytes is sent as a
+   * sequence of `STREAM` packets followed by a final `DATA` packet.
+   *
+   * Responses to a stream request (see `CMD_STREAM`) are pushed by
+   * `poll_stream`, which must be called regularly (e.g., on every `loop()`
+   * iteration).  Likewise, `poll_link` restores the previous baud rate if a
+   * new baud rate (see `CMD_LINK`) is not confirmed by the host in time. */
   public:
 
   OStream &ostream_;
@@ -68,14 +94,50 @@ class CommandPacketHandler {
   void process_packet(Packet &packet) {
     UInt8Array result = process_packet_with_processor(packet,
                                                       command_processor_);
+    /* Tag response with the identifier of the request (i.e., the sequence ID
+     * assigned by the host), so the host may match responses to requests
+     * when several requests are in flight. */
+    write_result(packet.iuid_, result);
+    /* Switch baud rate (if requested) only once the response is sent. */
+    apply_baud_rate(command_processor_);
+  }
+
+  void poll_link(uint32_t now_us) {
+    command_processor_.poll_link(now_us);
+  }
+
+  void poll_stream(uint32_t now_us) {
+    /* Push the response to the stream request, if due at the specified time
+     * (e.g., `micros()`).
+     *
+     * Pushed responses are tagged with the stream ID with the high bit set,
+     * so the host may tell them apart from responses to requests. */
+    if (!command_processor_.stream_due(now_us)) { return; }
+    UInt8Array result = command_processor_.process_stream(now_us);
+    if (result.data == NULL && result.length > 0) { return; }
+    write_result(0x8000 | command_processor_.stream_id(), result);
+  }
+
+  void write_result(uint16_t iuid, UInt8Array result) {
     FixedPacket result_packet;
+    result_packet.iuid_ = iuid;
     if (result.data == NULL && result.length > 0) {
       /* There was an error encountered while processing the request. */
       result_packet.type(FixedPacket::packet_type::NACK);
       result_packet.payload_length_ = 0;
     } else {
-      result_packet.reset_buffer(result.length, result.data);
-      result_packet.payload_length_ = result.length;
+      uint32_t offset = 0;
+      while (result.length - offset > MAX_RESPONSE_PAYLOAD_SIZE) {
+        result_packet.reset_buffer(MAX_RESPONSE_PAYLOAD_SIZE,
+                                   &result.data[offset]);
+        result_packet.payload_length_ = MAX_RESPONSE_PAYLOAD_SIZE;
+        result_packet.type(FixedPacket::packet_type::STREAM);
+        write_packet(ostream_, result_packet);
+        offset += MAX_RESPONSE_PAYLOAD_SIZE;
+      }
+      result_packet.reset_buffer(result.length - offset,
+                                 &result.data[offset]);
+      result_packet.payload_length_ = result.length - offset;
       result_packet.type(FixedPacket::packet_type::DATA);
     }
     write_packet(ostream_, result_packet);
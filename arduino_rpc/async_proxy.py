@@ -0,0 +1,167 @@
+'''
+`asyncio` proxy base class.
+
+Each `AsyncProxyBase` instance is an `asyncio.Protocol`: the event loop calls
+`data_received` as bytes arrive on the transport, so a single event loop can
+drive many devices without a thread (or a blocking read) per device.
+
+Requests are encoded (and responses decoded) exactly as for the synchronous
+`ProxyBase`; generated `AsyncProxy` classes share the `ProxyCodec` of the
+generated `Proxy` class (see `get_python_code(..., async_proxy=True)`).
+
+Requires Python 3.7+ (for `asyncio.get_running_loop`).
+
+.. versionadded:: 1.17
+'''
+import asyncio
+from collections import OrderedDict, deque
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+
+from .packet_stream import PacketParseError, PacketReceiver
+from .proxy import (CommandTimeoutError, FragmentError, MAX_SEQUENCE_ID,
+                    ProxyBase, encode_fragments)
+
+
+class AsyncProxyBase(asyncio.Protocol):
+    #: Default number of seconds to wait for a command response (`None`
+    #: waits indefinitely).
+    response_timeout_s = None
+    #: Packet buffer size of the device, maximum request payload size (or
+    #: `None` for `packet_size`), and maximum number of request fragments in
+    #: flight (see `ProxyBase`).
+    packet_size = ProxyBase.packet_size
+    max_request_payload_size = None
+    fragment_window = ProxyBase.fragment_window
+
+    def __init__(self):
+        self._transport = None
+        self._receiver = PacketReceiver()
+        self._pending = OrderedDict()
+        self._sequence_id = 0
+
+    @classmethod
+    async def connect(cls, port, baudrate=115200, loop=None, **kwargs):
+        '''
+        Open a serial port and return a connected proxy instance.
+
+        Requires the `pyserial-asyncio` package.  Extra keyword arguments are
+        passed to the `serial.Serial` constructor.
+        '''
+        import serial_asyncio
+
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        transport, proxy = await serial_asyncio.create_serial_connection(
+            loop, cls, port, baudrate=baudrate, **kwargs)
+        return proxy
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    # ## `asyncio.Protocol` interface ##
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        packets = self._receiver.packets
+        self._receiver.feed(data)
+        while packets:
+            packet = packets.popleft()
+            if isinstance(packet, PacketParseError):
+                # Sequence ID of a malformed packet is unknown.  Responses
+                # arrive in request order, so fail the oldest pending call.
+                if self._pending:
+                    future = self._pending.popitem(last=False)[1]
+                    if not future.done():
+                        future.set_exception(packet)
+                continue
+            sequence_id = packet.iuid
+            if sequence_id == 0 and self._pending:
+                sequence_id = next(iter(self._pending))
+            future = self._pending.pop(sequence_id, None)
+            if future is not None and not future.done():
+                future.set_result(packet)
+
+    def connection_lost(self, exc):
+        self._transport = None
+        while self._pending:
+            future = self._pending.popitem(last=False)[1]
+            if not future.done():
+                future.set_exception(IOError('Connection lost.')
+                                     if exc is None else exc)
+
+    # ## Command interface ##
+    async def _send_command(self, packet, timeout_s=None):
+        '''
+        Write the serialized packet to the transport and wait for the
+        corresponding response packet.
+
+        Raises `CommandTimeoutError` if no response is received within
+        `timeout_s` seconds (or `response_timeout_s` seconds if `timeout_s`
+        is not specified).
+        '''
+        if self._transport is None:
+            raise IOError('Not connected.')
+        if timeout_s is None:
+            timeout_s = self.response_timeout_s
+        self._sequence_id = self._sequence_id % MAX_SEQUENCE_ID + 1
+        sequence_id = packet.iuid = self._sequence_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[sequence_id] = future
+        self._transport.write(packet.tostring())
+        try:
+            return await asyncio.wait_for(future, timeout_s)
+        except asyncio.TimeoutError:
+            raise CommandTimeoutError('No response received before '
+                                      'deadline.')
+        finally:
+            # Late responses are discarded once the call is no longer
+            # pending.
+            self._pending.pop(sequence_id, None)
+
+    _command_packet = ProxyBase._command_packet
+    buffer_pool = ProxyBase.buffer_pool
+
+    async def _call(self, payload_data, decode, timeout_s=None):
+        max_payload_size = self.max_request_payload_size or self.packet_size
+        if len(payload_data) > max_payload_size:
+            return decode(await self._send_fragmented(payload_data,
+                                                      max_payload_size,
+                                                      timeout_s=timeout_s))
+        packet = cPacket(data=payload_data, type_=PACKET_TYPES.DATA)
+        return decode(await self._send_command(packet, timeout_s=timeout_s))
+
+    async def _send_fragmented(self, payload_data, max_payload_size,
+                               timeout_s=None):
+        '''
+        Send a request too long for a single packet as a sequence of
+        `CMD_FRAGMENT` requests, keeping up to `fragment_window` fragments in
+        flight (see `ProxyBase._send_fragmented`).
+
+        Returns
+        -------
+
+        cPacket
+            Response to the complete request (i.e., to the last fragment).
+        '''
+        calls = deque()
+        responses = []
+        try:
+            for fragment in encode_fragments(payload_data, max_payload_size):
+                if len(calls) >= self.fragment_window:
+                    responses.append(await calls.popleft())
+                packet = cPacket(data=fragment, type_=PACKET_TYPES.DATA)
+                # Tasks start (i.e., write their request) in creation order.
+                calls.append(asyncio.ensure_future(
+                    self._send_command(packet, timeout_s=timeout_s)))
+            while calls:
+                responses.append(await calls.popleft())
+        finally:
+            for call in calls:
+                call.cancel()
+        for response in responses:
+            if response.type_ == PACKET_TYPES.NACK:
+                raise FragmentError('Device rejected request fragment.')
+        return responses[-1]
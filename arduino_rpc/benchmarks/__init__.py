@@ -0,0 +1,14 @@
+'''
+Host-side benchmarks for `arduino_rpc` proxies.
+
+Each module in this package may be run as a script, e.g.:
+
+    python -m arduino_rpc.benchmarks.idle_wait
+
+The benchmark suite (see `arduino_rpc.benchmarks.suite`) runs the main
+benchmarks and reports results as JSON or CSV:
+
+    python -m arduino_rpc.benchmarks --simulated -o results.json
+
+(also installed as the `arduino-rpc-benchmark` command).
+'''
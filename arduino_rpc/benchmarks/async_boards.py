@@ -0,0 +1,107 @@
+'''
+Compare aggregate calls per second across N simulated boards driven
+synchronously (one `ProxyBase` per board, called in turn from one thread) and
+asynchronously (one `AsyncProxyBase` per board, all driven by a single event
+loop).
+
+See `arduino_rpc.benchmarks.simulated` for the simulated boards.
+
+Requires Python 3.7+ (see `arduino_rpc.async_proxy`).
+
+.. versionadded:: 1.17
+'''
+import asyncio
+import time
+
+import pandas as pd
+
+from ..async_proxy import AsyncProxyBase
+from ..proxy import ProxyBase
+from .simulated import SocketPort, close_boards, start_boards
+
+
+#: Request payload: command code `0`, followed by a short argument.
+PAYLOAD = b'\x00\x00hello'
+
+
+def _decode(packet):
+    return packet.data()
+
+
+def measure_sync(board_count, calls_per_board=50, latency_s=0.002):
+    '''
+    Returns
+    -------
+
+    float
+        Aggregate calls per second.
+    '''
+    sockets = start_boards(board_count, latency_s)
+    proxies = []
+    for host_sock, board_sock in sockets:
+        proxy = ProxyBase()
+        proxy._serial = SocketPort(host_sock)
+        proxies.append(proxy)
+    try:
+        start = time.time()
+        for i in range(calls_per_board):
+            for proxy in proxies:
+                proxy._call(PAYLOAD, _decode)
+        duration = time.time() - start
+    finally:
+        close_boards(sockets)
+    return board_count * calls_per_board / duration
+
+
+def measure_async(board_count, calls_per_board=50, latency_s=0.002):
+    '''
+    Returns
+    -------
+
+    float
+        Aggregate calls per second.
+    '''
+    loop = asyncio.new_event_loop()
+    sockets = start_boards(board_count, latency_s)
+
+    async def _run():
+        proxies = []
+        for host_sock, board_sock in sockets:
+            transport, proxy = await loop.create_connection(AsyncProxyBase,
+                                                            sock=host_sock)
+            proxies.append(proxy)
+
+        async def _board_calls(proxy):
+            for i in range(calls_per_board):
+                await proxy._call(PAYLOAD, _decode)
+
+        start = time.time()
+        await asyncio.gather(*[_board_calls(proxy) for proxy in proxies])
+        duration = time.time() - start
+        for proxy in proxies:
+            proxy.close()
+        return duration
+
+    try:
+        duration = loop.run_until_complete(_run())
+    finally:
+        close_boards(sockets)
+        loop.close()
+    return board_count * calls_per_board / duration
+
+
+def main(board_counts=(1, 4, 16, 32), calls_per_board=50, latency_s=0.002):
+    rows = []
+    for board_count in board_counts:
+        rows.append([board_count,
+                     measure_sync(board_count, calls_per_board, latency_s),
+                     measure_async(board_count, calls_per_board, latency_s)])
+    df_results = pd.DataFrame(rows, columns=['board_count',
+                                             'sync_calls_per_second',
+                                             'async_calls_per_second'])
+    print(df_results.to_string(index=False))
+    return df_results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+'''
+Measure the cost of encoding a request (i.e., `ProxyCodec._encode_<name>`)
+for each method of a generated proxy, excluding any serial communication.
+
+By default, the proxy is generated from an example signature frame covering
+methods without arguments, with scalar arguments, and with array arguments:
+
+    python -m arduino_rpc.benchmarks.encode
+
+With `--baseline`, the encoders generated before version 1.17 (which build
+each request with `pandas` and `numpy` record arrays, see
+`generate_baseline_codec`) are also timed, for a before/after comparison:
+
+    python -m arduino_rpc.benchmarks.encode --baseline
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from __future__ import print_function
+import timeit
+import types
+
+import jinja2
+import numpy as np
+import pandas as pd
+
+from ..rpc_data_frame import get_python_code, get_struct_sig_info_frame
+
+
+#: Example methods: `(name, return type, return ndims, [(argument name, atom
+#: type, ndims), ...])`.
+EXAMPLE_METHODS = [('ram_free', 'uint32_t', 0, []),
+                   ('set_x', None, 0, [('x', 'float', 0)]),
+                   ('add', 'int32_t', 0, [('a', 'int16_t', 0),
+                                          ('b', 'int16_t', 0)]),
+                   ('str_echo', 'uint8_t', 1, [('msg', 'uint8_t', 1)]),
+                   ('array_length', 'uint16_t', 0, [('array', 'uint8_t', 1)]),
+                   ('scale', 'int16_t', 1, [('values', 'int16_t', 1),
+                                            ('factor', 'float', 0)]),
+                   ('set_waveform', None, 0, [('times', 'uint32_t', 1),
+                                              ('values', 'float', 1)])]
+
+
+def example_sig_frame(pointer_width=16):
+    '''
+    Returns
+    -------
+
+    pandas.DataFrame
+        Signature frame (as returned by
+        `arduino_rpc.code_gen.get_multilevel_method_sig_frame`) of the
+        `EXAMPLE_METHODS`.
+    '''
+    rows = []
+    for method_i, (method_name, return_type, return_ndims,
+                   args) in enumerate(EXAMPLE_METHODS):
+        camel_name = ''.join(word.capitalize()
+                             for word in method_name.split('_'))
+        method = [method_i, method_name, camel_name, len(args)]
+        returns = [return_type, return_ndims]
+        if not args:
+            rows.append(method + [np.nan, None, None, np.nan] + returns)
+        for arg_i, (arg_name, atom_type, ndims) in enumerate(args):
+            rows.append(method + [arg_i, arg_name, atom_type, ndims] +
+                        returns)
+    df_sig_info = pd.DataFrame(rows, columns=['method_i', 'method_name',
+                                              'camel_name', 'arg_count',
+                                              'arg_i', 'arg_name',
+                                              'atom_type', 'ndims',
+                                              'return_atom_type',
+                                              'return_ndims'])
+    return get_struct_sig_info_frame(df_sig_info,
+                                     pointer_width=pointer_width)
+
+
+def sample_args(df_method_i, array_length=16):
+    '''
+    Returns
+    -------
+
+    list
+        Example argument values for a method (one value per row of the
+        signature frame of the method).
+    '''
+    args = []
+    if df_method_i.arg_count.iloc[0] > 0:
+        for i, arg_i in df_method_i.iterrows():
+            if arg_i.ndims > 0:
+                args.append(np.arange(array_length)
+                            .astype(arg_i.atom_np_type))
+            else:
+                args.append(np.dtype(arg_i.atom_np_type).type(1))
+    return args
+
+
+def encode_times(codec, df_sig_info, number=2000, array_length=16):
+    '''
+    Returns
+    -------
+
+    pandas.Series
+        Mean seconds per call of the request encoder of each method, indexed
+        by method name.
+    '''
+    times = pd.Series(name='encode_seconds')
+    for method_name, df_method_i in df_sig_info.groupby('method_name'):
+        encode = getattr(codec, '_encode_' + method_name)
+        args = sample_args(df_method_i, array_length=array_length)
+        times[method_name] = (timeit.timeit(lambda: encode(*args),
+                                            number=number) / number)
+    return times
+
+
+def generate_module(df_sig_info, **kwargs):
+    '''
+    Returns
+    -------
+
+    module
+        Python module generated for the signature frame (see
+        `arduino_rpc.rpc_data_frame.get_python_code`).
+    '''
+    module = types.ModuleType('generated_proxy')
+    exec(compile(get_python_code(df_sig_info, **kwargs), 'generated_proxy',
+                 'exec'), module.__dict__)
+    return module
+
+
+def generate_codec(df_sig_info, **kwargs):
+    '''
+    Returns
+    -------
+
+    ProxyCodec
+        Instance of the `ProxyCodec` class generated for the signature frame.
+    '''
+    return generate_module(df_sig_info, **kwargs).ProxyCodec()
+
+
+#: Request encoders generated by `get_python_code` before version 1.17
+#: (except that `tostring` is replaced by the equivalent `tobytes`).
+BASELINE_CODEC_TEMPLATE = jinja2.Template(r'''
+from builtins import bytes
+import pandas as pd
+import numpy as np
+_translate = lambda arg: arg
+
+
+class ProxyCodec(object):
+{% for i, (method_i, method_name) in df_sig_info.drop_duplicates(subset='method_i')[['method_i', 'method_name']].iterrows() %}
+    _CMD_{{ method_name.upper() }} = {{ '0x%02x' % method_i }}
+{%- endfor %}
+
+{% for (method_i, method_name, camel_name, arg_count), df_method_i in df_sig_info.groupby(['method_i', 'method_name', 'camel_name', 'arg_count']) %}
+    def _encode_{{ method_name }}(self{% if arg_count > 0 %}, {{ ', '.join(df_method_i.arg_name) }}{% endif %}):
+        command = np.dtype('uint16').type(self._CMD_{{ method_name.upper() }})
+{%- if arg_count > 0 %}
+        ARG_STRUCT_SIZE = {{ df_method_i.struct_size.sum() }}
+{%- if df_method_i.ndims.max() > 0 %}
+{% for i, array_i in df_method_i[df_method_i.ndims > 0].iterrows() %}
+        {{ array_i['arg_name'] }} = _translate({{ array_i['arg_name'] }})
+        if isinstance({{ array_i['arg_name'] }}, str):
+            {{ array_i['arg_name'] }} = map(ord, {{ array_i['arg_name'] }})
+        elif isinstance({{ array_i['arg_name'] }}, bytes):
+            {{ array_i['arg_name'] }} = list(bytes({{ array_i['arg_name'] }}))
+        # Argument is an array, so cast to appropriate array type.
+        {{ array_i['arg_name'] }} = np.ascontiguousarray({{ array_i['arg_name'] }}, dtype='{{ array_i.atom_np_type }}')
+{%- endfor %}
+        array_info = pd.DataFrame([
+{%- for arg_name in df_method_i.loc[df_method_i.ndims > 0, 'arg_name'] -%}
+        {{ arg_name }}.shape[0], {% endfor -%}],
+                                  index=[
+{%- for arg_name in df_method_i.loc[df_method_i.ndims > 0, 'arg_name'] -%}
+        '{{ arg_name }}', {% endfor -%}],
+                                  columns=['length'])
+        array_info['start'] = array_info.length.cumsum() - array_info.length
+        array_data = b''.join([
+{%- for arg_name in df_method_i.loc[df_method_i.ndims > 0, 'arg_name'] -%}
+        {{ arg_name }}.tobytes(), {% endfor -%}])
+{%- else %}
+        array_data = b''
+{%- endif %}
+        payload_size = ARG_STRUCT_SIZE + len(array_data)
+        struct_data = np.array([(
+{%- for i, (arg_name, ndims, np_atom_type) in df_method_i[['arg_name', 'ndims', 'atom_np_type']].iterrows() -%}
+{%- if ndims > 0 -%}
+        array_info.length['{{ arg_name }}'], ARG_STRUCT_SIZE + array_info.start['{{ arg_name }}'], {# #}
+{%- else -%}
+        {{ arg_name }}, {# #}
+{%- endif -%}
+{% endfor %})],
+                               dtype=[
+{%- for i, (arg_name, ndims, np_atom_type) in df_method_i[['arg_name', 'ndims', 'atom_np_type']].iterrows() -%}
+{%- if ndims > 0 -%}
+        ('{{ arg_name }}_length', 'uint32'), ('{{ arg_name }}_data', 'uint{{ pointer_width }}'), {% else -%}
+        ('{{ arg_name }}', '{{ np_atom_type }}'), {% endif %}{% endfor %}])
+        payload_data = struct_data.tobytes() + array_data
+{%- else %}
+        payload_size = 0
+        payload_data = b''
+{%- endif %}
+
+        return command.tobytes() + payload_data
+{% endfor %}
+'''.strip())
+
+
+def generate_baseline_codec(df_sig_info, pointer_width=16):
+    '''
+    Returns
+    -------
+
+    ProxyCodec
+        Instance of a class with the request encoders generated for the
+        signature frame before version 1.17 (see `BASELINE_CODEC_TEMPLATE`),
+        e.g., to compare against `generate_codec`.
+    '''
+    module = types.ModuleType('baseline_proxy')
+    exec(compile(BASELINE_CODEC_TEMPLATE.render(df_sig_info=df_sig_info,
+                                                pointer_width=pointer_width),
+                 'baseline_proxy', 'exec'), module.__dict__)
+    return module.ProxyCodec()
+
+
+def parse_args(args=None):
+    """Parses arguments, returns (options, args)."""
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Measure request encode times.')
+    parser.add_argument('-n', '--number', type=int, default=2000,
+                        help='Calls per method (default=%(default)s).')
+    parser.add_argument('--array-length', type=int, default=16,
+                        help='Length of array arguments '
+                        '(default=%(default)s).')
+    parser.add_argument('--baseline', action='store_true',
+                        help='Also time the encoders generated before '
+                        'version 1.17.')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    df_sig_info = example_sig_frame()
+    times = (encode_times(generate_codec(df_sig_info), df_sig_info,
+                          number=args.number, array_length=args.array_length)
+             .to_frame('encode_microseconds') * 1e6)
+    if args.baseline:
+        times.insert(0, 'baseline_encode_microseconds',
+                     encode_times(generate_baseline_codec(df_sig_info),
+                                  df_sig_info, number=args.number,
+                                  array_length=args.array_length) * 1e6)
+        times['speedup'] = (times['baseline_encode_microseconds'] /
+                            times['encode_microseconds'])
+    print(times.to_string())
+    return times
+
+
+if __name__ == '__main__':
+    main()
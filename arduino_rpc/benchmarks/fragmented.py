@@ -0,0 +1,135 @@
+'''
+Measure the throughput of sending a request too long for a single packet
+(i.e., as a sequence of `CMD_FRAGMENT` requests) to a simulated board, against
+the baud-limited transfer rate.
+
+The simulated board assembles fragments (as the generated `CommandProcessor`
+does with a staging buffer) and delays each request packet by the time it
+would take to receive over a serial link at the specified baud rate.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from __future__ import print_function
+import socket
+import struct
+import threading
+import time
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+import numpy as np
+import pandas as pd
+
+from ..commands import CMD_FRAGMENT, FRAGMENT_HEADER_SIZE
+from ..packet_stream import PacketReceiver
+from ..proxy import ProxyBase
+from .simulated import SocketPort
+
+
+#: Bits on the wire per byte (start bit, 8 data bits, stop bit).
+BITS_PER_BYTE = 10
+
+
+class LengthProxy(ProxyBase):
+    '''
+    Proxy with a single `array_length` method (command code `0`), which
+    returns the length of the request payload.
+    '''
+    def _encode_array_length(self, array):
+        return b'\x00\x00' + bytes(array)
+
+    def _decode_array_length(self, response):
+        return struct.unpack('<I', response.data())[0]
+
+    def array_length(self, array, timeout_s=None):
+        return self._call(self._encode_array_length(array),
+                          self._decode_array_length, timeout_s=timeout_s)
+
+
+def _simulated_board(sock, baudrate, packet_size):
+    receiver = PacketReceiver()
+    staged = bytearray()
+    byte_s = float(BITS_PER_BYTE) / baudrate
+    while True:
+        try:
+            data = sock.recv(4096)
+        except (IOError, OSError):
+            break
+        if not data:
+            break
+        receiver.feed(data)
+        while receiver.packets:
+            request = receiver.packets.popleft()
+            payload = request.data()
+            # Time to receive the request packet.
+            time.sleep((len(payload) + 10) * byte_s)
+            if len(payload) > packet_size:
+                response = None
+            elif struct.unpack_from('<H', payload)[0] == CMD_FRAGMENT:
+                offset, total_length = struct.unpack_from('<II', payload, 2)
+                if offset != len(staged):
+                    del staged[:]
+                staged += payload[FRAGMENT_HEADER_SIZE:]
+                if len(staged) < total_length:
+                    response = b''
+                else:
+                    response = struct.pack('<I', len(staged) - 2)
+                    del staged[:]
+            else:
+                response = struct.pack('<I', len(payload) - 2)
+            if response is None:
+                packet = cPacket(data=b'', type_=PACKET_TYPES.NACK,
+                                 iuid=request.iuid)
+            else:
+                packet = cPacket(data=response, type_=PACKET_TYPES.DATA,
+                                 iuid=request.iuid)
+            # Responses are sent while the next request is received (i.e.,
+            # the link is full duplex).
+            sock.sendall(packet.tostring())
+
+
+def measure(byte_count, baudrate=115200, packet_size=80, repeats=3):
+    '''
+    Returns
+    -------
+
+    float
+        Mean seconds per transfer of `byte_count` bytes.
+    '''
+    host_sock, board_sock = socket.socketpair()
+    thread = threading.Thread(target=_simulated_board,
+                              args=(board_sock, baudrate, packet_size))
+    thread.daemon = True
+    thread.start()
+    proxy = LengthProxy()
+    proxy._serial = SocketPort(host_sock)
+    proxy.packet_size = packet_size
+    data = np.zeros(byte_count, dtype='uint8')
+    try:
+        start = time.time()
+        for i in range(repeats):
+            assert proxy.array_length(data) == byte_count
+        return (time.time() - start) / repeats
+    finally:
+        host_sock.close()
+        board_sock.close()
+
+
+def main(byte_counts=(1 << 10, 4 << 10, 16 << 10, 64 << 10),
+         baudrate=115200, packet_size=80):
+    rows = []
+    for byte_count in byte_counts:
+        seconds = measure(byte_count, baudrate=baudrate,
+                          packet_size=packet_size)
+        baud_seconds = byte_count * float(BITS_PER_BYTE) / baudrate
+        rows.append([byte_count, seconds, baud_seconds,
+                     baud_seconds / seconds])
+    df_results = pd.DataFrame(rows, columns=['byte_count', 'seconds',
+                                             'baud_seconds',
+                                             'baud_efficiency'])
+    print(df_results.to_string(index=False))
+    return df_results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Measure host CPU usage while a proxy waits for slow command responses.
+
+A pseudo-terminal stands in for the device: a responder thread echoes each
+request packet back after a fixed delay, so the proxy spends nearly all of
+its time waiting for the response.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import threading
+import time
+
+import numpy as np
+from nadamq.NadaMq import cPacket, cPacketParser, PACKET_TYPES
+import serial
+
+from ..proxy import ProxyBase
+
+
+class _BusyWaitProxy(ProxyBase):
+    '''
+    Proxy using the original polling receive loop, for comparison.
+    '''
+    def _send_command(self, packet, timeout_s=None):
+        self._serial.write(packet.tostring())
+        parser = cPacketParser()
+        while True:
+            response = self._serial.read(self._serial.inWaiting())
+            if not response:
+                continue
+            result = parser.parse(np.fromstring(response, dtype='uint8'))
+            if parser.message_completed:
+                return result
+            elif parser.error:
+                raise IOError('Error parsing.')
+
+
+class _BlockingProxy(ProxyBase):
+    pass
+
+
+def _echo_responder(master_fd, delay_s, stop):
+    while not stop.is_set():
+        try:
+            data = os.read(master_fd, 1024)
+        except OSError:
+            break
+        time.sleep(delay_s)
+        os.write(master_fd, data)
+
+
+def measure(proxy_class, delay_s=0.05, count=20):
+    '''
+    Send `count` commands through a proxy of type `proxy_class`, where each
+    response is delayed by `delay_s` seconds.
+
+    Returns
+    -------
+
+    (float, float)
+        Wall-clock duration and process CPU time (user + system) in seconds.
+    '''
+    master_fd, slave_fd = os.openpty()
+    port = serial.Serial(os.ttyname(slave_fd), baudrate=115200)
+    stop = threading.Event()
+    responder = threading.Thread(target=_echo_responder,
+                                 args=(master_fd, delay_s, stop))
+    responder.daemon = True
+    responder.start()
+
+    proxy = proxy_class()
+    proxy._serial = port
+    packet = cPacket(data=b'\x00\x00', type_=PACKET_TYPES.DATA)
+    try:
+        start_times = os.times()
+        start = time.time()
+        for i in range(count):
+            proxy._send_command(packet)
+        end = time.time()
+        end_times = os.times()
+    finally:
+        stop.set()
+        port.close()
+        os.close(master_fd)
+        os.close(slave_fd)
+    cpu_s = ((end_times[0] + end_times[1]) -
+             (start_times[0] + start_times[1]))
+    return end - start, cpu_s
+
+
+def main(delay_s=0.05, count=20):
+    for name, proxy_class in (('busy-wait', _BusyWaitProxy),
+                              ('blocking', _BlockingProxy)):
+        wall_s, cpu_s = measure(proxy_class, delay_s=delay_s, count=count)
+        print('%-10s wall: %6.3f s  cpu: %6.3f s  (%5.1f%% of one core)' %
+              (name, wall_s, cpu_s, 100 * cpu_s / wall_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Compare serial and pipelined throughput for the `str_echo` (round-trip) and
+`array_length` (one-way) byte-count sweep from the `Transfer benchmark`
+notebook.
+
+The proxy must expose `str_echo` and `array_length` methods, e.g.:
+
+    python -m arduino_rpc.benchmarks.pipeline /dev/ttyUSB0 \\
+        --proxy-class my_package.node.Proxy
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from __future__ import print_function
+import importlib
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def _time_serial(f, data, repeats):
+    start = time.time()
+    for i in range(repeats):
+        f(data)
+    return (time.time() - start) / repeats
+
+
+def _time_pipelined(proxy, method_name, data, repeats, **kwargs):
+    start = time.time()
+    with proxy.pipeline(**kwargs) as pipeline:
+        f = getattr(pipeline, method_name)
+        for i in range(repeats):
+            f(data)
+    return (time.time() - start) / repeats
+
+
+def transfer_sweep(proxy, byte_counts=None, repeats=20, window=None,
+                   window_bytes=None):
+    '''
+    Measure mean seconds per call for each byte count, issuing calls both
+    serially (waiting for each response before sending the next request) and
+    pipelined.
+
+    Returns
+    -------
+
+    pandas.DataFrame
+        Columns `byte_count`, `echo_seconds`, `length_seconds`,
+        `pipelined_echo_seconds`, and `pipelined_length_seconds`.
+    '''
+    if byte_counts is None:
+        byte_counts = range(1, 102, 10)
+    rows = []
+    for n in byte_counts:
+        data = np.full(n, ord('h'), dtype='uint8')
+        row = [n]
+        row.append(_time_serial(proxy.str_echo, data, repeats))
+        row.append(_time_serial(proxy.array_length, data, repeats))
+        for method_name in ('str_echo', 'array_length'):
+            row.append(_time_pipelined(proxy, method_name, data, repeats,
+                                       window=window,
+                                       window_bytes=window_bytes))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['byte_count', 'echo_seconds',
+                                       'length_seconds',
+                                       'pipelined_echo_seconds',
+                                       'pipelined_length_seconds'])
+
+
+def parse_args(args=None):
+    """Parses arguments, returns (options, args)."""
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Compare serial and pipelined '
+                            'transfer throughput.')
+    parser.add_argument('port')
+    parser.add_argument('-b', '--baudrate', type=int, default=115200)
+    parser.add_argument('--proxy-class', required=True,
+                        help='Dotted path of generated `Proxy` class (e.g., '
+                        '`my_package.node.Proxy`).')
+    parser.add_argument('-r', '--repeats', type=int, default=20)
+    parser.add_argument('-w', '--window', type=int, default=None)
+    parser.add_argument('--window-bytes', type=int, default=None)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    from serial import Serial
+
+    args = parse_args(args)
+    module_name, class_name = args.proxy_class.rsplit('.', 1)
+    proxy_class = getattr(importlib.import_module(module_name), class_name)
+    proxy = proxy_class()
+    proxy._serial = Serial(args.port, baudrate=args.baudrate)
+    times = transfer_sweep(proxy, repeats=args.repeats, window=args.window,
+                           window_bytes=args.window_bytes)
+    # Minimum serial communication time for one-way transfer of each byte.
+    times['baud_seconds'] = (times['length_seconds'].min() +
+                             8. / args.baudrate * times['byte_count'])
+    print(times.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
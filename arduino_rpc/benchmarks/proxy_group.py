@@ -0,0 +1,79 @@
+'''
+Compare the wall time of calling one method on N simulated boards, one board
+after another versus fanned out through a `ProxyGroup`.
+
+See `arduino_rpc.benchmarks.simulated` for the simulated boards.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from __future__ import print_function
+import time
+
+import pandas as pd
+
+from ..proxy import ProxyBase
+from ..proxy_group import ProxyGroup
+from .simulated import SocketPort, close_boards, start_boards
+
+
+class EchoProxy(ProxyBase):
+    '''
+    Proxy with a single `echo` method (command code `0`).
+    '''
+    def _encode_echo(self, data):
+        return b'\x00\x00' + bytes(data)
+
+    def _decode_echo(self, response):
+        return len(response.data()) - 2
+
+    def echo(self, data, timeout_s=None):
+        return self._call(self._encode_echo(data), self._decode_echo,
+                          timeout_s=timeout_s)
+
+
+def measure(board_count, calls=20, latency_s=0.005):
+    '''
+    Returns
+    -------
+
+    tuple
+        Mean seconds per call `(sequential, fanned_out)`.
+    '''
+    sockets = start_boards(board_count, latency_s)
+    proxies = []
+    for host_sock, board_sock in sockets:
+        proxy = EchoProxy()
+        proxy._serial = SocketPort(host_sock)
+        proxies.append(proxy)
+    group = ProxyGroup(proxies)
+    try:
+        start = time.time()
+        for i in range(calls):
+            for proxy in proxies:
+                proxy.echo(b'hello')
+        sequential_s = (time.time() - start) / calls
+
+        start = time.time()
+        for i in range(calls):
+            df_results = group.echo(b'hello')
+        fanned_out_s = (time.time() - start) / calls
+        assert df_results.error.isnull().all()
+    finally:
+        close_boards(sockets)
+    return sequential_s, fanned_out_s
+
+
+def main(board_counts=(1, 2, 4, 8, 16, 32), calls=20, latency_s=0.005):
+    rows = []
+    for board_count in board_counts:
+        rows.append((board_count, ) + measure(board_count, calls, latency_s))
+    df_results = pd.DataFrame(rows, columns=['board_count',
+                                             'sequential_seconds',
+                                             'group_seconds'])
+    print(df_results.to_string(index=False))
+    return df_results
+
+
+if __name__ == '__main__':
+    main()
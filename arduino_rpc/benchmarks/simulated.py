@@ -0,0 +1,85 @@
+'''
+Simulated boards for benchmarks.
+
+Each simulated board is a responder thread on the far end of a socket pair,
+which echoes each request payload back after a fixed processing latency.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import fcntl
+import socket
+import struct
+import termios
+import threading
+import time
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+
+from ..packet_stream import PacketReceiver
+
+
+class SocketPort(object):
+    '''
+    Minimal serial port interface (as used by `ProxyBase`) for a socket.
+    '''
+    def __init__(self, sock):
+        self._sock = sock
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def inWaiting(self):
+        buffer_ = fcntl.ioctl(self._sock, termios.FIONREAD, b'\0' * 4)
+        return struct.unpack('I', buffer_)[0]
+
+    def readinto(self, buffer_):
+        return self._sock.recv_into(buffer_)
+
+    def write(self, data):
+        self._sock.sendall(data)
+
+
+def _simulated_board(sock, latency_s):
+    receiver = PacketReceiver()
+    while True:
+        try:
+            data = sock.recv(4096)
+        except (IOError, OSError):
+            break
+        if not data:
+            break
+        receiver.feed(data)
+        while receiver.packets:
+            request = receiver.packets.popleft()
+            time.sleep(latency_s)
+            response = cPacket(data=request.data(), type_=PACKET_TYPES.DATA,
+                               iuid=request.iuid)
+            sock.sendall(response.tostring())
+
+
+def start_boards(count, latency_s):
+    '''
+    Start `count` simulated boards.
+
+    Returns
+    -------
+
+    list
+        `(host_socket, board_socket)` pair for each board.
+    '''
+    sockets = []
+    for i in range(count):
+        host_sock, board_sock = socket.socketpair()
+        thread = threading.Thread(target=_simulated_board,
+                                  args=(board_sock, latency_s))
+        thread.daemon = True
+        thread.start()
+        sockets.append((host_sock, board_sock))
+    return sockets
+
+
+def close_boards(sockets):
+    for host_sock, board_sock in sockets:
+        host_sock.close()
+        board_sock.close()
@@ -0,0 +1,608 @@
+'''
+Reproducible benchmark suite, with machine-readable results (JSON/CSV) and
+regression checks against a baseline result file.
+
+Benchmarks:
+
+ - `sweep`: Byte-count sweep of round-trip (`str_echo`) and one-way
+   (`array_length`) transfers, issued serially and pipelined (see
+   `arduino_rpc.benchmarks.pipeline.transfer_sweep`).
+ - `encode`: Request encoding time of each method (no communication).
+ - `decode`: Response decoding time of each method (no communication).
+ - `import`: Import time and peak resident memory of a fresh interpreter
+   importing the generated proxy module, for the `numpy` and `struct`
+   runtimes (see `get_python_code(..., runtime=...)`), and of a bare
+   interpreter (`baseline`).
+ - `concurrency`: Call throughput from several threads through the I/O
+   thread of the proxy (see `ProxyBase.start_io_thread`).
+ - `settle`: Latency-to-settle of a burst of setter calls (e.g., from a UI
+   slider), with and without coalescing (see
+   `ProxyBase.enable_coalescing`).
+ - `priority`: Worst-case latency of control calls (`set_x`) while bulk
+   array uploads (`array_length`) run in another thread, with control calls
+   queued behind the upload (FIFO) or in the high priority lane (see
+   `ProxyBase.start_io_thread`).
+ - `compression`: Effective throughput (raw bytes per second) of round trips
+   of noisy sensor data (`scale`) and mostly-zero masks (`str_echo`), with
+   and without compression (see `ProxyBase.enable_compression`), relative
+   to the baud rate limit.
+
+Benchmarks run against a real device, or against a simulated device (see
+`arduino_rpc.simulator.SimulatedDevice`) implementing the `EXAMPLE_METHODS`:
+
+    arduino-rpc-benchmark --simulated --baudrate 115200 -o results.json
+    arduino-rpc-benchmark /dev/ttyUSB0 --proxy-class my_package.node.Proxy \\
+        --baseline results.json --threshold 0.2
+
+The exit status is non-zero if any result regressed by more than the
+threshold relative to the baseline.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from __future__ import print_function
+import csv
+import datetime as dt
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+import numpy as np
+
+from ..proxy import _monotonic
+from ..rpc_data_frame import get_python_code
+from .encode import example_sig_frame, encode_times, generate_module
+from .pipeline import transfer_sweep
+
+
+#: Fields of each result record.
+RESULT_FIELDS = ['benchmark', 'name', 'parameter', 'value', 'unit',
+                 'higher_is_better']
+
+
+class ExampleNode(object):
+    '''
+    Python implementation of the `EXAMPLE_METHODS` (for a simulated device).
+    '''
+    def __init__(self):
+        self.x = 0
+
+    def ram_free(self):
+        return 1024
+
+    def set_x(self, x):
+        self.x = x
+
+    def add(self, a, b):
+        return a + b
+
+    def str_echo(self, msg):
+        return msg
+
+    def array_length(self, array):
+        return len(array)
+
+    def scale(self, values, factor):
+        return values * factor
+
+    def set_waveform(self, times, values):
+        pass
+
+
+def _record(benchmark, name, parameter, value, unit, higher_is_better=False):
+    return dict(zip(RESULT_FIELDS, [benchmark, name, parameter, float(value),
+                                    unit, higher_is_better]))
+
+
+def run_sweep(proxy, byte_counts=None, repeats=20):
+    df_times = transfer_sweep(proxy, byte_counts=byte_counts, repeats=repeats)
+    records = []
+    for i, row in df_times.iterrows():
+        byte_count = int(row['byte_count'])
+        for column in df_times.columns[1:]:
+            name = column[:-len('_seconds')]
+            records.append(_record('sweep', name, byte_count, row[column],
+                                   's'))
+            records.append(_record('sweep', name + '_throughput', byte_count,
+                                   byte_count / row[column], 'B/s', True))
+    return records
+
+
+def run_encode(proxy, df_sig_info, number=2000):
+    times = encode_times(proxy, df_sig_info, number=number)
+    return [_record('encode', method_name, None, seconds, 's')
+            for method_name, seconds in times.items()]
+
+
+def decode_times(proxy, df_sig_info, number=2000, array_length=16):
+    '''
+    Returns
+    -------
+
+    dict
+        Mean seconds per call of the response decoder of each method which
+        returns a value, keyed by method name.
+    '''
+    times = {}
+    for method_name, df_method_i in df_sig_info.groupby('method_name'):
+        method_i = df_method_i.iloc[0]
+        if method_i.return_atom_type is None:
+            continue
+        dtype = np.dtype(method_i.return_atom_np_type)
+        if method_i.return_ndims > 0:
+            data = np.arange(array_length).astype(dtype).tobytes()
+        else:
+            data = dtype.type(1).tobytes()
+        response = cPacket(data=data, type_=PACKET_TYPES.DATA)
+        decode = getattr(proxy, '_decode_' + method_name)
+        times[method_name] = (timeit.timeit(lambda: decode(response),
+                                            number=number) / number)
+    return times
+
+
+def run_decode(proxy, df_sig_info, number=2000):
+    return [_record('decode', method_name, None, seconds, 's')
+            for method_name, seconds in
+            sorted(decode_times(proxy, df_sig_info, number=number).items())]
+
+
+#: Script run in a fresh interpreter to measure the import footprint of a
+#: module.  Prints `[import seconds, peak RSS in kB, heavy modules imported]`.
+_IMPORT_SCRIPT = '''
+import json, resource, sys, timeit
+start = timeit.default_timer()
+%s
+duration = timeit.default_timer() - start
+try:
+    # Peak RSS of this process image (`ru_maxrss` includes the peak RSS of
+    # the parent before `exec` on Linux).
+    with open('/proc/self/status') as status:
+        rss = [int(line.split()[1]) for line in status
+               if line.startswith('VmHWM:')][0]
+except IOError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+print(json.dumps([duration, rss, [name for name in ('numpy', 'pandas',
+                                                     'google.protobuf')
+                                   if name in sys.modules]]))
+'''
+
+
+def import_footprint(df_sig_info, runtime=None, repeats=5):
+    '''
+    Measure the import footprint of the proxy module generated for
+    `df_sig_info`, in fresh interpreters (requires the `resource` module,
+    i.e., not Windows).
+
+    Arguments
+    ---------
+
+     - `runtime`: Runtime of the generated module (see `get_python_code`),
+       or `None` to measure a bare interpreter.
+     - `repeats`: Number of interpreters to run.
+
+    Returns
+    -------
+
+    tuple
+        Median import time (in seconds), median peak resident set size (in
+        MB), and names of heavy modules (`numpy`, `pandas`,
+        `google.protobuf`) imported.
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        if runtime is None:
+            statement = 'pass'
+        else:
+            with open(os.path.join(directory, 'generated_proxy.py'),
+                      'w') as output:
+                output.write(get_python_code(df_sig_info, runtime=runtime))
+            statement = 'import generated_proxy'
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([directory] +
+                                            [path_ for path_ in sys.path
+                                             if path_])
+        results = [json.loads(subprocess.check_output([sys.executable, '-c',
+                                                       _IMPORT_SCRIPT %
+                                                       statement],
+                                                      env=env,
+                                                      cwd=directory)
+                              .decode('utf8'))
+                   for i in range(repeats)]
+    finally:
+        shutil.rmtree(directory)
+    durations, rss_kb, modules = zip(*results)
+    return (float(np.median(durations)), float(np.median(rss_kb)) / 1024.,
+            modules[-1])
+
+
+def run_import(df_sig_info):
+    records = []
+    for runtime in (None, 'numpy', 'struct'):
+        name = runtime or 'baseline'
+        duration, rss_mb = import_footprint(df_sig_info, runtime)[:2]
+        records += [_record('import', name + '_time', None, duration, 's'),
+                    _record('import', name + '_rss', None, rss_mb, 'MB')]
+    return records
+
+
+def run_concurrency(proxy, thread_counts=(1, 2, 4, 8), calls_per_thread=100,
+                    method_name='ram_free', args=()):
+    '''
+    Measure call throughput with several threads calling a method
+    concurrently through the I/O thread of the proxy.
+    '''
+    method = getattr(proxy, method_name)
+    records = []
+    proxy.start_io_thread()
+    try:
+        for thread_count in thread_counts:
+            def _calls():
+                for i in range(calls_per_thread):
+                    method(*args)
+            threads = [threading.Thread(target=_calls)
+                       for i in range(thread_count)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.time() - start
+            records.append(_record('concurrency', method_name + '_calls',
+                                   thread_count, thread_count *
+                                   calls_per_thread / duration, 'calls/s',
+                                   True))
+    finally:
+        proxy.stop_io_thread()
+    return records
+
+
+def settle_time(proxy, method_name='set_x', calls=200, interval_s=1e-3,
+                coalesce=False):
+    '''
+    Call a setter `calls` times, one call every `interval_s` seconds (or as
+    fast as calls return, if slower), with values `0, 1, ...`.
+
+    Returns
+    -------
+
+    float
+        Seconds from the time the last call was due until the device
+        processed the last value.
+    '''
+    if coalesce:
+        proxy.enable_coalescing([method_name])
+    setter = getattr(proxy, method_name)
+    try:
+        start = _monotonic()
+        for i in range(calls):
+            delay = start + i * interval_s - _monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            setter(i)
+        proxy.flush_coalesced()
+        return _monotonic() - (start + (calls - 1) * interval_s)
+    finally:
+        proxy.disable_coalescing()
+
+
+def run_settle(proxy, method_name='set_x', calls=200, interval_s=1e-3):
+    return [_record('settle', method_name + ('_coalesced' if coalesce
+                                             else '_serial'),
+                    calls, settle_time(proxy, method_name=method_name,
+                                       calls=calls, interval_s=interval_s,
+                                       coalesce=coalesce), 's')
+            for coalesce in (False, True)]
+
+
+def control_latencies(proxy, control_priority, upload_size=2048,
+                      uploads=3, interval_s=0.005, method_name='set_x',
+                      bulk_method_name='array_length'):
+    '''
+    Call a control method every `interval_s` seconds while another thread
+    uploads arrays of `upload_size` bytes through a bulk method, with the
+    control method in the specified priority lane.
+
+    Returns
+    -------
+
+    numpy.ndarray
+        Latency (in seconds) of each control call.
+    '''
+    from ..threaded import PRIORITY_BULK
+
+    data = np.zeros(upload_size, dtype='uint8')
+    control = getattr(proxy, method_name)
+    upload = getattr(proxy, bulk_method_name)
+    proxy.start_io_thread(priorities={method_name: control_priority,
+                                      bulk_method_name: PRIORITY_BULK})
+    try:
+        def _uploads():
+            for i in range(uploads):
+                upload(data)
+
+        thread = threading.Thread(target=_uploads)
+        thread.start()
+        latencies = []
+        while thread.is_alive():
+            start = _monotonic()
+            control(len(latencies))
+            latencies.append(_monotonic() - start)
+            time.sleep(max(0, start + interval_s - _monotonic()))
+        thread.join()
+    finally:
+        proxy.stop_io_thread()
+    return np.array(latencies)
+
+
+def run_priority(proxy, upload_size=2048, uploads=3):
+    from ..threaded import PRIORITY_BULK, PRIORITY_HIGH
+
+    records = []
+    for name, priority in (('fifo', PRIORITY_BULK), ('high', PRIORITY_HIGH)):
+        latencies = control_latencies(proxy, priority,
+                                      upload_size=upload_size,
+                                      uploads=uploads)
+        records += [_record('priority', 'control_%s_max' % name, upload_size,
+                            latencies.max(), 's'),
+                    _record('priority', 'control_%s_median' % name,
+                            upload_size, np.median(latencies), 's')]
+    return records
+
+
+def example_arrays(length, seed=0):
+    '''
+    Returns
+    -------
+
+    dict
+        Example arrays of the specified length: `sensor`, a slowly changing
+        noisy signal (as sampled by a 12-bit ADC), and `mask`, a mostly-zero
+        byte mask.
+    '''
+    random = np.random.RandomState(seed)
+    t = np.arange(length)
+    sensor = (2048 + 1000 * np.sin(2 * np.pi * t / 500.) +
+              random.normal(0, 2, length)).astype('int16')
+    mask = np.zeros(length, dtype='uint8')
+    for start in random.randint(0, max(length, 1), 4):
+        mask[start:start + length // 20] = 1
+    return {'sensor': sensor, 'mask': mask}
+
+
+def run_compression(proxy, baud_rate, lengths=(256, 1024), repeats=5):
+    '''
+    Measure effective throughput (raw request and result bytes per second)
+    of array round trips, with and without compression.
+
+    Link settings are negotiated first if the staging buffer size of the
+    device is unknown (compressed requests are decoded to the staging
+    buffer).
+    '''
+    if proxy.staging_size is None:
+        proxy.negotiate_link(cache_path=None)
+    records = [_record('compression', 'baud_limit', None, baud_rate / 10.,
+                       'B/s', True)]
+    for length in lengths:
+        arrays = example_arrays(length)
+        calls = [('sensor', 'scale', (arrays['sensor'], 1)),
+                 ('mask', 'str_echo', (arrays['mask'], ))]
+        for name, method_name, args in calls:
+            raw_bytes = (len(getattr(proxy, '_encode_' + method_name)(*args)) +
+                         args[0].nbytes)
+            for compressed in (False, True):
+                if compressed:
+                    proxy.enable_compression([method_name])
+                try:
+                    method = getattr(proxy, method_name)
+                    duration = timeit.timeit(lambda: method(*args),
+                                             number=repeats) / repeats
+                finally:
+                    proxy.disable_compression()
+                records.append(_record('compression', '%s_%s_throughput' %
+                                       (name, 'compressed' if compressed
+                                        else 'raw'), length,
+                                       raw_bytes / duration, 'B/s', True))
+    return records
+
+
+def compare(records, baseline_records, threshold):
+    '''
+    Returns
+    -------
+
+    list
+        `(record, baseline value, relative change)` of each result which
+        regressed by more than `threshold` (e.g., `0.2` for 20%) relative to
+        the matching baseline result.
+    '''
+    baseline = dict(((record['benchmark'], record['name'],
+                      record['parameter']), record['value'])
+                    for record in baseline_records)
+    regressions = []
+    for record in records:
+        key = record['benchmark'], record['name'], record['parameter']
+        if key not in baseline or not baseline[key]:
+            continue
+        change = (record['value'] - baseline[key]) / baseline[key]
+        if record['higher_is_better']:
+            change = -change
+        if change > threshold:
+            regressions.append((record, baseline[key], change))
+    return regressions
+
+
+def write_results(results, output, format_):
+    if format_ == 'json':
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write('\n')
+    else:
+        writer = csv.DictWriter(output, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for record in results['results']:
+            writer.writerow(record)
+
+
+def read_results(path):
+    '''
+    Read result records from a JSON or CSV result file.
+    '''
+    with open(path) as input_:
+        if path.endswith('.csv'):
+            records = []
+            for row in csv.DictReader(input_):
+                row['value'] = float(row['value'])
+                row['parameter'] = (int(row['parameter'])
+                                    if row['parameter'] else None)
+                row['higher_is_better'] = row['higher_is_better'] == 'True'
+                records.append(row)
+            return records
+        return json.load(input_)['results']
+
+
+def parse_args(args=None):
+    """Parses arguments, returns (options, args)."""
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Run proxy benchmarks and report '
+                            'results as JSON or CSV.')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('port', nargs='?', help='Serial port of device.')
+    target.add_argument('--simulated', action='store_true',
+                        help='Benchmark a simulated device.')
+    parser.add_argument('--proxy-class', help='Dotted path of generated '
+                        '`Proxy` class (e.g., `my_package.node.Proxy`).  '
+                        'Required for a real device.  The proxy must '
+                        'expose `str_echo`, `array_length`, `ram_free`, '
+                        '`set_x` and `scale` methods.')
+    parser.add_argument('-b', '--baudrate', type=int, default=115200,
+                        help='Baud rate (or 0 for no baud rate shaping of a '
+                        'simulated device).')
+    parser.add_argument('--latency-s', type=float, default=0,
+                        help='Processing latency of simulated device.')
+    parser.add_argument('--benchmarks', default='sweep,encode,decode,'
+                        'import,concurrency,settle,priority,compression',
+                        help='Comma-separated benchmarks to run '
+                        '(default=%(default)s).  The `encode`, `decode` and '
+                        '`import` benchmarks require the signature frame of '
+                        'the proxy, so only run against a simulated device.')
+    parser.add_argument('-r', '--repeats', type=int, default=20)
+    parser.add_argument('--byte-counts', default='1,11,21,31,41,51,61',
+                        help='Comma-separated byte counts of sweep.')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='Comma-separated thread counts of concurrency '
+                        'benchmark.')
+    parser.add_argument('-f', '--format', choices=['json', 'csv'],
+                        default=None, help='Output format (default: from '
+                        'output file extension, or json).')
+    parser.add_argument('-o', '--output', help='Output file (default: '
+                        'stdout).')
+    parser.add_argument('--baseline', help='Result file (JSON or CSV) to '
+                        'compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Maximum relative regression from baseline '
+                        '(default=%(default)s).')
+    args = parser.parse_args(args)
+    if args.port and not args.proxy_class:
+        parser.error('--proxy-class is required for a real device.')
+    return args
+
+
+def main(args=None):
+    from serial import Serial
+
+    args = parse_args(args)
+    benchmarks = args.benchmarks.split(',')
+    device = None
+    if args.simulated:
+        from ..simulator import SimulatedDevice
+
+        df_sig_info = example_sig_frame()
+        device = SimulatedDevice(df_sig_info, ExampleNode(),
+                                 baud_rate=args.baudrate or None,
+                                 latency_s=args.latency_s).start()
+        proxy = generate_module(df_sig_info).Proxy()
+        proxy._serial = Serial(device.port_name, baudrate=args.baudrate or
+                               115200)
+        target = 'simulated'
+    else:
+        module_name, class_name = args.proxy_class.rsplit('.', 1)
+        proxy_class = getattr(importlib.import_module(module_name),
+                              class_name)
+        proxy = proxy_class()
+        proxy._serial = Serial(args.port, baudrate=args.baudrate)
+        df_sig_info = None
+        target = args.port
+
+    records = []
+    try:
+        if 'sweep' in benchmarks:
+            records += run_sweep(proxy, byte_counts=[int(n) for n in
+                                                     args.byte_counts
+                                                     .split(',')],
+                                 repeats=args.repeats)
+        if df_sig_info is not None:
+            if 'encode' in benchmarks:
+                records += run_encode(proxy, df_sig_info)
+            if 'decode' in benchmarks:
+                records += run_decode(proxy, df_sig_info)
+            if 'import' in benchmarks:
+                records += run_import(df_sig_info)
+        if 'concurrency' in benchmarks:
+            records += run_concurrency(proxy, thread_counts=[int(n) for n in
+                                                             args.threads
+                                                             .split(',')])
+        if 'settle' in benchmarks:
+            records += run_settle(proxy)
+        if 'priority' in benchmarks:
+            records += run_priority(proxy)
+        if 'compression' in benchmarks:
+            records += run_compression(proxy, args.baudrate or 115200)
+    finally:
+        if device is not None:
+            proxy._serial.close()
+            device.stop()
+
+    from .. import __version__
+
+    results = {'metadata': {'target': target, 'baudrate': args.baudrate,
+                            'version': __version__,
+                            'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'timestamp': dt.datetime.utcnow().isoformat()},
+               'results': records}
+    format_ = args.format
+    if format_ is None:
+        format_ = ('csv' if args.output and args.output.endswith('.csv')
+                   else 'json')
+    if args.output:
+        with open(args.output, 'w') as output:
+            write_results(results, output, format_)
+    else:
+        write_results(results, sys.stdout, format_)
+
+    if args.baseline:
+        regressions = compare(records, read_results(args.baseline),
+                              args.threshold)
+        for record, baseline_value, change in regressions:
+            print('Regression: %s/%s[%s] %.4g %s (baseline %.4g, %+.0f%%)' %
+                  (record['benchmark'], record['name'], record['parameter'],
+                   record['value'], record['unit'], baseline_value,
+                   100 * change), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+from functools import partial
 import sys
 from path_helpers import path
 
@@ -26,6 +27,13 @@ def parse_args(args=None):
     action.add_argument('--cpp', help='Name for C++ command processor class '
                         'in underscore format (e.g., `my_class_name`)',
                         default=None)
+    parser.add_argument('--runtime', choices=('numpy', 'struct'),
+                        default='numpy', help='Runtime of generated Python '
+                        'code: `numpy` arrays, or the standard library only '
+                        '(default=%(default)s).')
+    parser.add_argument('--manifest', type=path, default=None,
+                        help='Also write the signature manifest of the '
+                        'methods to this path (see `arduino_rpc.manifest`).')
 
     args = parser.parse_args()
     if args.out_file.isfile() and not args.force_overwrite:
@@ -38,8 +46,9 @@ if __name__ == '__main__':
     args = parse_args()
 
     if args.python:
-        f_get_code = get_python_code
+        f_get_code = partial(get_python_code, runtime=args.runtime)
     else:
         f_get_code = lambda *args_: get_c_header_code(*(args_ + (args.cpp, )))
 
-    write_code(args.cpp_header, args.class_name, args.out_file, f_get_code)
+    write_code(args.cpp_header, args.class_name, args.out_file, f_get_code,
+               manifest_file=args.manifest)
@@ -0,0 +1,217 @@
+'''
+Cache results of read-only proxy methods (see `ProxyBase.enable_cache`).
+
+The cache policy of a method is `(ttl_s, invalidated_by)`:
+
+ - `ttl_s`: Number of seconds a cached result remains valid (`None` for no
+   expiry).
+ - `invalidated_by`: Names of the methods which invalidate the cached results
+   of the method when called (e.g., the corresponding setters), or `None` to
+   invalidate on a call to any method which is not cached.
+
+The default policy of a generated proxy (i.e., `ProxyCodec._CACHE_POLICY`)
+caches the results of `const` methods of the device class, until any
+non-`const` method is called (see `arduino_rpc.rpc_data_frame
+.get_cache_policy`).
+
+Like call statistics (see `arduino_rpc.stats`), caching wraps methods of a
+proxy *instance*, so a proxy with caching disabled runs exactly the same code
+as before.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import OrderedDict
+import copy
+import threading
+
+from .proxy import _bind, _monotonic
+
+
+class CachedMethod(object):
+    '''
+    Cached results and counters of a single method.
+    '''
+    __slots__ = ('ttl_s', 'results', 'generation', 'hits', 'misses',
+                 'invalidations')
+
+    def __init__(self, ttl_s):
+        self.ttl_s = ttl_s
+        # `(request, (expiry time, result))` of each cached result, least
+        # recently used first.
+        self.results = OrderedDict()
+        # Incremented on each invalidation, so a result requested before an
+        # invalidation (e.g., by another thread) is not cached.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+class ResultCache(object):
+    '''
+    Result cache of a proxy.
+
+    Arguments
+    ---------
+
+     - `policy`: Mapping from method name to `(ttl_s, invalidated_by)`.
+     - `max_results`: Maximum number of cached results (i.e., distinct
+       arguments) per method.
+    '''
+    def __init__(self, policy, max_results=128):
+        self._lock = threading.Lock()
+        self.max_results = max_results
+        self.methods = OrderedDict((name, CachedMethod(ttl_s))
+                                   for name, (ttl_s, invalidated_by) in
+                                   policy.items())
+        # Names of cached methods invalidated by each method (`None` key:
+        # methods invalidated by any method which is not cached).
+        self.invalidates = {}
+        for name, (ttl_s, invalidated_by) in policy.items():
+            for other in (None, ) if invalidated_by is None else invalidated_by:
+                self.invalidates.setdefault(other, []).append(name)
+        self._wrapped = []
+
+    def install(self, proxy):
+        '''
+        Wrap cached methods, and the methods which invalidate them, of proxy
+        instance.
+        '''
+        names = [attr[len('_CMD_'):].lower() for attr in dir(type(proxy))
+                 if attr.startswith('_CMD_')]
+        for name in names:
+            method = getattr(proxy, name, None)
+            if method is None:
+                continue
+            if name in self.methods:
+                self._wrap(proxy, name, self._cached(proxy, name, method))
+                continue
+            targets = (self.invalidates.get(name, []) +
+                       self.invalidates.get(None, []))
+            if not targets:
+                continue
+            # Invalidate when the request is encoded (i.e., before it is
+            # sent) and again once the response is decoded, to discard
+            # results requested (e.g., by another thread) while the call was
+            # in progress.  Wrapping the encoder and decoder also invalidates
+            # on pipelined, batched and future-based calls.  Methods without
+            # arguments send a pre-encoded request, and a call may fail
+            # without a response, so wrap the method too.
+            for prefix, before, after in (('_encode_', True, False),
+                                          ('_decode_', False, True),
+                                          ('', True, True)):
+                self._wrap(proxy, prefix + name,
+                           self._invalidating(getattr(proxy, prefix + name),
+                                              targets, before, after))
+
+    def uninstall(self, proxy):
+        for name, previous in reversed(self._wrapped):
+            if previous is None:
+                proxy.__dict__.pop(name, None)
+            else:
+                setattr(proxy, name, previous)
+        self._wrapped = []
+
+    def _wrap(self, proxy, name, wrapper):
+        # Wrappers installed earlier (e.g., by `enable_stats`) are restored
+        # on `uninstall`.
+        self._wrapped.append((name, proxy.__dict__.get(name)))
+        setattr(proxy, name, wrapper)
+
+    def _cached(self, proxy, name, method):
+        cached = self.methods[name]
+        encode = getattr(proxy, '_encode_' + name)
+        arg_names = proxy._ARG_NAMES.get(name)
+        lock = self._lock
+
+        def _cached_method(*args, **kwargs):
+            if kwargs.get('out') is not None:
+                # Caller provided output buffer; always call the device.
+                return method(*args, **kwargs)
+            arg_kwargs = dict((key, value) for key, value in kwargs.items()
+                              if key not in ('timeout_s', 'out'))
+            if arg_names is None:
+                request = encode(*args, **arg_kwargs)
+            else:
+                request = encode(*_bind(name, arg_names, args, arg_kwargs))
+            now = _monotonic()
+            with lock:
+                entry = cached.results.get(request)
+                if entry is not None and (entry[0] is None or now < entry[0]):
+                    cached.hits += 1
+                    # Copy, so the caller may not modify the cached result
+                    # (e.g., a `numpy` or `array` array).
+                    return copy.copy(entry[1])
+                cached.misses += 1
+                generation = cached.generation
+            result = method(*args, **kwargs)
+            expiry = None if cached.ttl_s is None else now + cached.ttl_s
+            with lock:
+                if cached.generation == generation:
+                    cached.results.pop(request, None)
+                    cached.results[request] = (expiry, copy.copy(result))
+                    while len(cached.results) > self.max_results:
+                        cached.results.popitem(last=False)
+            return result
+        _cached_method.__name__ = method.__name__
+        _cached_method.__doc__ = method.__doc__
+        return _cached_method
+
+    def _invalidating(self, method, targets, before=True, after=True):
+        def _invalidating_method(*args, **kwargs):
+            if before:
+                self.invalidate(targets)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if after:
+                    self.invalidate(targets)
+        _invalidating_method.__name__ = method.__name__
+        _invalidating_method.__doc__ = method.__doc__
+        return _invalidating_method
+
+    def invalidate(self, names=None):
+        '''
+        Discard cached results of the named methods (default: all methods).
+        '''
+        with self._lock:
+            for name in self.methods if names is None else names:
+                cached = self.methods[name]
+                cached.generation += 1
+                if cached.results:
+                    cached.results.clear()
+                    cached.invalidations += 1
+
+    def reset(self):
+        '''
+        Reset hit, miss and invalidation counters.
+        '''
+        with self._lock:
+            for cached in self.methods.values():
+                cached.hits = cached.misses = cached.invalidations = 0
+
+    def to_frame(self):
+        '''
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per cached method, indexed by method name, with time to
+            live, hit, miss and invalidation counts, hit rate and the number
+            of currently cached results.
+        '''
+        import pandas as pd
+
+        rows = []
+        with self._lock:
+            for name, cached in self.methods.items():
+                calls = cached.hits + cached.misses
+                rows.append([cached.ttl_s, cached.hits, cached.misses,
+                             cached.hits / float(calls) if calls
+                             else float('nan'), cached.invalidations,
+                             len(cached.results)])
+        return pd.DataFrame(rows, columns=['ttl_s', 'hits', 'misses',
+                                           'hit_rate', 'invalidations',
+                                           'results'],
+                            index=pd.Index(list(self.methods), name='method'))
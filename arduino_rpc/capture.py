@@ -0,0 +1,268 @@
+'''
+Capture results from a device to disk, with memory use independent of the
+length of the capture.
+
+A capture consists of two files:
+
+ - The data file (`<path>`), holding the raw bytes of each captured array,
+   each padded to a multiple of 8 bytes.  The file is grown in chunks of
+   `chunk_bytes`, and only the chunk currently being written is mapped.
+ - The index file (`<path>.index`), holding one `INDEX_DTYPE` record per
+   captured array: timestamp, command code, dtype, byte offset in the data
+   file, and item count.
+
+Each index record is appended *after* the corresponding data is written, so
+`CaptureReader` may be used (e.g., in another process) while the capture is
+still running.
+
+For example:
+
+    with CaptureWriter('run.bin') as capture:
+        with proxy.stream('analog_read', 0, rate=1000,
+                          block_size=1000) as stream:
+            capture.extend(stream, count=3600)
+
+    reader = CaptureReader('run.bin')
+    samples = reader[0]
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import os
+import time
+
+import numpy as np
+
+
+#: Record of each captured array in the index file.
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('command', '<u2'),
+                        ('dtype', 'S6'), ('offset', '<u8'),
+                        ('count', '<u8')])
+#: Alignment of each captured array in the data file.
+ALIGNMENT = 8
+
+
+def index_path(path):
+    return path + '.index'
+
+
+def command_code(proxy, name):
+    '''
+    Returns
+    -------
+
+    int
+        Command code of named proxy method (or 0 if unknown).
+    '''
+    return getattr(proxy, '_CMD_' + name.upper(), 0)
+
+
+class CaptureWriter(object):
+    '''
+    Append arrays to a capture (see module docstring).
+
+    Arguments
+    ---------
+
+     - `path`: Path of data file.  An existing capture is appended to.
+     - `chunk_bytes`: Number of bytes to grow the data file by (and to map)
+       at a time.
+    '''
+    def __init__(self, path, chunk_bytes=1 << 24):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self._index = open(index_path(path), 'ab')
+        # Resume after the last indexed array (data past it is incomplete).
+        index_size = os.path.getsize(index_path(path))
+        index_size -= index_size % INDEX_DTYPE.itemsize
+        self._index.truncate(index_size)
+        self.length = 0
+        if index_size:
+            with open(index_path(path), 'rb') as index:
+                index.seek(index_size - INDEX_DTYPE.itemsize)
+                last = np.frombuffer(index.read(), dtype=INDEX_DTYPE)[0]
+            self.length = _aligned(int(last['offset']) +
+                                   int(last['count']) *
+                                   np.dtype(last['dtype'].decode()).itemsize)
+        self._data = open(path, 'ab+')
+        self._chunk = None
+        self._chunk_offset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _map_chunk(self, offset):
+        '''
+        Map the chunk of the data file starting at the specified offset,
+        growing the file if necessary.
+        '''
+        if self._chunk is not None:
+            self._chunk.flush()
+            self._chunk = None
+        end = offset + self.chunk_bytes
+        self._data.seek(0, os.SEEK_END)
+        if self._data.tell() < end:
+            self._data.truncate(end)
+        self._chunk = np.memmap(self._data, dtype='uint8', mode='r+',
+                                offset=offset, shape=(self.chunk_bytes, ))
+        self._chunk_offset = offset
+
+    def _write(self, data):
+        offset = self.length
+        position = 0
+        while position < len(data):
+            if (self._chunk is None or not
+                    (self._chunk_offset <= offset <
+                     self._chunk_offset + self.chunk_bytes)):
+                self._map_chunk(offset - offset % self.chunk_bytes)
+            start = offset - self._chunk_offset
+            size = min(len(data) - position, self.chunk_bytes - start)
+            self._chunk[start:start + size] = data[position:position + size]
+            offset += size
+            position += size
+
+    def append(self, array, command=0, timestamp=None):
+        '''
+        Append an array (flattened) to the capture.
+
+        Arguments
+        ---------
+
+         - `array`: Array to append.
+         - `command`: Command code of method which returned the array.
+         - `timestamp`: Time the array was captured (default: now, as seconds
+           since the epoch).
+
+        Returns
+        -------
+
+        int
+            Position of array in the capture.
+        '''
+        array = np.ascontiguousarray(array).ravel()
+        if timestamp is None:
+            timestamp = time.time()
+        self._write(array.view('uint8'))
+        record = np.array((timestamp, command, array.dtype.str, self.length,
+                           array.size), dtype=INDEX_DTYPE)
+        self.length = _aligned(self.length + array.nbytes)
+        # Data must be visible before the index record which refers to it.
+        self._index.write(record.tobytes())
+        self._index.flush()
+        return self._index.tell() // INDEX_DTYPE.itemsize - 1
+
+    def poll(self, proxy, name, *args, **kwargs):
+        '''
+        Call the named proxy method and append the result.
+
+        Returns
+        -------
+
+        Result of method.
+        '''
+        result = getattr(proxy, name)(*args, **kwargs)
+        self.append(result, command_code(proxy, name))
+        return result
+
+    def extend(self, stream, count=None):
+        '''
+        Append each block from a stream (see `ProxyBase.stream`).
+
+        Arguments
+        ---------
+
+         - `stream`: Stream (or any iterable of arrays, in which case the
+           command code is 0).
+         - `count`: Maximum number of blocks to append (default: until the
+           stream is exhausted).
+        '''
+        proxy = getattr(stream, '_proxy', None)
+        command = (0 if proxy is None
+                   else command_code(proxy, stream.name))
+        for i, block in enumerate(stream):
+            self.append(block, command)
+            if count is not None and i + 1 >= count:
+                break
+
+    def flush(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._index.flush()
+
+    def close(self):
+        '''
+        Flush the capture and trim unused space from the data file.
+        '''
+        if self._data.closed:
+            return
+        self.flush()
+        self._chunk = None
+        self._data.truncate(self.length)
+        self._data.close()
+        self._index.close()
+
+
+class CaptureReader(object):
+    '''
+    Read a capture (see module docstring), which may still be running.
+
+    Captured arrays are read-only views of the memory-mapped data file.
+    Arrays appended after the reader is created (or last refreshed) are
+    available after calling `refresh`.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._data = None
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Map arrays appended since the last refresh.
+
+        Returns
+        -------
+
+        int
+            Number of arrays in the capture.
+        '''
+        count = os.path.getsize(index_path(self.path)) // INDEX_DTYPE.itemsize
+        if count != len(self.index):
+            self.index = np.memmap(index_path(self.path), dtype=INDEX_DTYPE,
+                                   mode='r', shape=(count, ))
+            size = os.path.getsize(self.path)
+            if size and (self._data is None or len(self._data) < size):
+                self._data = np.memmap(self.path, dtype='uint8', mode='r')
+        return count
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        record = self.index[i]
+        dtype = np.dtype(record['dtype'].decode())
+        offset = int(record['offset'])
+        return self._data[offset:offset + int(record['count']) *
+                          dtype.itemsize].view(dtype)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def command(self, command):
+        '''
+        Returns
+        -------
+
+        list
+            Arrays captured from the specified command code.
+        '''
+        return [self[i] for i in np.flatnonzero(self.index['command'] ==
+                                                command)]
+
+
+def _aligned(offset):
+    return offset + -offset % ALIGNMENT
@@ -0,0 +1,187 @@
+'''
+Coalesce rapid calls to setters (see `ProxyBase.enable_coalescing`).
+
+A call to a coalesced method (by default, each method which takes arguments
+and returns nothing, e.g., `set_voltage`) returns immediately, and the
+request is queued to be sent by a background thread when the link is free.  A
+queued request replaced by a newer call to the same method is never sent
+(i.e., last write wins), so the device stays at most one request per method
+behind the caller.
+
+Requests are sent in the order of the *last* call to each method.  A call to
+any other method of the proxy first sends all queued requests from the
+calling thread, so reads observe every preceding write.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import OrderedDict
+import threading
+
+from .proxy import _bind
+
+
+class CallCoalescer(object):
+    '''
+    Queue of pending setter requests of a proxy, with at most one request per
+    method.
+
+    Arguments
+    ---------
+
+     - `proxy`: Generated proxy.
+     - `methods`: Names of methods to coalesce (default: each method which
+       takes arguments and returns nothing).
+    '''
+    def __init__(self, proxy, methods=None):
+        self.proxy = proxy
+        if methods is None:
+            methods = [name for name, size in proxy._RESPONSE_SIZES.items()
+                       if size == 0 and
+                       not hasattr(proxy, '_REQUEST_' + name.upper())]
+        self.methods = list(methods)
+        #: Number of calls to coalesced methods.
+        self.calls = 0
+        #: Number of requests sent to the device.
+        self.sent = 0
+        #: Number of requests replaced by a newer call before being sent.
+        self.coalesced = 0
+        #: Exception raised by the last failed background request (raised in
+        #: the calling thread on the next call through the proxy).
+        self.exception = None
+        # `(method name, (request, timeout_s))` of each pending request, in
+        # send order.
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        # Held while a request is sent (by any thread).
+        self._send_lock = threading.RLock()
+        self._stopping = False
+        self._wrapped = []
+        self._thread = threading.Thread(target=self._run,
+                                        name='Call coalescer')
+        self._thread.daemon = True
+
+    def install(self):
+        '''
+        Wrap the methods of the proxy instance and start the send thread.
+        '''
+        proxy = self.proxy
+        names = [attr[len('_CMD_'):].lower() for attr in dir(type(proxy))
+                 if attr.startswith('_CMD_')]
+        for name in names:
+            method = getattr(proxy, name, None)
+            if method is None:
+                continue
+            wrapper = (self._coalesced(name) if name in self.methods
+                       else self._barrier(method))
+            wrapper.__name__ = method.__name__
+            wrapper.__doc__ = method.__doc__
+            # Wrappers installed earlier (e.g., by `enable_cache`) are
+            # restored on `uninstall`.
+            self._wrapped.append((name, proxy.__dict__.get(name)))
+            setattr(proxy, name, wrapper)
+        self._thread.start()
+        return self
+
+    def uninstall(self):
+        '''
+        Send pending requests, stop the send thread and unwrap the methods of
+        the proxy instance.
+        '''
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            for name, previous in self._wrapped:
+                if previous is None:
+                    self.proxy.__dict__.pop(name, None)
+                else:
+                    setattr(self.proxy, name, previous)
+            self._wrapped = []
+
+    def _coalesced(self, name):
+        encode = getattr(self.proxy, '_encode_' + name)
+        arg_names = self.proxy._ARG_NAMES.get(name)
+
+        def _coalesced_method(*args, **kwargs):
+            self._raise_exception()
+            timeout_s = kwargs.pop('timeout_s', None)
+            if arg_names is None:
+                request = encode(*args, **kwargs)
+            else:
+                request = encode(*_bind(name, arg_names, args, kwargs))
+            with self._condition:
+                self.calls += 1
+                if self._pending.pop(name, None) is not None:
+                    self.coalesced += 1
+                self._pending[name] = (request, timeout_s)
+                self._condition.notify_all()
+        return _coalesced_method
+
+    def _barrier(self, method):
+        def _barrier_method(*args, **kwargs):
+            with self._send_lock:
+                self.flush()
+                return method(*args, **kwargs)
+        return _barrier_method
+
+    def _raise_exception(self):
+        exception, self.exception = self.exception, None
+        if exception is not None:
+            raise exception
+
+    def _pop(self):
+        with self._condition:
+            if not self._pending:
+                return None
+            return self._pending.popitem(last=False)
+
+    def _send(self, name, call):
+        request, timeout_s = call
+        decode = getattr(self.proxy, '_decode_' + name)
+        try:
+            self.proxy._call(request, decode, timeout_s=timeout_s)
+        finally:
+            with self._condition:
+                self.sent += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+            with self._send_lock:
+                item = self._pop()
+                if item is None:
+                    continue
+                try:
+                    self._send(*item)
+                except Exception as exception:
+                    self.exception = exception
+
+    def flush(self):
+        '''
+        Send all pending requests from the calling thread.
+
+        Raises the exception of a failed request, if any.
+        '''
+        with self._send_lock:
+            while True:
+                item = self._pop()
+                if item is None:
+                    break
+                self._send(*item)
+        self._raise_exception()
+
+    @property
+    def pending(self):
+        '''
+        Names of methods with a pending request, in send order.
+        '''
+        with self._condition:
+            return list(self._pending)
@@ -26,6 +26,32 @@ PYTHON_GENERATED_WARNING_MESSAGE = '''
 '''
 
 
+def get_const_methods(class_cursor):
+    '''
+    Returns
+    -------
+
+    dict
+        Mapping from the name of each method of a `libclang` class cursor to
+        `True` if the method is `const`-qualified (i.e., does not modify the
+        object), otherwise `False`.  Empty if the version of `libclang` does
+        not expose method qualifiers.
+
+    .. versionadded:: 1.17
+    '''
+    from clang.cindex import CursorKind
+
+    const_methods = {}
+    for child in class_cursor.get_children():
+        if child.kind == CursorKind.CXX_METHOD:
+            try:
+                const_methods[child.spelling] = child.is_const_method()
+            except AttributeError:
+                # `is_const_method` requires `libclang>=3.9`.
+                return {}
+    return const_methods
+
+
 def get_multilevel_method_sig_frame(cpp_header, class_name, *args, **kwargs):
     '''
     Given one or more C++ header paths, each with a corresponding C++ class
@@ -48,6 +74,10 @@ def get_multilevel_method_sig_frame(cpp_header, class_name, *args, **kwargs):
        included in the data frame.  The order is determined by the order of the
        headers and classes provided in the `cpp_header` argument and the
        `class_name` argument, respectively.
+
+    .. versionchanged:: 1.17
+        Add `is_const` column, which is `True` for rows of `const`-qualified
+        methods (see `get_const_methods`).
     '''
     if isinstance(cpp_header, six.string_types):
         cpp_header = [cpp_header]
@@ -73,6 +103,9 @@ def get_multilevel_method_sig_frame(cpp_header, class_name, *args, **kwargs):
 
         frame = get_struct_sig_info_frame(df_sig_info,
                                           pointer_width=pointer_width)
+        frame['is_const'] = (frame.method_name
+                             .map(get_const_methods(node_class))
+                             .fillna(False).astype(bool))
         frame.insert(0, 'header_name', path(header).name)
         frame.insert(1, 'class_name', class_)
         frames.append(frame)
@@ -133,14 +166,28 @@ def write_code(cpp_header, class_name, out_file, f_get_code, *args, **kwargs):
 
          is referenced in the frame with the `class_name` of
          `ClassName<Parameter1,Parameter2>`.
+     - `manifest_file`: Path to also write the signature manifest of the
+       methods to (optional; see `arduino_rpc.manifest`), e.g., to build a
+       proxy at runtime without `libclang`, or to embed in the firmware.
+
+    .. versionchanged:: 1.17
+        Add `manifest_file` keyword argument.
     '''
     methods_filter = kwargs.pop('methods_filter', lambda x: x)
+    manifest_file = kwargs.pop('manifest_file', None)
 
     # Apply filter to methods (accepts all rows by default).
     df_methods = methods_filter(get_multilevel_method_sig_frame(cpp_header,
                                                                 class_name,
                                                                 *args,
                                                                 **kwargs))
+    if manifest_file is not None:
+        from .manifest import get_manifest, write_manifest
+
+        write_manifest(get_manifest(df_methods,
+                                    kwargs.get('pointer_width', 16)),
+                       manifest_file)
+
     if out_file == '-':
         # Write code to `stdout`.
         output = sys.stdout
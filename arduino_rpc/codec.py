@@ -0,0 +1,130 @@
+'''
+Runtime helpers for the request encoders and response decoders of generated
+proxy classes (see `arduino_rpc.rpc_data_frame.get_python_code`).
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import deque
+import threading
+
+import numpy as np
+import six
+
+
+_local = threading.local()
+
+
+def request_buffer(size):
+    '''
+    Return a writable `memoryview` of at least `size` bytes.
+
+    The buffer is reused by every request encoded in the calling thread, so
+    the encoded request must be copied out (e.g., using `.tobytes()`) before
+    the next request is encoded.  Each thread has its own buffer, so requests
+    may be encoded concurrently (e.g., when calls are made from several
+    threads through `ProxyBase.start_io_thread`).
+    '''
+    view = getattr(_local, 'view', None)
+    if view is None or len(view) < size:
+        length = 256 if view is None else len(view)
+        while length < size:
+            length *= 2
+        view = _local.view = memoryview(bytearray(length))
+    return view
+
+
+def as_array(arg, dtype):
+    '''
+    Return a contiguous, one-dimensional array of the specified type.
+
+    Byte strings (and text strings, with one element per character) are
+    converted to one element per byte.  No copy is made if `arg` is already a
+    contiguous array of the specified type.
+    '''
+    if isinstance(arg, (six.binary_type, bytearray)):
+        arg = np.frombuffer(arg, dtype='uint8')
+    elif isinstance(arg, six.text_type):
+        arg = np.frombuffer(arg.encode('latin-1'), dtype='uint8')
+    return np.ascontiguousarray(arg, dtype=dtype).ravel()
+
+
+class BufferPool(object):
+    '''
+    Pool of arrays for decoded responses.
+
+    Arrays returned by `acquire` are taken from the pool if an array of the
+    same type and length was released with `release`, and allocated
+    otherwise.  Releasing arrays which are no longer needed (e.g., in an
+    acquisition loop calling the same method repeatedly) avoids allocating a
+    new array for each response.
+
+    Arguments
+    ---------
+
+     - `max_free`: Maximum number of released arrays kept for each type and
+       length.
+    '''
+    def __init__(self, max_free=4):
+        self.max_free = max_free
+        self._free = {}
+
+    def acquire(self, dtype, length):
+        try:
+            return self._free[(np.dtype(dtype), length)].pop()
+        except (KeyError, IndexError):
+            return np.empty(length, dtype=dtype)
+
+    def release(self, array):
+        '''
+        Return an array to the pool.  The array must not be used after it is
+        released.
+
+        Arrays which do not own their data (e.g., views) are ignored.
+        '''
+        if not (array.ndim == 1 and array.flags.owndata and
+                array.flags.writeable):
+            return
+        free = self._free.setdefault((array.dtype, array.shape[0]), deque())
+        if len(free) < self.max_free:
+            free.append(array)
+
+    def clear(self):
+        self._free.clear()
+
+
+def decode_array(data, dtype, out=None, pool=None):
+    '''
+    Decode an array response.
+
+    Arguments
+    ---------
+
+     - `data`: Response data.
+     - `dtype`: Array element type.
+     - `out`: Array to decode into (optional).  Must have at least as many
+       elements as the response.
+     - `pool`: `BufferPool` to take the result array from if `out` is not
+       specified (optional).
+
+    Returns
+    -------
+
+    numpy.ndarray
+        If `out` is specified, the leading elements of `out` holding the
+        response.  Otherwise, an array from `pool` holding the response, or a
+        read-only view of `data` if `pool` is `None`.
+    '''
+    view = np.frombuffer(data, dtype=dtype)
+    if out is not None:
+        if out.shape[0] < view.shape[0]:
+            raise ValueError('Output array has %d elements, but response has '
+                             '%d elements.' % (out.shape[0], view.shape[0]))
+        out = out[:view.shape[0]]
+        out[...] = view
+        return out
+    elif pool is not None:
+        result = pool.acquire(view.dtype, view.shape[0])
+        result[...] = view
+        return result
+    return view
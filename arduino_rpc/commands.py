@@ -0,0 +1,95 @@
+'''
+Built-in commands handled by the generated `CommandProcessor`.
+
+Command codes of user methods are allocated from zero (see
+`arduino_rpc.code_gen.get_multilevel_method_sig_frame`), so built-in command
+codes are allocated from the top of the 16-bit command code space.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import OrderedDict
+
+
+#: Run several length-prefixed requests in order and return the concatenated
+#: length-prefixed responses in a single packet.
+CMD_BATCH = 0xFFF0
+#: Fragment of a request too long to fit in a single packet.  The device
+#: assembles fragments in a staging buffer (or passes each fragment to a
+#: callback) and processes the complete request with the last fragment.
+CMD_FRAGMENT = 0xFFF1
+#: Start (or stop) pushing the response to a request at a fixed period.
+CMD_STREAM = 0xFFF2
+#: Query serial link settings (e.g., packet size and supported baud rates),
+#: switch baud rate, or echo data to test the link.
+CMD_LINK = 0xFFF3
+#: Request with compressed array data, optionally asking for a compressed
+#: array result (see `arduino_rpc.compression`).
+CMD_ENCODED = 0xFFF4
+#: Read the signature manifest of the device (see `arduino_rpc.manifest`).
+CMD_MANIFEST = 0xFFF5
+
+RESERVED_COMMANDS = OrderedDict([('BATCH', CMD_BATCH),
+                                 ('FRAGMENT', CMD_FRAGMENT),
+                                 ('STREAM', CMD_STREAM),
+                                 ('LINK', CMD_LINK),
+                                 ('ENCODED', CMD_ENCODED),
+                                 ('MANIFEST', CMD_MANIFEST)])
+
+#: Size of batch command code.
+BATCH_HEADER_SIZE = 2
+#: Size of the length prefix of each request/response in a batch.
+BATCH_ITEM_HEADER_SIZE = 2
+#: Response length reported by the device for a batched request which could
+#: not be processed.
+BATCH_ITEM_ERROR = 0xFFFF
+
+#: Size of fragment header: command code, offset of fragment in request
+#: (`uint32_t`), and total request length (`uint32_t`).
+FRAGMENT_HEADER_SIZE = 10
+
+#: Size of stream header: command code, stream ID (`uint16_t`), and push
+#: period in microseconds (`uint32_t`, zero to stop the stream).
+STREAM_HEADER_SIZE = 8
+#: Flag set in the `iuid` of packets pushed by the device (i.e., not in
+#: response to a request).  The remaining bits hold the stream ID.
+PUSH_IUID_FLAG = 0x8000
+
+#: Size of link header: command code and operation (`uint8_t`).
+LINK_HEADER_SIZE = 3
+#: Link operations (see `CMD_LINK`).
+LINK_QUERY = 0
+LINK_SET_BAUD_RATE = 1
+LINK_CONFIRM = 2
+LINK_ECHO = 3
+#: Size of the fixed part of the response to `LINK_QUERY`: packet buffer size
+#: (`uint16_t`), staging buffer size and current baud rate (`uint32_t`
+#: each), followed by the supported baud rates (`uint32_t` each).
+LINK_QUERY_RESPONSE_SIZE = 10
+
+#: Size of encoded request header: command code, type code of array result
+#: to encode (`uint8_t`, zero for none), and length of the request header
+#: (`uint16_t`; command code and request structure) which follows.
+ENCODED_HEADER_SIZE = 5
+#: Size of encoded array segment header: encoding and type code (`uint8_t`
+#: each), decoded and encoded lengths (`uint32_t` each).
+SEGMENT_HEADER_SIZE = 10
+#: Array encodings.
+ENCODING_NONE = 0
+#: Zig-zag varint of the difference from the previous element (integers up
+#: to 32 bits).
+ENCODING_DELTA = 1
+#: Run-length encoded bytes.
+ENCODING_RLE = 2
+#: Response to a request for an encoded result which did not fit in the
+#: buffers of the device.
+ENCODING_OVERFLOW = 0xFF
+#: Flag set in type codes (i.e., element size) of signed integer types.
+TYPE_SIGNED_FLAG = 0x80
+
+#: Size of manifest request: command code and offset of the first manifest
+#: byte to read (`uint32_t`).
+MANIFEST_REQUEST_SIZE = 6
+#: Size of the manifest length (`uint32_t`) preceding the manifest bytes in
+#: each response to `CMD_MANIFEST`.
+MANIFEST_HEADER_SIZE = 4
@@ -0,0 +1,633 @@
+'''
+Compressed array transfers (see `ProxyBase.enable_compression`).
+
+Array data is sent in one of the following encodings, whichever is
+smallest for each array of each call:
+
+ - `ENCODING_NONE`: Raw bytes.
+ - `ENCODING_DELTA`: Each element (integers of up to 32 bits) as the
+   zig-zag encoded difference from the previous element, in LEB128 varint
+   format, e.g., for slowly changing sensor data.
+ - `ENCODING_RLE`: Run-length encoded bytes, e.g., for mostly-zero masks.
+   Each run starts with a control byte `n`: `n < 0x80` is followed by
+   `n + 1` literal bytes, otherwise the next byte is repeated `n - 0x80 + 3`
+   times.
+
+A request with encoded arrays is sent as a `CMD_ENCODED` request:
+
+    uint16_t command;  // `CMD_ENCODED`
+    uint8_t result_type;  // Type code of array result to encode (or zero).
+    uint16_t header_length;
+    uint8_t header[header_length];  // Command code and request structure.
+    // One segment per array argument, in order:
+    uint8_t encoding;
+    uint8_t type;  // Element size (`| TYPE_SIGNED_FLAG` if signed).
+    uint32_t decoded_length;
+    uint32_t encoded_length;
+    uint8_t data[encoded_length];
+
+The generated `CommandProcessor` decodes the request and processes it as
+usual.  If `result_type` is set, the array result is encoded by the device
+and prefixed with its encoding.
+
+Encoders and decoders are vectorized with `numpy` (except for building
+run-length encoded output, which loops over runs and is only done when the
+runs are long enough for the encoding to be chosen).
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from functools import partial
+import struct
+import threading
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+import numpy as np
+
+from .commands import (CMD_ENCODED, ENCODED_HEADER_SIZE, ENCODING_DELTA,
+                       ENCODING_NONE, ENCODING_OVERFLOW, ENCODING_RLE,
+                       SEGMENT_HEADER_SIZE, TYPE_SIGNED_FLAG)
+from .proxy import CommandNackError
+
+
+#: Maximum length of a literal run (RLE).
+MAX_LITERAL_RUN = 0x80
+#: Minimum and maximum lengths of a repeated run (RLE).
+MIN_REPEAT_RUN = 3
+MAX_REPEAT_RUN = 0x7F + MIN_REPEAT_RUN
+#: Maximum number of bytes of a varint encoding a 64-bit value.
+MAX_VARINT_SIZE = 10
+
+_ENCODED_HEADER = struct.Struct('<HBH')
+_SEGMENT_HEADER = struct.Struct('<BBII')
+
+
+class CompressionError(IOError):
+    '''
+    Raised when an encoded request or response is malformed, or when the
+    device could not fit an encoded result in its buffers.
+    '''
+    pass
+
+
+def type_code(dtype):
+    '''
+    Returns
+    -------
+
+    int
+        Type code (element size, with `TYPE_SIGNED_FLAG` set for signed
+        integers) of a `numpy` type.
+    '''
+    dtype = np.dtype(dtype)
+    return dtype.itemsize | (TYPE_SIGNED_FLAG if dtype.kind == 'i' else 0)
+
+
+def _delta_supported(dtype):
+    return dtype.kind in 'iu' and dtype.itemsize <= 4
+
+
+def zigzag_deltas(array):
+    '''
+    Returns
+    -------
+
+    numpy.ndarray
+        Zig-zag encoded (`uint64`) differences between consecutive elements
+        of an integer array (the first element is relative to zero).
+        Differences wrap around at the width of the element type.
+    '''
+    bits = 8 * array.dtype.itemsize
+    values = array.astype('int64')
+    deltas = np.diff(np.concatenate([[0], values]))
+    # Difference modulo element width, as a signed value of that width.
+    half = 1 << (bits - 1)
+    deltas = ((deltas + half) & ((1 << bits) - 1)) - half
+    return ((deltas << 1) ^ (deltas >> 63)).astype('uint64')
+
+
+def varint_sizes(values):
+    '''
+    Returns
+    -------
+
+    numpy.ndarray
+        Number of bytes of the varint encoding of each (`uint64`) value.
+    '''
+    sizes = np.ones(len(values), dtype='int64')
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        sizes += remaining > 0
+        remaining >>= np.uint64(7)
+    return sizes
+
+
+def encode_varints(values, sizes=None):
+    '''
+    Returns
+    -------
+
+    bytes
+        LEB128 varint encoding of each (`uint64`) value.
+    '''
+    if sizes is None:
+        sizes = varint_sizes(values)
+    total = int(sizes.sum())
+    starts = np.cumsum(sizes) - sizes
+    # Index of each output byte within the encoding of its value.
+    position = np.arange(total) - np.repeat(starts, sizes)
+    output = ((np.repeat(values, sizes) >> (7 * position).astype('uint64')) &
+              np.uint64(0x7F)).astype('uint8')
+    output[position < np.repeat(sizes, sizes) - 1] |= 0x80
+    return output.tobytes()
+
+
+def decode_varints(data):
+    '''
+    Returns
+    -------
+
+    numpy.ndarray
+        `uint64` values of a sequence of LEB128 varints.
+    '''
+    data = np.frombuffer(data, dtype='uint8')
+    if not len(data):
+        return np.empty(0, dtype='uint64')
+    ends = np.flatnonzero(data < 0x80)
+    if not len(ends) or ends[-1] != len(data) - 1:
+        raise CompressionError('Truncated varint.')
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    sizes = ends - starts + 1
+    if sizes.max() > MAX_VARINT_SIZE:
+        raise CompressionError('Varint too long.')
+    position = np.arange(len(data)) - np.repeat(starts, sizes)
+    groups = ((data & 0x7F).astype('uint64') <<
+              (7 * position).astype('uint64'))
+    return np.bitwise_or.reduceat(groups, starts)
+
+
+def delta_size(array):
+    '''
+    Returns
+    -------
+
+    int
+        Size of the `ENCODING_DELTA` encoding of an integer array.
+    '''
+    return int(varint_sizes(zigzag_deltas(array)).sum())
+
+
+def encode_delta(array):
+    '''
+    Returns
+    -------
+
+    bytes
+        `ENCODING_DELTA` encoding of an integer array.
+    '''
+    return encode_varints(zigzag_deltas(array))
+
+
+def decode_delta(data, dtype):
+    '''
+    Returns
+    -------
+
+    numpy.ndarray
+        Array of the specified integer type decoded from `ENCODING_DELTA`
+        data.
+    '''
+    zigzag = decode_varints(data).astype('int64')
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    # Sum wraps around at the element width on conversion.
+    return np.cumsum(deltas).astype(dtype)
+
+
+def _runs(data):
+    '''
+    Returns
+    -------
+
+    tuple
+        `(starts, lengths)` of each run of equal bytes.
+    '''
+    data = np.frombuffer(data, dtype='uint8')
+    if not len(data):
+        empty = np.empty(0, dtype='int64')
+        return empty, empty
+    starts = np.concatenate([[0], np.flatnonzero(data[1:] != data[:-1]) + 1])
+    lengths = np.diff(np.append(starts, len(data)))
+    return starts, lengths
+
+
+def _rle_segments(data):
+    '''
+    Returns
+    -------
+
+    tuple
+        `(starts, lengths, repeats)` of each segment (maximal sequence of
+        literal bytes, or repeated run).
+    '''
+    starts, lengths = _runs(data)
+    repeats = lengths >= MIN_REPEAT_RUN
+    # Merge consecutive literal runs into a single segment.
+    new_segment = np.ones(len(starts), dtype=bool)
+    new_segment[1:] = repeats[1:] | repeats[:-1]
+    segment_starts = np.flatnonzero(new_segment)
+    return (starts[segment_starts],
+            np.add.reduceat(lengths, segment_starts) if len(segment_starts)
+            else lengths, repeats[segment_starts])
+
+
+def rle_size(data):
+    '''
+    Returns
+    -------
+
+    int
+        Size of the `ENCODING_RLE` encoding of `data`.
+    '''
+    starts, lengths, repeats = _rle_segments(data)
+    repeat_lengths = lengths[repeats]
+    literal_lengths = lengths[~repeats]
+    return int(2 * (-(-repeat_lengths // MAX_REPEAT_RUN)).sum() +
+               (literal_lengths + -(-literal_lengths //
+                                    MAX_LITERAL_RUN)).sum())
+
+
+def encode_rle(data):
+    '''
+    Returns
+    -------
+
+    bytes
+        `ENCODING_RLE` encoding of `data`.
+    '''
+    data = bytes(data)
+    output = bytearray()
+    for start, length, repeat in zip(*_rle_segments(data)):
+        start = int(start)
+        end = start + int(length)
+        if repeat:
+            value = data[start:start + 1]
+            while start < end:
+                count = min(end - start, MAX_REPEAT_RUN)
+                if 0 < end - start - count < MIN_REPEAT_RUN:
+                    # Leave a long enough remainder for a repeated run.
+                    count = end - start - MIN_REPEAT_RUN
+                output.append(0x80 + count - MIN_REPEAT_RUN)
+                output += value
+                start += count
+        else:
+            for i in range(start, end, MAX_LITERAL_RUN):
+                chunk = data[i:min(i + MAX_LITERAL_RUN, end)]
+                output.append(len(chunk) - 1)
+                output += chunk
+    return bytes(output)
+
+
+def decode_rle(data, length=None):
+    '''
+    Returns
+    -------
+
+    bytes
+        Bytes decoded from `ENCODING_RLE` data.
+    '''
+    data = bytes(data)
+    output = bytearray()
+    i = 0
+    while i < len(data):
+        control = bytearray(data[i:i + 1])[0]
+        i += 1
+        if control < 0x80:
+            count = control + 1
+            if i + count > len(data):
+                raise CompressionError('Truncated literal run.')
+            output += data[i:i + count]
+            i += count
+        else:
+            if i >= len(data):
+                raise CompressionError('Truncated repeated run.')
+            output += data[i:i + 1] * (control - 0x80 + MIN_REPEAT_RUN)
+            i += 1
+    if length is not None and len(output) != length:
+        raise CompressionError('Decoded length mismatch.')
+    return bytes(output)
+
+
+def encode_array(array):
+    '''
+    Encode an array with the encoding giving the smallest output.
+
+    Returns
+    -------
+
+    tuple
+        `(encoding, data)`.
+    '''
+    array = np.ascontiguousarray(array)
+    data = array.tobytes()
+    best = ENCODING_NONE, len(data)
+    if _delta_supported(array.dtype) and len(array):
+        deltas = zigzag_deltas(array)
+        sizes = varint_sizes(deltas)
+        size = int(sizes.sum())
+        if size < best[1]:
+            best = ENCODING_DELTA, size
+    if len(data):
+        size = rle_size(data)
+        if size < best[1]:
+            best = ENCODING_RLE, size
+    encoding = best[0]
+    if encoding == ENCODING_DELTA:
+        return encoding, encode_varints(deltas, sizes)
+    elif encoding == ENCODING_RLE:
+        return encoding, encode_rle(data)
+    return encoding, data
+
+
+def decode_array(encoding, data, dtype, length=None):
+    '''
+    Returns
+    -------
+
+    bytes
+        Raw array bytes decoded from `data`.
+    '''
+    dtype = np.dtype(dtype)
+    if encoding == ENCODING_NONE:
+        decoded = bytes(data)
+    elif encoding == ENCODING_RLE:
+        decoded = decode_rle(data)
+    elif encoding == ENCODING_DELTA:
+        if dtype.kind not in 'iu':
+            # The device only knows the size of array elements (see
+            # `type_code`), so non-integer elements (e.g., of a `float32`
+            # result) are delta encoded as unsigned integers of the same
+            # width.
+            dtype = np.dtype('u%d' % dtype.itemsize)
+        if not _delta_supported(dtype):
+            raise CompressionError('Delta encoding of `%s` not supported.' %
+                                   dtype)
+        decoded = decode_delta(data, dtype).tobytes()
+    else:
+        raise CompressionError('Unknown encoding: %s' % encoding)
+    if length is not None and len(decoded) != length:
+        raise CompressionError('Decoded length mismatch.')
+    return decoded
+
+
+def _type_dtype(type_):
+    size = type_ & ~TYPE_SIGNED_FLAG
+    return np.dtype('%s%d' % ('i' if type_ & TYPE_SIGNED_FLAG else 'u', size))
+
+
+def encode_request(request, array_args, result_type=0):
+    '''
+    Encode the array data of a serialized request.
+
+    Arguments
+    ---------
+
+     - `request`: Serialized request (as returned by a request encoder).
+     - `array_args`: `(offset of length field in request, numpy type)` of
+       each array argument (see `ProxyCodec._ARRAY_ARGS`).
+     - `result_type`: Type code of array result to encode (zero for none).
+
+    Returns
+    -------
+
+    tuple
+        `(payload, decoded_length)`, where `payload` is the `CMD_ENCODED`
+        request payload and `decoded_length` is the length of the request
+        data decoded by the device.
+    '''
+    lengths = [struct.unpack_from('<I', request, offset)[0] *
+               np.dtype(dtype).itemsize for offset, dtype in array_args]
+    header_length = len(request) - sum(lengths)
+    output = [_ENCODED_HEADER.pack(CMD_ENCODED, result_type, header_length),
+              request[:header_length]]
+    start = header_length
+    for length, (offset, dtype) in zip(lengths, array_args):
+        array = np.frombuffer(request, dtype=dtype, count=length //
+                              np.dtype(dtype).itemsize, offset=start)
+        encoding, data = encode_array(array)
+        output += [_SEGMENT_HEADER.pack(encoding, type_code(dtype), length,
+                                        len(data)), data]
+        start += length
+    return b''.join(output), len(request)
+
+
+def decode_request(payload):
+    '''
+    Returns
+    -------
+
+    tuple
+        `(request, result_type)`: decoded request and type code of array
+        result to encode (zero for none).
+    '''
+    command, result_type, header_length = \
+        _ENCODED_HEADER.unpack_from(payload)
+    start = ENCODED_HEADER_SIZE + header_length
+    if start > len(payload):
+        raise CompressionError('Truncated request header.')
+    output = [payload[ENCODED_HEADER_SIZE:start]]
+    while start < len(payload):
+        if start + SEGMENT_HEADER_SIZE > len(payload):
+            raise CompressionError('Truncated segment header.')
+        encoding, type_, decoded_length, encoded_length = \
+            _SEGMENT_HEADER.unpack_from(payload, start)
+        start += SEGMENT_HEADER_SIZE
+        data = payload[start:start + encoded_length]
+        if len(data) < encoded_length:
+            raise CompressionError('Truncated segment.')
+        output.append(decode_array(encoding, data, _type_dtype(type_),
+                                   decoded_length))
+        start += encoded_length
+    return b''.join(output), result_type
+
+
+def encode_result(result, result_type):
+    '''
+    Returns
+    -------
+
+    bytes
+        Array result bytes, encoded with the encoding giving the smallest
+        output and prefixed with the encoding.
+    '''
+    encoding, data = encode_array(np.frombuffer(result,
+                                                dtype=_type_dtype(result_type)))
+    return struct.pack('B', encoding) + data
+
+
+def decode_result(data, dtype):
+    '''
+    Returns
+    -------
+
+    bytes
+        Raw array result bytes decoded from an encoded result.
+    '''
+    if not data:
+        raise CompressionError('Empty encoded result.')
+    encoding = bytearray(data[:1])[0]
+    if encoding == ENCODING_OVERFLOW:
+        raise CompressionError('Encoded result did not fit in the buffers of '
+                               'the device.  Disable compression of the '
+                               'result of this method.')
+    return decode_array(encoding, data[1:], dtype)
+
+
+class MethodCompression(object):
+    '''
+    Byte counters of compressed calls to a single method.
+    '''
+    __slots__ = ('calls', 'encoded_calls', 'request_bytes',
+                 'encoded_request_bytes', 'result_bytes', 'encoded_result_bytes')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class Compressor(object):
+    '''
+    Send array arguments and receive array results of a proxy compressed.
+
+    Arguments
+    ---------
+
+     - `proxy`: Generated proxy.
+     - `methods`: Names of methods to compress (default: each method with an
+       array argument or result).
+     - `results`: If `True`, ask the device to encode array results.
+
+    If the device rejects an encoded request (e.g., the firmware was built
+    without `ENABLE_ENCODED_REQUESTS`), the call is sent uncompressed, and so
+    are later calls (i.e., `rejected` is set).
+    '''
+    def __init__(self, proxy, methods=None, results=True):
+        self.proxy = proxy
+        if methods is None:
+            methods = sorted(set(proxy._ARRAY_ARGS) |
+                             set(proxy._ARRAY_RESULTS))
+        self.results = results
+        self.methods = dict((name, MethodCompression()) for name in methods)
+        self._lock = threading.Lock()
+        self._wrapped = []
+        self.rejected = False
+
+    def install(self):
+        for name in self.methods:
+            method = getattr(self.proxy, name)
+            wrapper = self._compressed(name)
+            wrapper.__name__ = method.__name__
+            wrapper.__doc__ = method.__doc__
+            setattr(self.proxy, name, wrapper)
+            self._wrapped.append(name)
+        return self
+
+    def uninstall(self):
+        for name in self._wrapped:
+            self.proxy.__dict__.pop(name, None)
+        self._wrapped = []
+
+    def _fits(self, payload_length, decoded_length):
+        '''
+        Return `True` if the device has room to decode a request.
+        '''
+        proxy = self.proxy
+        fragmented = (payload_length > proxy.packet_size and payload_length >
+                      proxy._get_max_request_payload_size())
+        if proxy.staging_size:
+            # Decoded to the staging buffer (fragmented requests are decoded
+            # from the end of the staging buffer to its start).
+            return (decoded_length + (payload_length if fragmented else 0) <=
+                    proxy.staging_size)
+        # Decoded from the end of the packet buffer to its start.
+        return (not fragmented and decoded_length + payload_length <=
+                proxy.packet_size)
+
+    def _compressed(self, name):
+        proxy = self.proxy
+        encode = getattr(proxy, '_encode_' + name)
+        decode = getattr(proxy, '_decode_' + name)
+        array_args = proxy._ARRAY_ARGS.get(name, ())
+        result_dtype = (proxy._ARRAY_RESULTS.get(name) if self.results
+                        else None)
+        result_type = 0 if result_dtype is None else type_code(result_dtype)
+        counters = self.methods[name]
+
+        def _decode_result(decode, response):
+            if response.type_ == PACKET_TYPES.NACK:
+                return decode(response)
+            data = response.data()
+            result = decode_result(data, result_dtype)
+            with self._lock:
+                counters.result_bytes += len(result)
+                counters.encoded_result_bytes += len(data)
+            return decode(cPacket(data=result, type_=PACKET_TYPES.DATA))
+
+        def _compressed_method(*args, **kwargs):
+            out = kwargs.pop('out', None)
+            timeout_s = kwargs.pop('timeout_s', None)
+            method_decode = decode if out is None else partial(decode, out=out)
+            request = encode(*args)
+            payload, decoded_length = encode_request(request, array_args,
+                                                     result_type)
+            encoded = (not self.rejected and
+                       (result_type or len(payload) < len(request)) and
+                       self._fits(len(payload), decoded_length))
+            with self._lock:
+                counters.calls += 1
+                counters.request_bytes += len(request)
+                if encoded:
+                    counters.encoded_calls += 1
+                    counters.encoded_request_bytes += len(payload)
+                else:
+                    counters.encoded_request_bytes += len(request)
+            if not encoded:
+                return proxy._call(request, method_decode,
+                                   timeout_s=timeout_s)
+            try:
+                return proxy._call(payload,
+                                   partial(_decode_result, method_decode)
+                                   if result_type else method_decode,
+                                   timeout_s=timeout_s)
+            except CommandNackError:
+                # Device does not handle `CMD_ENCODED` requests.
+                self.rejected = True
+                with self._lock:
+                    counters.encoded_calls -= 1
+                    counters.encoded_request_bytes += (len(request) -
+                                                       len(payload))
+                return proxy._call(request, method_decode,
+                                   timeout_s=timeout_s)
+        return _compressed_method
+
+    def to_frame(self):
+        '''
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per compressed method, with call counts, raw and encoded
+            request and result bytes, and compression ratios (raw bytes per
+            encoded byte).
+        '''
+        import pandas as pd
+
+        columns = list(MethodCompression.__slots__)
+        with self._lock:
+            index = sorted(self.methods)
+            rows = [[getattr(self.methods[name], column)
+                     for column in columns] for name in index]
+        df = pd.DataFrame(rows, columns=columns,
+                          index=pd.Index(index, name='method'))
+        df['request_ratio'] = df.request_bytes / df.encoded_request_bytes
+        df['result_ratio'] = df.result_bytes / df.encoded_result_bytes
+        return df
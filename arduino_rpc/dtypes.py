@@ -41,3 +41,19 @@ NP_STD_INT_TYPE = pd.Series(OrderedDict([
     ('uint32_t', 'uint32'),
     ('uint64_t', 'uint64'),
     ('uint16_t', 'uint16')]))
+
+
+#: `struct` module format character for each numpy atom type (standard sizes,
+#: i.e., for use with a `<` byte order prefix).
+NP_STRUCT_FORMATS = pd.Series(OrderedDict([
+    ('int8', 'b'),
+    ('uint8', 'B'),
+    ('int16', 'h'),
+    ('uint16', 'H'),
+    ('int32', 'i'),
+    ('uint32', 'I'),
+    ('int64', 'q'),
+    ('uint64', 'Q'),
+    ('float32', 'f'),
+    ('float64', 'd'),
+]))
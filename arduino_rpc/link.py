@@ -0,0 +1,285 @@
+'''
+Negotiate serial link settings with a device (see
+`ProxyBase.negotiate_link`).
+
+Using the built-in `CMD_LINK` command, the host:
+
+ 1. Queries the packet buffer size, staging buffer size and supported baud
+    rates of the device, and sets the packet and staging buffer sizes of the
+    proxy accordingly.
+ 2. Switches both sides to the fastest supported baud rate (fastest first)
+    which passes an echo test, and confirms the baud rate to the device.  A
+    device restores the previous baud rate if a new baud rate is not
+    confirmed within `LINK_CONFIRM_TIMEOUT_US`, so a failed test leaves both
+    sides at the previous baud rate.
+ 3. Optionally (i.e., if a `cache_path` is given), caches the negotiated
+    settings per device serial number, so the next connection to the same
+    device switches directly to the cached baud rate.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import json
+import os
+import struct
+import time
+
+from nadamq.NadaMq import PACKET_TYPES
+
+from .commands import (CMD_LINK, LINK_CONFIRM, LINK_ECHO, LINK_HEADER_SIZE,
+                       LINK_QUERY, LINK_QUERY_RESPONSE_SIZE,
+                       LINK_SET_BAUD_RATE)
+
+
+#: Suggested path of negotiated link settings cache (see `negotiate_link`).
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                                  'arduino_rpc', 'link.json')
+#: Time (in seconds) the device waits for a new baud rate to be confirmed
+#: (i.e., the default `LINK_CONFIRM_TIMEOUT_US` of the generated
+#: `CommandProcessor`).
+LINK_CONFIRM_TIMEOUT_S = 0.5
+
+
+class LinkError(IOError):
+    '''
+    Raised when the device rejects a link request (e.g., the device does not
+    support `CMD_LINK`, or does not support the requested baud rate).
+    '''
+    pass
+
+
+class LinkSettings(object):
+    '''
+    Serial link settings of a device.
+    '''
+    __slots__ = ('packet_size', 'staging_size', 'baud_rate', 'baud_rates')
+
+    def __init__(self, packet_size, staging_size, baud_rate, baud_rates):
+        self.packet_size = packet_size
+        self.staging_size = staging_size
+        self.baud_rate = baud_rate
+        self.baud_rates = list(baud_rates)
+
+    def __repr__(self):
+        return ('LinkSettings(packet_size=%s, staging_size=%s, baud_rate=%s, '
+                'baud_rates=%s)' % (self.packet_size, self.staging_size,
+                                    self.baud_rate, self.baud_rates))
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+def encode_link_request(operation, data=b''):
+    '''
+    Returns
+    -------
+
+    bytes
+        `CMD_LINK` request payload.
+    '''
+    return struct.pack('<HB', CMD_LINK, operation) + data
+
+
+def _link_call(proxy, operation, data=b'', timeout_s=None):
+    def _decode(response):
+        if response.type_ == PACKET_TYPES.NACK:
+            raise LinkError('Device rejected link request.')
+        return response.data()
+    return proxy._call(encode_link_request(operation, data), _decode,
+                       timeout_s=timeout_s)
+
+
+def query_link(proxy, timeout_s=None):
+    '''
+    Returns
+    -------
+
+    LinkSettings
+        Link settings reported by the device.  The `baud_rate` is the baud
+        rate of the device (as set by `CommandProcessor::set_baud_rates`), or
+        zero if unknown.
+    '''
+    data = _link_call(proxy, LINK_QUERY, timeout_s=timeout_s)
+    if len(data) < LINK_QUERY_RESPONSE_SIZE:
+        raise LinkError('Link query response too short.')
+    packet_size, staging_size, baud_rate = struct.unpack_from('<HII', data)
+    count = (len(data) - LINK_QUERY_RESPONSE_SIZE) // 4
+    baud_rates = struct.unpack_from('<%dI' % count, data,
+                                    LINK_QUERY_RESPONSE_SIZE)
+    return LinkSettings(packet_size, staging_size, baud_rate, baud_rates)
+
+
+def device_serial_number(port):
+    '''
+    Returns
+    -------
+
+    str
+        USB serial number of the device connected to a serial port (or the
+        port name, if the serial number is not available).
+    '''
+    name = getattr(port, 'port', None) or getattr(port, 'name', None)
+    try:
+        from serial.tools.list_ports import comports
+
+        for info in comports():
+            if info.device == name and info.serial_number:
+                return info.serial_number
+    except ImportError:
+        pass
+    return name
+
+
+def _reset_receiver(proxy):
+    '''
+    Discard received bytes (e.g., garbled by a baud rate mismatch).
+
+    Uses the resync path of the proxy, which clears the receiver in place
+    (rather than replacing it), and leaves received bytes alone while other
+    calls await a response or the I/O thread owns the serial port.
+    '''
+    proxy._resync()
+
+
+def set_baud_rate(proxy, baud_rate, echo_size=None, timeout_s=0.2,
+                  confirm_timeout_s=LINK_CONFIRM_TIMEOUT_S):
+    '''
+    Switch the device and the serial port of a proxy to a baud rate, and
+    confirm the baud rate to the device if a packet echoed at the new baud
+    rate is received intact.
+
+    Arguments
+    ---------
+
+     - `baud_rate`: Baud rate supported by the device.
+     - `echo_size`: Number of bytes to echo (default: fill a packet, up to
+       256 bytes).
+     - `timeout_s`: Seconds to wait for each response.
+     - `confirm_timeout_s`: Seconds the device waits for confirmation before
+       restoring the previous baud rate.
+
+    Returns
+    -------
+
+    bool
+        `True` if both sides switched to the baud rate.  Otherwise, both
+        sides are at the previous baud rate.
+    '''
+    port = proxy._serial
+    previous_baud_rate = port.baudrate
+    try:
+        _link_call(proxy, LINK_SET_BAUD_RATE, struct.pack('<I', baud_rate),
+                   timeout_s=timeout_s)
+    except IOError:
+        return False
+    # Give the device time to switch after writing the response.
+    time.sleep(0.01)
+    port.baudrate = baud_rate
+    _reset_receiver(proxy)
+    if echo_size is None:
+        echo_size = min(proxy.packet_size, 256) - LINK_HEADER_SIZE
+    # Pattern exercising every bit of each byte.
+    echo_data = bytes(bytearray((i * 37 + 0x55) & 0xFF
+                                for i in range(echo_size)))
+    try:
+        if _link_call(proxy, LINK_ECHO, echo_data,
+                      timeout_s=timeout_s) != echo_data:
+            raise LinkError('Echo test failed.')
+        _link_call(proxy, LINK_CONFIRM, timeout_s=timeout_s)
+        return True
+    except IOError:
+        # Wait for the device to restore the previous baud rate.
+        port.baudrate = previous_baud_rate
+        time.sleep(confirm_timeout_s + timeout_s)
+        _reset_receiver(proxy)
+        return False
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path) as input_:
+            return json.load(input_)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_cache(cache_path, cache):
+    directory = os.path.dirname(cache_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(cache_path, 'w') as output:
+        json.dump(cache, output, indent=2, sort_keys=True)
+
+
+def _apply_settings(proxy, settings):
+    proxy.packet_size = settings.packet_size
+    proxy.max_request_payload_size = settings.packet_size
+    proxy.staging_size = settings.staging_size
+
+
+def negotiate_link(proxy, baud_rates=None, cache_path=None,
+                   timeout_s=0.2, confirm_timeout_s=LINK_CONFIRM_TIMEOUT_S):
+    '''
+    Negotiate packet size and baud rate with the device of a proxy.
+
+    Arguments
+    ---------
+
+     - `baud_rates`: Baud rates supported by the host (default: any baud
+       rate supported by the device).
+     - `cache_path`: Path of negotiated settings cache (e.g.,
+       `DEFAULT_CACHE_PATH`), or `None` (default) to disable caching.
+     - `timeout_s`: Seconds to wait for each response.
+     - `confirm_timeout_s`: Seconds the device waits for confirmation of a
+       new baud rate (i.e., `LINK_CONFIRM_TIMEOUT_US`).
+
+    Returns
+    -------
+
+    LinkSettings or None
+        Negotiated settings, or `None` if the device does not support
+        `CMD_LINK`.  In that case, only the maximum request payload size of
+        the proxy is set, from the `max_payload_size` method of the device
+        (if any).
+    '''
+    port = proxy._serial
+    kwargs = dict(timeout_s=timeout_s, confirm_timeout_s=confirm_timeout_s)
+    defaults = (proxy.packet_size, proxy.max_request_payload_size,
+                proxy.staging_size)
+    serial_number = None
+    cache = {}
+    if cache_path is not None:
+        serial_number = device_serial_number(port)
+        cache = _read_cache(cache_path)
+        cached = cache.get(serial_number)
+        if cached is not None:
+            settings = LinkSettings(**cached)
+            _apply_settings(proxy, settings)
+            if (settings.baud_rate == port.baudrate or
+                    set_baud_rate(proxy, settings.baud_rate, **kwargs)):
+                return settings
+
+    try:
+        settings = query_link(proxy, timeout_s=timeout_s)
+    except IOError:
+        _reset_receiver(proxy)
+        (proxy.packet_size, proxy.max_request_payload_size,
+         proxy.staging_size) = defaults
+        if hasattr(proxy, 'max_payload_size'):
+            proxy.max_request_payload_size = \
+                int(proxy.max_payload_size(timeout_s=timeout_s))
+        return None
+    _apply_settings(proxy, settings)
+    candidates = sorted((baud_rate for baud_rate in settings.baud_rates
+                         if baud_rate > port.baudrate and
+                         (baud_rates is None or baud_rate in baud_rates)),
+                        reverse=True)
+    for baud_rate in candidates:
+        if set_baud_rate(proxy, baud_rate, **kwargs):
+            break
+    settings.baud_rate = port.baudrate
+
+    if cache_path is not None:
+        cache[serial_number] = settings.to_dict()
+        _write_cache(cache_path, cache)
+    return settings
@@ -0,0 +1,487 @@
+'''
+Compact signature manifest of a device, and proxy classes built from a
+manifest at runtime.
+
+Generating a proxy module requires `libclang`, the C++ headers of the device
+and `pandas` (see `arduino_rpc.code_gen.get_multilevel_method_sig_frame`).
+A manifest is a compact JSON document with everything a proxy needs: the
+command code, argument names, types and request structure layout of each
+method, the pointer width of the device, and the cache and retry policies.
+It is written alongside the generated code (see
+`arduino_rpc.code_gen.write_code`), and may also be embedded in the firmware
+(see `get_c_commands_header_code(..., manifest=...)`) and read from the
+device with the built-in `CMD_MANIFEST` command.
+
+`proxy_class` builds a proxy class from a manifest in milliseconds, without
+`libclang`, `pandas` or `jinja2`:
+
+    from arduino_rpc.manifest import load_manifest, proxy_class
+
+    Proxy = proxy_class(load_manifest('device.json'))
+
+or, for a device serving its own manifest:
+
+    from arduino_rpc.manifest import connect
+
+    proxy = connect(serial.Serial(port, baudrate=115200))
+
+For example, the manifest entry of a method `int32_t add(int16_t a, int16_t
+b)` (command code 2) is:
+
+    {"name":"add","command":2,"format":"<Hhh",
+     "args":[["a","int16",0,"h"],["b","int16",0,"h"]],
+     "returns":["int32",0,"i"]}
+
+where each argument is `[name, numpy type, ndims, struct format]`, and
+`format` is the `struct` format of the command code followed by the request
+structure (see `arduino_rpc.rpc_data_frame.get_request_layouts`).
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import OrderedDict
+from functools import partial
+import json
+import struct
+import sys
+
+from nadamq.NadaMq import PACKET_TYPES
+import six
+
+from .commands import CMD_MANIFEST, MANIFEST_HEADER_SIZE
+from .proxy import CommandNackError, _bind
+
+
+#: Version of the manifest format.
+MANIFEST_VERSION = 1
+
+_MANIFEST_HEADER = struct.Struct('<I')
+
+
+class ManifestError(IOError):
+    '''
+    Raised when a manifest cannot be read from a device (e.g., the firmware
+    does not embed a manifest).
+    '''
+    pass
+
+
+def get_manifest(df_sig_info, pointer_width=16, cache_policy=None,
+                 idempotent=None):
+    '''
+    Arguments
+    ---------
+
+     - `df_sig_info`: Method signature frame (as returned by
+       `arduino_rpc.code_gen.get_multilevel_method_sig_frame`).
+     - `pointer_width`: Pointer width of the device, in bits.
+     - `cache_policy`: See `arduino_rpc.rpc_data_frame.get_cache_policy`.
+     - `idempotent`: See `arduino_rpc.rpc_data_frame.get_idempotent_methods`.
+
+    Returns
+    -------
+
+    OrderedDict
+        Signature manifest of the methods in `df_sig_info`.
+    '''
+    from .dtypes import NP_STRUCT_FORMATS
+    from .rpc_data_frame import (get_cache_policy, get_idempotent_methods,
+                                 get_request_layouts)
+
+    layouts = get_request_layouts(df_sig_info, pointer_width)
+    methods = []
+    for (method_i, method_name), df_method_i in (df_sig_info
+                                                 .groupby(['method_i',
+                                                           'method_name'])):
+        row = df_method_i.iloc[0]
+        args = []
+        if row.arg_count > 0:
+            args = [[arg_i.arg_name, arg_i.atom_np_type, int(arg_i.ndims),
+                     NP_STRUCT_FORMATS[arg_i.atom_np_type]]
+                    for i, arg_i in df_method_i.iterrows()]
+        returns = None
+        if row.return_atom_type is not None:
+            returns = [row.return_atom_np_type, int(row.return_ndims),
+                       NP_STRUCT_FORMATS[row.return_atom_np_type]]
+        methods.append(OrderedDict([('name', method_name),
+                                    ('command', int(method_i)),
+                                    ('format', layouts[method_name]
+                                     ['struct_format']),
+                                    ('args', args), ('returns', returns)]))
+    policy = OrderedDict()
+    cache_policy = get_cache_policy(df_sig_info, cache_policy)
+    for name, (ttl_s, invalidated_by) in cache_policy.items():
+        policy[name] = [ttl_s, None if invalidated_by is None
+                        else list(invalidated_by)]
+    return OrderedDict([('version', MANIFEST_VERSION),
+                        ('pointer_width', pointer_width),
+                        ('methods', methods), ('cache_policy', policy),
+                        ('idempotent', get_idempotent_methods(df_sig_info,
+                                                              idempotent))])
+
+
+def dumps_manifest(manifest):
+    '''
+    Returns
+    -------
+
+    str
+        Compact JSON encoding of a manifest.
+    '''
+    return json.dumps(manifest, separators=(',', ':'))
+
+
+def loads_manifest(data):
+    '''
+    Returns
+    -------
+
+    dict
+        Manifest decoded from JSON text (or UTF-8 encoded bytes).
+    '''
+    if isinstance(data, (six.binary_type, bytearray)):
+        data = bytes(data).decode('utf8')
+    manifest = json.loads(data, object_pairs_hook=OrderedDict)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError('Unsupported manifest version `%s`.' %
+                         manifest.get('version'))
+    return manifest
+
+
+def write_manifest(manifest, path):
+    with open(path, 'w') as output:
+        output.write(dumps_manifest(manifest))
+
+
+def load_manifest(path):
+    with open(path, 'rb') as input_:
+        return loads_manifest(input_.read())
+
+
+def fetch_manifest(proxy, timeout_s=None):
+    '''
+    Read the manifest embedded in the firmware of a device, using the
+    built-in `CMD_MANIFEST` command.
+
+    Arguments
+    ---------
+
+     - `proxy`: Proxy connected to the device (any `ProxyBase` instance).
+     - `timeout_s`: Seconds to wait for each response (optional).
+
+    Returns
+    -------
+
+    dict
+        Manifest of the device.
+    '''
+    def _decode(response):
+        if response.type_ == PACKET_TYPES.NACK:
+            raise ManifestError('Device does not serve a manifest.')
+        data = response.data()
+        if len(data) < MANIFEST_HEADER_SIZE:
+            raise ManifestError('Manifest response too short.')
+        return data
+
+    chunks = []
+    offset = 0
+    while True:
+        data = proxy._call(struct.pack('<HI', CMD_MANIFEST, offset), _decode,
+                           timeout_s=timeout_s)
+        length = _MANIFEST_HEADER.unpack_from(data)[0]
+        chunk = data[MANIFEST_HEADER_SIZE:]
+        chunks.append(chunk)
+        offset += len(chunk)
+        if offset >= length:
+            break
+        elif not chunk:
+            raise ManifestError('Manifest read stopped at byte %d of %d.' %
+                                (offset, length))
+    return loads_manifest(b''.join(chunks)[:length])
+
+
+def _translate(arg):
+    # Serialize protocol buffer messages (as in generated modules).
+    message = sys.modules.get('google.protobuf.message')
+    if message is not None and isinstance(arg, message.Message):
+        return arg.SerializeToString()
+    return arg
+
+
+class _Runtime(object):
+    '''
+    Array conversions of a runtime (see `get_python_code(..., runtime=...)`).
+    '''
+    def __init__(self, runtime):
+        if runtime == 'numpy':
+            import numpy as np
+
+            from .codec import as_array, decode_array
+
+            self.to_array = lambda arg, np_type, format_: as_array(arg,
+                                                                   np_type)
+            self.to_bytes = lambda array_: array_.tobytes()
+            self.decode_array = \
+                lambda self_, data, np_type, format_, out: \
+                decode_array(data, np_type, out=out,
+                             pool=getattr(self_, 'buffer_pool', None))
+            self.decode_scalar = \
+                lambda data, np_type, format_: np.frombuffer(data,
+                                                             dtype=np_type)[0]
+        elif runtime == 'struct':
+            from .struct_codec import array_bytes, pack_array, unpack_array
+
+            self.to_array = lambda arg, np_type, format_: pack_array(arg,
+                                                                     format_)
+            self.to_bytes = array_bytes
+            self.decode_array = \
+                lambda self_, data, np_type, format_, out: \
+                unpack_array(data, format_, out=out)
+            self.decode_scalar = None
+        else:
+            raise ValueError('Unknown runtime `%s`.' % runtime)
+
+
+def _codec_attrs(method, runtime):
+    # Command code, request encoder and response decoder of a method.
+    name = method['name']
+    command = method['command']
+    attrs = {'_CMD_' + name.upper(): command}
+    args = method['args']
+    request_struct = struct.Struct(str(method['format']))
+
+    if not args:
+        request = struct.pack('<H', command)
+        attrs['_REQUEST_' + name.upper()] = request
+
+        def _encode(self):
+            return request
+    elif not any(ndims for arg_name, np_type, ndims, format_ in args):
+        attrs['_STRUCT_' + name.upper()] = request_struct
+        converters = [int if format_ in 'bBhHiIqQ' else float
+                      for arg_name, np_type, ndims, format_ in args]
+        pack = request_struct.pack
+
+        def _encode(self, *values):
+            try:
+                return pack(command, *values)
+            except struct.error:
+                # Truncate floats passed for integer arguments (as generated
+                # encoders do).
+                return pack(command, *[convert(value) for convert, value in
+                                       zip(converters, values)])
+    else:
+        attrs['_STRUCT_' + name.upper()] = request_struct
+        pack = request_struct.pack
+        arg_struct_size = request_struct.size - 2
+        to_array = runtime.to_array
+        to_bytes = runtime.to_bytes
+        converters = [None if ndims else
+                      (int if format_ in 'bBhHiIqQ' else float)
+                      for arg_name, np_type, ndims, format_ in args]
+
+        def _encode(self, *values):
+            fields = []
+            arrays = []
+            # Array data follows the request structure; offsets are relative
+            # to the start of the request structure.
+            offset = arg_struct_size
+            for (arg_name, np_type, ndims, format_), convert, value in \
+                    zip(args, converters, values):
+                if convert is None:
+                    array_ = to_array(_translate(value), np_type, format_)
+                    fields += [len(array_), offset]
+                    offset += len(array_) * array_.itemsize
+                    arrays.append(to_bytes(array_))
+                else:
+                    fields.append(convert(value))
+            return b''.join([pack(command, *fields)] + arrays)
+
+    returns = method['returns']
+    nack_message = 'Device rejected `%s` request.' % name
+    if returns is None:
+        def _decode(self, response):
+            if response.type_ == PACKET_TYPES.NACK:
+                raise CommandNackError(nack_message)
+            return None
+    elif returns[1] > 0:
+        np_type, ndims, format_ = returns
+        decode_array = runtime.decode_array
+
+        def _decode(self, response, out=None):
+            if response.type_ == PACKET_TYPES.NACK:
+                raise CommandNackError(nack_message)
+            return decode_array(self, response.data(), np_type, format_, out)
+    elif runtime.decode_scalar is None:
+        result_struct = struct.Struct('<' + str(returns[2]))
+        attrs['_RESULT_' + name.upper()] = result_struct
+        unpack_from = result_struct.unpack_from
+
+        def _decode(self, response):
+            if response.type_ == PACKET_TYPES.NACK:
+                raise CommandNackError(nack_message)
+            return unpack_from(response.data())[0]
+    else:
+        np_type, ndims, format_ = returns
+        decode_scalar = runtime.decode_scalar
+
+        def _decode(self, response):
+            if response.type_ == PACKET_TYPES.NACK:
+                raise CommandNackError(nack_message)
+            return decode_scalar(response.data(), np_type, format_)
+
+    _encode.__name__ = str('_encode_' + name)
+    _decode.__name__ = str('_decode_' + name)
+    attrs[_encode.__name__] = _encode
+    attrs[_decode.__name__] = _decode
+    return attrs
+
+
+def _method(method):
+    # Public method of the proxy class, calling the encoder and decoder of
+    # the (proxy) instance, so instance wrappers (e.g., `enable_stats`)
+    # apply.
+    name = method['name']
+    arg_names = tuple(arg[0] for arg in method['args'])
+    returns_array = method['returns'] is not None and method['returns'][1] > 0
+    encode_name = '_encode_' + name
+    decode_name = '_decode_' + name
+
+    if not arg_names:
+        request_name = '_REQUEST_' + name.upper()
+
+        def _proxy_method(self, timeout_s=None, out=None):
+            packet = self._command_packet(getattr(self, request_name))
+            response = self._send_command(packet, timeout_s=timeout_s)
+            if out is None:
+                return getattr(self, decode_name)(response)
+            return getattr(self, decode_name)(response, out=out)
+    else:
+        def _proxy_method(self, *args, **kwargs):
+            timeout_s = kwargs.pop('timeout_s', None)
+            out = kwargs.pop('out', None) if returns_array else None
+            args = _bind(name, arg_names, args, kwargs)
+            decode = getattr(self, decode_name)
+            if out is not None:
+                decode = partial(decode, out=out)
+            return self._call(getattr(self, encode_name)(*args), decode,
+                              timeout_s=timeout_s)
+
+    _proxy_method.__name__ = str(name)
+    _proxy_method.__doc__ = '%s(%s)' % (name, ', '.join(
+        arg_names + ('timeout_s=None', ) +
+        (('out=None', ) if returns_array else ())))
+    return _proxy_method
+
+
+def proxy_class(manifest, runtime='numpy', name='Proxy', base=None):
+    '''
+    Build a proxy class from a manifest.
+
+    The class has the same methods (and the same request encoders, response
+    decoders and policies) as the `Proxy` class of a module generated for
+    the device with `arduino_rpc.rpc_data_frame.get_python_code`.  Its
+    `ProxyCodec` base class holds the command codes, encoders and decoders.
+
+    Arguments
+    ---------
+
+     - `manifest`: Manifest (see `get_manifest`), or path to a manifest
+       file.
+     - `runtime`: `'numpy'` or `'struct'` (see `get_python_code`).
+     - `name`: Name of the class.
+     - `base`: Proxy base class (default: `arduino_rpc.proxy.ProxyBase`).
+
+    Returns
+    -------
+
+    type
+        Proxy class.
+    '''
+    if isinstance(manifest, six.string_types):
+        manifest = load_manifest(manifest)
+    if base is None:
+        from .proxy import ProxyBase as base
+
+    runtime_ = _Runtime(runtime)
+    methods = manifest['methods']
+    cache_policy = {}
+    for method_name, (ttl_s, invalidated_by) in (manifest['cache_policy']
+                                                 .items()):
+        cache_policy[method_name] = (ttl_s, None if invalidated_by is None
+                                     else tuple(invalidated_by))
+    codec_attrs = {
+        '__doc__': 'Command codes, request encoders, and response decoders '
+        'built from a manifest.',
+        'MAX_COMMAND_CODE': max([method['command'] for method in methods] or
+                                [0]),
+        '_RESPONSE_SIZES': {},
+        '_CACHE_POLICY': cache_policy,
+        '_ARRAY_ARGS': {},
+        '_ARRAY_RESULTS': {},
+        '_ARG_NAMES': {},
+        '_IDEMPOTENT_METHODS': tuple(manifest['idempotent']),
+        'manifest': manifest}
+    pointer_size = struct.calcsize('<' + {16: 'H', 32: 'I', 64: 'Q'}
+                                   [manifest['pointer_width']])
+    proxy_attrs = {'__module__': __name__}
+    for method in methods:
+        method_name = method['name']
+        codec_attrs.update(_codec_attrs(method, runtime_))
+        proxy_attrs[method_name] = _method(method)
+        codec_attrs['_ARG_NAMES'][method_name] = tuple(arg[0] for arg in
+                                                       method['args'])
+        returns = method['returns']
+        if returns is None:
+            codec_attrs['_RESPONSE_SIZES'][method_name] = 0
+        elif returns[1] > 0:
+            codec_attrs['_RESPONSE_SIZES'][method_name] = None
+            codec_attrs['_ARRAY_RESULTS'][method_name] = returns[0]
+        else:
+            codec_attrs['_RESPONSE_SIZES'][method_name] = \
+                struct.calcsize('<' + str(returns[2]))
+        # Offset of the length field of each array argument in the request.
+        offset = 2
+        array_args = []
+        for arg_name, np_type, ndims, format_ in method['args']:
+            if ndims > 0:
+                array_args.append((offset, np_type))
+                offset += 4 + pointer_size
+            else:
+                offset += struct.calcsize('<' + str(format_))
+        if array_args:
+            codec_attrs['_ARRAY_ARGS'][method_name] = tuple(array_args)
+    codec = type(str('ProxyCodec'), (object, ), codec_attrs)
+    return type(str(name), (codec, base), proxy_attrs)
+
+
+def connect(port, manifest=None, runtime='numpy', base=None, timeout_s=1.0):
+    '''
+    Connect a proxy, built from a manifest, to a device.
+
+    Arguments
+    ---------
+
+     - `port`: Open serial port (e.g., `serial.Serial`) connected to the
+       device.
+     - `manifest`: Manifest, or path to a manifest file (default: read the
+       manifest from the device; see `fetch_manifest`).
+     - `runtime`, `base`: See `proxy_class`.
+     - `timeout_s`: Seconds to wait for each manifest response.
+
+    Returns
+    -------
+
+    ProxyBase
+        Proxy instance.
+    '''
+    if base is None:
+        from .proxy import ProxyBase as base
+
+    if manifest is None:
+        bootstrap = base()
+        bootstrap._serial = port
+        manifest = fetch_manifest(bootstrap, timeout_s=timeout_s)
+    proxy = proxy_class(manifest, runtime=runtime, base=base)()
+    proxy._serial = port
+    return proxy
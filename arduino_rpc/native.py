@@ -0,0 +1,385 @@
+'''
+Compile the generated C++ `CommandProcessor` for the host, and call it through
+`ctypes`.
+
+The generated `Commands.h` and `CommandProcessor.h` headers are compiled
+together with the user class into a shared library exposing a C entry point
+to `process_command`, e.g., to:
+
+ - Measure the cost of dispatching, decoding and responding to each command
+   (see `NativeCommandProcessor.time_command`), without a board.
+ - Test a proxy against the real C++ command processor, in-process (see
+   `NativeLoopbackPort`).
+
+Note that requests must be encoded for the pointer width of the *host*
+(e.g., `get_python_code(df_sig_info, pointer_width=NATIVE_POINTER_WIDTH)`).
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import ctypes
+import os
+import subprocess as sp
+import threading
+
+from nadamq.NadaMq import PACKET_TYPES
+import jinja2
+import six
+
+from .commands import PUSH_IUID_FLAG
+from .packet_stream import AssembledPacket, PacketReceiver
+from .proxy import _monotonic
+from .rpc_data_frame import (get_c_commands_header_code,
+                             get_c_command_processor_header_code)
+from .trace import _encode_response
+
+
+#: Pointer width (in bits) of the host.
+NATIVE_POINTER_WIDTH = 8 * ctypes.sizeof(ctypes.c_void_p)
+
+#: Entry points of the shared library.
+SOURCE_TEMPLATE = jinja2.Template(r'''
+#include <stdint.h>
+#include <string.h>
+#include <time.h>
+{% for header in headers %}
+#include "{{ header }}"
+{%- endfor %}
+#ifndef STREAM_REQUEST_SIZE
+/* Enable streaming (disabled by default on devices, to save RAM). */
+#define STREAM_REQUEST_SIZE 32
+#endif  // #ifndef STREAM_REQUEST_SIZE
+#ifndef ENABLE_LINK_NEGOTIATION
+/* Enable link negotiation (disabled by default on devices, to save program
+ * memory). */
+#define ENABLE_LINK_NEGOTIATION
+#endif  // #ifndef ENABLE_LINK_NEGOTIATION
+#ifndef ENABLE_ENCODED_REQUESTS
+/* Enable encoded requests (disabled by default on devices, to save program
+ * memory). */
+#define ENABLE_ENCODED_REQUESTS
+#endif  // #ifndef ENABLE_ENCODED_REQUESTS
+#include "CommandProcessor.h"
+
+static {{ class_name }} obj_;
+static {{ namespace }}::CommandProcessor<{{ class_name }} > processor_(obj_);
+
+extern "C" {
+
+int64_t arpc_process_command(uint8_t *buffer, uint32_t request_length,
+                             uint32_t buffer_size, uint8_t *output,
+                             uint32_t output_size) {
+  /* Process request at the start of `buffer` (which is also available to
+   * write the response to, as for a packet buffer on a device) and copy the
+   * response to `output`.
+   *
+   * Returns the length of the response, -1 if the request could not be
+   * processed, or -2 if the response does not fit in `output`. */
+  UInt8Array request;
+  request.data = buffer;
+  request.length = request_length;
+  UInt8Array buffer_arr;
+  buffer_arr.data = buffer;
+  buffer_arr.length = buffer_size;
+  UInt8Array result = processor_.process_command(request, buffer_arr);
+  if (result.data == NULL && result.length > 0) { return -1; }
+  if (result.length > output_size) { return -2; }
+  memmove(output, result.data, result.length);
+  return result.length;
+}
+
+int64_t arpc_time_command(const uint8_t *request, uint32_t request_length,
+                          uint8_t *buffer, uint32_t buffer_size,
+                          uint32_t iterations) {
+  /* Process request `iterations` times and return the elapsed time (in
+   * nanoseconds).  The request is copied to `buffer` before each call,
+   * since processing may modify the request in place. */
+  timespec start;
+  timespec end;
+  volatile uint32_t sink = 0;
+  UInt8Array request_arr;
+  request_arr.data = buffer;
+  request_arr.length = request_length;
+  UInt8Array buffer_arr;
+  buffer_arr.data = buffer;
+  buffer_arr.length = buffer_size;
+  clock_gettime(CLOCK_MONOTONIC, &start);
+  for (uint32_t i = 0; i < iterations; i++) {
+    memcpy(buffer, request, request_length);
+    sink += processor_.process_command(request_arr, buffer_arr).length;
+  }
+  clock_gettime(CLOCK_MONOTONIC, &end);
+  (void)sink;
+  return ((int64_t)(end.tv_sec - start.tv_sec) * 1000000000LL +
+          (end.tv_nsec - start.tv_nsec));
+}
+
+void arpc_set_staging_buffer(uint8_t *data, uint32_t length) {
+  UInt8Array staging_buffer;
+  staging_buffer.data = data;
+  staging_buffer.length = length;
+  processor_.set_staging_buffer(staging_buffer);
+}
+
+int64_t arpc_poll_stream(uint32_t now_us, uint8_t *output,
+                         uint32_t output_size, uint16_t *iuid) {
+  /* Run the stream request, if due (see `CommandPacketHandler::poll_stream`).
+   *
+   * Returns the length of the response, or -1 if no response is due. */
+  if (!processor_.stream_due(now_us)) { return -1; }
+  UInt8Array result = processor_.process_stream(now_us);
+  if (result.data == NULL || result.length > output_size) { return -1; }
+  memmove(output, result.data, result.length);
+  *iuid = 0x8000 | processor_.stream_id();
+  return result.length;
+}
+
+}  // extern "C"
+'''.strip())
+
+
+def build_native_library(df_sig_info, cpp_header, class_name, output_dir,
+                         namespace='native_rpc', includes=None,
+                         extra_args=None, compiler=None, manifest=None):
+    '''
+    Generate the C++ command processor for a class and compile it, together
+    with the class, into a shared library.
+
+    The class must be default constructible.
+
+    Arguments
+    ---------
+
+     - `df_sig_info`: Method signature frame (as returned by
+       `arduino_rpc.code_gen.get_multilevel_method_sig_frame`).
+     - `cpp_header`: Path to C++ header defining the class (or list of
+       paths).
+     - `class_name`: Name of C++ class.
+     - `output_dir`: Directory to write generated sources and library to.
+     - `namespace`: Namespace of generated code.
+     - `includes`: Include directories (default: `arduino_rpc.get_includes()`,
+       i.e., including the `CArrayDefs` headers).
+     - `extra_args`: Extra compiler arguments.
+     - `compiler`: C++ compiler (default: `$CXX`, or `c++`).
+     - `manifest`: Signature manifest to serve with `CMD_MANIFEST`
+       (optional; see `arduino_rpc.manifest.get_manifest`).
+
+    Returns
+    -------
+
+    str
+        Path to shared library.
+    '''
+    if isinstance(cpp_header, six.string_types):
+        cpp_header = [cpp_header]
+    if includes is None:
+        from . import get_includes
+
+        includes = get_includes()
+    if compiler is None:
+        compiler = os.environ.get('CXX', 'c++')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    sources = {'Commands.h': get_c_commands_header_code(df_sig_info,
+                                                        namespace,
+                                                        manifest=manifest),
+               'CommandProcessor.h':
+               get_c_command_processor_header_code(df_sig_info, namespace),
+               'NativeCommandProcessor.cpp':
+               SOURCE_TEMPLATE.render(headers=[os.path.abspath(header)
+                                               for header in cpp_header],
+                                      class_name=class_name,
+                                      namespace=namespace)}
+    for name, code in sources.items():
+        with open(os.path.join(output_dir, name), 'w') as output:
+            output.write(code)
+
+    library_path = os.path.join(output_dir, 'libcommand_processor.so')
+    include_dirs = ([output_dir] + sorted(set(os.path.dirname(os.path.abspath
+                                                              (header))
+                                              for header in cpp_header)) +
+                    list(includes))
+    command = ([compiler, '-O2', '-shared', '-fPIC', '-o', library_path,
+                os.path.join(output_dir, 'NativeCommandProcessor.cpp')] +
+               ['-I%s' % include for include in include_dirs] +
+               list(extra_args or []))
+    process = sp.Popen(command, stdout=sp.PIPE, stderr=sp.STDOUT)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise RuntimeError('Error compiling command processor:\n%s' %
+                           output.decode('utf8', 'replace'))
+    return library_path
+
+
+class NativeCommandProcessor(object):
+    '''
+    Command processor compiled for the host (see `build_native_library`).
+
+    Arguments
+    ---------
+
+     - `library_path`: Path to shared library.
+     - `buffer_size`: Size of packet buffer (i.e., `PACKET_SIZE` of a
+       device).
+     - `staging_size`: Size of staging buffer for fragmented requests (see
+       `CMD_FRAGMENT`), or `None` for no staging buffer.
+     - `output_size`: Maximum response length.
+    '''
+    def __init__(self, library_path, buffer_size=80, staging_size=None,
+                 output_size=1 << 20):
+        library = ctypes.CDLL(os.path.abspath(library_path))
+        library.arpc_process_command.restype = ctypes.c_int64
+        library.arpc_process_command.argtypes = [ctypes.c_char_p,
+                                                 ctypes.c_uint32,
+                                                 ctypes.c_uint32,
+                                                 ctypes.c_char_p,
+                                                 ctypes.c_uint32]
+        library.arpc_time_command.restype = ctypes.c_int64
+        library.arpc_time_command.argtypes = [ctypes.c_char_p,
+                                              ctypes.c_uint32,
+                                              ctypes.c_char_p,
+                                              ctypes.c_uint32,
+                                              ctypes.c_uint32]
+        library.arpc_set_staging_buffer.argtypes = [ctypes.c_char_p,
+                                                    ctypes.c_uint32]
+        library.arpc_poll_stream.restype = ctypes.c_int64
+        library.arpc_poll_stream.argtypes = [ctypes.c_uint32,
+                                             ctypes.c_char_p,
+                                             ctypes.c_uint32,
+                                             ctypes.POINTER(ctypes.c_uint16)]
+        self.library = library
+        self.buffer_size = buffer_size
+        self._buffer = ctypes.create_string_buffer(buffer_size)
+        self._output = ctypes.create_string_buffer(output_size)
+        self._staging = None
+        if staging_size is not None:
+            self._staging = ctypes.create_string_buffer(staging_size)
+            library.arpc_set_staging_buffer(self._staging, staging_size)
+
+    def _request_buffer(self, request):
+        if len(request) > len(self._buffer):
+            self._buffer = ctypes.create_string_buffer(len(request))
+        ctypes.memmove(self._buffer, request, len(request))
+        return max(self.buffer_size, len(request))
+
+    def process_command(self, request):
+        '''
+        Returns
+        -------
+
+        bytes or None
+            Response to a serialized request, or `None` if the request could
+            not be processed.
+        '''
+        buffer_size = self._request_buffer(request)
+        length = self.library.arpc_process_command(self._buffer,
+                                                   len(request), buffer_size,
+                                                   self._output,
+                                                   len(self._output))
+        if length < 0:
+            return None
+        return self._output.raw[:length]
+
+    def time_command(self, request, iterations=100000):
+        '''
+        Returns
+        -------
+
+        float
+            Mean time to process a serialized request (in nanoseconds),
+            measured in C++ (i.e., excluding `ctypes` overhead).
+        '''
+        buffer_size = self._request_buffer(request)
+        elapsed_ns = self.library.arpc_time_command(bytes(request),
+                                                    len(request),
+                                                    self._buffer,
+                                                    buffer_size, iterations)
+        return elapsed_ns / float(iterations)
+
+    def poll_stream(self, now_us):
+        '''
+        Returns
+        -------
+
+        tuple or None
+            `(iuid, response)` of the stream request, if due.
+        '''
+        iuid = ctypes.c_uint16()
+        length = self.library.arpc_poll_stream(now_us & 0xFFFFFFFF,
+                                               self._output,
+                                               len(self._output),
+                                               ctypes.byref(iuid))
+        if length < 0:
+            return None
+        return iuid.value, self._output.raw[:length]
+
+
+class NativeLoopbackPort(object):
+    '''
+    Serial port connected, in-process, to a `NativeCommandProcessor` (e.g.,
+    to test a proxy against the generated C++ code without a device).
+
+    Each request written to the port is processed immediately, and the
+    response is available to read.  Stream responses (see `CMD_STREAM`) are
+    produced as the port is polled.
+    '''
+    def __init__(self, processor):
+        self.processor = processor
+        self.timeout = None
+        self._receiver = PacketReceiver()
+        self._output = bytearray()
+        self._lock = threading.Condition()
+        self._start = _monotonic()
+
+    def _respond(self, iuid, response):
+        if response is None:
+            packet = AssembledPacket(b'', PACKET_TYPES.NACK, iuid)
+        else:
+            packet = AssembledPacket(response, PACKET_TYPES.DATA, iuid)
+        with self._lock:
+            self._output += _encode_response(packet, iuid)
+            self._lock.notify_all()
+
+    def write(self, data):
+        self._receiver.feed(data)
+        packets = self._receiver.packets
+        while packets:
+            request = packets.popleft()
+            if isinstance(request, IOError) or request.iuid & PUSH_IUID_FLAG:
+                continue
+            self._respond(request.iuid,
+                          self.processor.process_command(request.data()))
+        return len(data)
+
+    def _poll(self):
+        while True:
+            now_us = int((_monotonic() - self._start) * 1e6)
+            pushed = self.processor.poll_stream(now_us)
+            if pushed is None:
+                break
+            self._respond(*pushed)
+
+    def inWaiting(self):
+        self._poll()
+        return len(self._output)
+
+    in_waiting = property(inWaiting)
+
+    def read(self, size=1):
+        deadline = (None if self.timeout is None
+                    else _monotonic() + self.timeout)
+        while True:
+            self._poll()
+            with self._lock:
+                if self._output or size == 0:
+                    data = bytes(self._output[:size])
+                    del self._output[:size]
+                    return data
+            if deadline is not None and _monotonic() >= deadline:
+                return b''
+            # Wait for the next stream period (if any).
+            with self._lock:
+                self._lock.wait(0.0005 if deadline is None else
+                                max(0, min(0.0005,
+                                           deadline - _monotonic())))
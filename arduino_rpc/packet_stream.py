@@ -0,0 +1,241 @@
+'''
+Incremental reassembly of `nadamq` packets from a byte stream.
+
+Packets are framed on the wire according to the following grammar (see
+`PacketWriter.h` in `nadamq`):
+
+    packet = startflag iuid type [length payload crc]
+    startflag = 3%x7C
+    iuid = 2OCTET
+    type = OCTET
+    length = 2OCTET
+    payload = *OCTET
+    crc = 2OCTET
+
+where the `length`, `payload`, and `crc` fields are only present for `DATA`
+and `STREAM` packets.
+
+A response too long for a single packet is sent as one or more `STREAM`
+packets followed by a final `DATA` packet, all tagged with the same `iuid`.
+The payloads are joined into a single `AssembledPacket`.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import deque
+
+from nadamq.NadaMq import cPacket, cPacketParser, PACKET_TYPES
+
+
+START_FLAG = b'|||'
+#: Length of start flag, interface identifier, and packet type fields.
+HEADER_SIZE = len(START_FLAG) + 3
+#: Length of header including the payload length field of data packets.
+DATA_HEADER_SIZE = HEADER_SIZE + 2
+CRC_SIZE = 2
+MAX_PAYLOAD_SIZE = 0xFFFF
+
+
+class PacketParseError(IOError):
+    '''
+    Raised when a received packet is malformed (e.g., CRC mismatch).
+    '''
+    pass
+
+
+class AssembledPacket(object):
+    '''
+    Packet reassembled from a sequence of `STREAM` packets and a final `DATA`
+    packet.
+
+    Provides the parts of the `cPacket` interface used to decode responses;
+    unlike a `cPacket`, the payload may be longer than `MAX_PAYLOAD_SIZE`.
+    '''
+    __slots__ = ('_data', 'iuid', 'type_')
+
+    def __init__(self, data, type_, iuid):
+        self._data = data
+        self.type_ = type_
+        self.iuid = iuid
+
+    def data(self):
+        return self._data
+
+
+class PacketReceiver(object):
+    '''
+    Persistent receive engine which reads serial data into a preallocated
+    buffer and parses *every* complete packet available in a single pass.
+
+    Bytes following the last complete packet (i.e., a partially received
+    packet) are retained and parsed along with data from subsequent reads.
+
+    Parsed packets (or `PacketParseError` instances, for malformed packets)
+    are appended, in order of arrival, to the `packets` queue.
+    '''
+    def __init__(self, buffer_size=4 << 10):
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # Received bytes which have not been consumed yet are stored in
+        # `self._buffer[self._start:self._end]`.
+        self._start = 0
+        self._end = 0
+        self._parser = cPacketParser(buffer_size=MAX_PAYLOAD_SIZE)
+        self.packets = deque()
+        # Payloads of `STREAM` packets received so far for each `iuid` (or
+        # `None` if a packet in the sequence was malformed).
+        self._fragments = {}
+        #: Number of bytes discarded while searching for a start flag.
+        self.discarded_bytes = 0
+
+    @property
+    def pending_bytes(self):
+        '''
+        Number of received bytes not yet consumed by a complete packet.
+        '''
+        return self._end - self._start
+
+    def clear(self):
+        '''
+        Discard all unconsumed bytes and queued packets.
+        '''
+        self._start = self._end = 0
+        self.packets.clear()
+        self._fragments.clear()
+
+    def _reserve(self, size):
+        '''
+        Ensure there is space for at least `size` more bytes at the end of the
+        buffer, compacting and/or growing the buffer as necessary.
+        '''
+        if self._end + size <= len(self._buffer):
+            return
+        pending = self._end - self._start
+        if pending + size > len(self._buffer):
+            # Grow buffer.  A new `bytearray` is allocated, since a
+            # `bytearray` may not be resized while a view of it exists.
+            buffer_size = len(self._buffer)
+            while pending + size > buffer_size:
+                buffer_size *= 2
+            buffer_ = bytearray(buffer_size)
+            buffer_[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer_
+            self._view = memoryview(self._buffer)
+        else:
+            # Move unconsumed bytes to start of buffer.
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def read_from(self, stream, size):
+        '''
+        Read up to `size` bytes from `stream` directly into the receive buffer
+        and parse all complete packets.
+
+        Returns
+        -------
+
+        int
+            Number of bytes read.
+        '''
+        if size <= 0:
+            return 0
+        self._reserve(size)
+        target = self._view[self._end:self._end + size]
+        readinto = getattr(stream, 'readinto', None)
+        if readinto is not None:
+            count = readinto(target) or 0
+        else:
+            data = stream.read(size)
+            count = len(data)
+            target[:count] = data
+        if count:
+            self._end += count
+            self._parse()
+        return count
+
+    def feed(self, data):
+        '''
+        Append bytes to the receive buffer and parse all complete packets.
+        '''
+        size = len(data)
+        if size:
+            self._reserve(size)
+            self._view[self._end:self._end + size] = data
+            self._end += size
+            self._parse()
+        return size
+
+    def _append(self, packet, type_, iuid):
+        if type_ == PACKET_TYPES.STREAM:
+            fragments = self._fragments.setdefault(iuid, [])
+            if fragments is not None:
+                fragments.append(packet.data())
+        elif iuid in self._fragments:
+            fragments = self._fragments.pop(iuid)
+            if fragments is not None:
+                fragments.append(packet.data())
+                self.packets.append(AssembledPacket(b''.join(fragments),
+                                                    type_, iuid))
+            # Otherwise, the response is incomplete and the corresponding
+            # parse error has already been reported.
+        else:
+            self.packets.append(cPacket(data=packet.data(), type_=type_,
+                                        iuid=iuid))
+
+    def _parse(self):
+        buffer_ = self._buffer
+        start = self._start
+        end = self._end
+
+        while True:
+            i = buffer_.find(START_FLAG, start, end)
+            if i < 0:
+                # Keep trailing bytes which may be the start of a flag.
+                keep = min(end - start, len(START_FLAG) - 1)
+                self.discarded_bytes += end - start - keep
+                start = end - keep
+                break
+            self.discarded_bytes += i - start
+            start = i
+            if end - i < HEADER_SIZE:
+                break
+            iuid = (buffer_[i + 3] << 8) | buffer_[i + 4]
+            type_ = buffer_[i + 5]
+            if type_ in (PACKET_TYPES.DATA, PACKET_TYPES.STREAM):
+                if end - i < DATA_HEADER_SIZE:
+                    break
+                length = (buffer_[i + 6] << 8) | buffer_[i + 7]
+                frame_size = DATA_HEADER_SIZE + length + CRC_SIZE
+                if end - i < frame_size:
+                    break
+                self._parser.reset()
+                try:
+                    packet = self._parser.parse(self._view[i:i +
+                                                           frame_size])
+                except RuntimeError:
+                    # Some versions of `cPacketParser` raise on CRC error.
+                    packet = None
+                if packet and self._parser.message_completed:
+                    self._append(packet, type_, iuid)
+                    start = i + frame_size
+                else:
+                    self.packets.append(PacketParseError('Error parsing.'))
+                    # The malformed packet may belong to any partially
+                    # received response, so none can be completed.
+                    for fragment_iuid in self._fragments:
+                        self._fragments[fragment_iuid] = None
+                    # Resynchronize on the next start flag.
+                    start = i + 1
+            elif type_ in (PACKET_TYPES.ACK, PACKET_TYPES.NACK):
+                self.packets.append(cPacket(data=b'', type_=type_,
+                                            iuid=iuid))
+                start = i + HEADER_SIZE
+            else:
+                # Not a valid packet header; resynchronize.
+                start = i + 1
+
+        if start == end:
+            start = end = 0
+        self._start = start
+        self._end = end
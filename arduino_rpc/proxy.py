@@ -1,21 +1,1386 @@
 from __future__ import absolute_import
-import numpy as np
-from nadamq.NadaMq import cPacketParser
+from collections import OrderedDict
+from functools import partial
+import select
+import struct
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+
+from .commands import (BATCH_HEADER_SIZE, BATCH_ITEM_ERROR,
+                       BATCH_ITEM_HEADER_SIZE, CMD_BATCH, CMD_FRAGMENT,
+                       FRAGMENT_HEADER_SIZE, PUSH_IUID_FLAG)
+from .packet_stream import PacketParseError, PacketReceiver
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    # Python 2 has no monotonic clock in the standard library.
+    from time import time as _monotonic
+
+
+#: Sequence IDs are carried in the interface identifier (`iuid`) field of each
+#: packet.  Zero is reserved for untagged packets and the most significant bit
+#: is reserved for packets initiated by the device.
+MAX_SEQUENCE_ID = 0x7FFF
+
+
+class CommandTimeoutError(IOError):
+    '''
+    Raised when no complete response is received from the device before the
+    response deadline expires.
+    '''
+    pass
+
+
+class CommandNackError(IOError):
+    '''
+    Raised when the device answers a request with a `NACK` (i.e., the device
+    could not process the request).
+
+    .. versionadded:: 1.17
+    '''
+    pass
+
+
+class BatchCommandError(IOError):
+    '''
+    Raised for a batched call which the device could not process (e.g., an
+    unknown command, or a response which did not fit in the packet buffer).
+    '''
+    pass
+
+
+class FragmentError(IOError):
+    '''
+    Raised when the device rejects a fragment of a request too long for a
+    single packet (e.g., the request does not fit in the staging buffer of
+    the device, or the device has no staging buffer).
+    '''
+    pass
+
+
+def _get_codec(proxy, name):
+    '''
+    Return the request encoder and response decoder of the named method of a
+    generated proxy.
+    '''
+    try:
+        return (getattr(proxy, '_encode_' + name),
+                getattr(proxy, '_decode_' + name))
+    except AttributeError:
+        raise AttributeError('Proxy has no method `%s`' % name)
+
+
+def _bind_out(decode, kwargs):
+    '''
+    Bind the `out` keyword argument of a call (if specified) to the response
+    decoder of the call.
+    '''
+    out = kwargs.pop('out', None)
+    return decode if out is None else partial(decode, out=out)
+
+
+def _bind(name, arg_names, args, kwargs):
+    '''
+    Bind the positional and keyword arguments of a call of method `name` to
+    the argument names of the method.
+
+    Returns
+    -------
+
+    tuple
+        Arguments of the call, in order of `arg_names`.
+    '''
+    if kwargs:
+        try:
+            args += tuple(kwargs.pop(arg_name)
+                          for arg_name in arg_names[len(args):])
+        except KeyError as exception:
+            raise TypeError('%s() missing argument %s' % (name, exception))
+        if kwargs:
+            raise TypeError('%s() got unexpected keyword arguments: %s' %
+                            (name, ', '.join(sorted(kwargs))))
+    if len(args) != len(arg_names):
+        raise TypeError('%s() takes %d arguments (%d given)' %
+                        (name, len(arg_names), len(args)))
+    return args
+
+
+class PendingCall(object):
+    '''
+    Result of a command request which has been sent to the device, but whose
+    response may not have been received yet.
+
+    .. versionadded:: 1.17
+    '''
+    def __init__(self, owner, sequence_id=None, decode=None, deadline=None,
+                 size=0):
+        # Object responsible for completing the call (e.g., the proxy), which
+        # must provide a `_wait_for(call)` method.
+        self._owner = owner
+        self._decode = decode
+        self._done = False
+        self._result = None
+        self._exception = None
+        self.sequence_id = sequence_id
+        self.deadline = deadline
+        #: Size of serialized request (in bytes).
+        self.size = size
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        '''
+        Block until the response is received and return the decoded result.
+
+        Raises the exception encountered while waiting for, or decoding, the
+        response (if any).
+        '''
+        if not self._done:
+            self._owner._wait_for(self)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        if not self._done:
+            self._owner._wait_for(self)
+        return self._exception
+
+    def _set_response(self, packet):
+        try:
+            self._result = (packet if self._decode is None
+                            else self._decode(packet))
+        except Exception as exception:
+            self._exception = exception
+        self._done = True
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done = True
+
+
+class Pipeline(object):
+    '''
+    Issue proxy calls without waiting for each response before sending the
+    next request (see `ProxyBase.pipeline`).
+
+    .. versionadded:: 1.17
+    '''
+    def __init__(self, proxy, window, window_bytes=None):
+        self._proxy = proxy
+        self.window = window
+        self.window_bytes = window_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.wait()
+
+    def wait(self):
+        '''
+        Wait for all outstanding calls to complete.
+        '''
+        pending = self._proxy._pending_calls
+        while pending:
+            self._proxy._wait_for(next(iter(pending.values())))
+
+    def _throttle(self, size):
+        pending = self._proxy._pending_calls
+        while pending and (len(pending) >= self.window or
+                           (self.window_bytes is not None and
+                            sum(call.size for call in pending.values()) +
+                            size > self.window_bytes)):
+            self._proxy._wait_for(next(iter(pending.values())))
+
+    def submit(self, payload_data, decode, timeout_s=None):
+        '''
+        Send a serialized command request once the window has room.
+
+        Returns
+        -------
+
+        PendingCall
+        '''
+        packet = cPacket(data=payload_data, type_=PACKET_TYPES.DATA)
+        # Packet size: start flag, ID, type, length, payload, CRC.
+        self._throttle(len(payload_data) + 10)
+        return self._proxy._submit(packet, decode, timeout_s=timeout_s)
+
+    def __getattr__(self, name):
+        encode, decode = _get_codec(self._proxy, name)
+
+        def _pipelined(*args, **kwargs):
+            timeout_s = kwargs.pop('timeout_s', None)
+            decode_ = _bind_out(decode, kwargs)
+            return self.submit(encode(*args, **kwargs), decode_,
+                               timeout_s=timeout_s)
+        _pipelined.__name__ = name
+        return _pipelined
+
+
+class Batch(object):
+    '''
+    Collect proxy calls and send them to the device packed into as few batch
+    command packets as possible (see `ProxyBase.batch`).
+
+    .. versionadded:: 1.17
+    '''
+    def __init__(self, proxy, packet_size, timeout_s=None):
+        self._proxy = proxy
+        self._calls = []
+        self.packet_size = packet_size
+        self.timeout_s = timeout_s
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        if type_ is None:
+            self.send()
+
+    def __getattr__(self, name):
+        encode, decode = _get_codec(self._proxy, name)
+        response_size = getattr(self._proxy, '_RESPONSE_SIZES',
+                                {}).get(name)
+
+        def _batched(*args, **kwargs):
+            call = PendingCall(self, decode=_bind_out(decode, kwargs))
+            self._calls.append((encode(*args, **kwargs), response_size,
+                                call))
+            return call
+        _batched.__name__ = name
+        return _batched
+
+    def _wait_for(self, call):
+        self.send()
+
+    def _chunks(self):
+        '''
+        Split queued calls into chunks, such that the batch request *and*
+        response of each chunk fit in the packet buffer of the device.
+
+        Responses of unknown size (i.e., arrays) are not counted, and are
+        reported by the device as a `BatchCommandError` if they do not fit.
+        '''
+        chunk = []
+        size = BATCH_HEADER_SIZE
+        for payload_data, response_size, call in self._calls:
+            call_size = (BATCH_ITEM_HEADER_SIZE + len(payload_data) +
+                         BATCH_ITEM_HEADER_SIZE + (response_size or 0))
+            if chunk and size + call_size > self.packet_size:
+                yield chunk
+                chunk = []
+                size = BATCH_HEADER_SIZE
+            chunk.append((payload_data, call))
+            size += call_size
+        if chunk:
+            yield chunk
+
+    def send(self):
+        '''
+        Send all queued calls and wait for the responses.
+        '''
+        calls = [call for payload_data, response_size, call in self._calls]
+        try:
+            for chunk in self._chunks():
+                decode = _BatchDecoder(chunk)
+                decode(self._proxy._send_command(encode_batch_request(chunk),
+                                                 timeout_s=self.timeout_s))
+        except Exception as exception:
+            for call in calls:
+                if not call.done():
+                    call._set_exception(exception)
+            raise
+        finally:
+            del self._calls[:]
+
+
+class _BatchDecoder(object):
+    '''
+    Split a batch response and complete each call in the batch.
+    '''
+    def __init__(self, chunk):
+        self.calls = [call for payload_data, call in chunk]
+
+    def __call__(self, packet):
+        data = packet.data()
+        offset = 0
+        for call in self.calls:
+            if offset + BATCH_ITEM_HEADER_SIZE > len(data):
+                call._set_exception(BatchCommandError('Missing response.'))
+                continue
+            length = struct.unpack_from('<H', data, offset)[0]
+            offset += BATCH_ITEM_HEADER_SIZE
+            if length == BATCH_ITEM_ERROR:
+                call._set_exception(BatchCommandError('Device could not '
+                                                      'process command.'))
+            else:
+                call._set_response(cPacket(data=data[offset:offset + length],
+                                           type_=PACKET_TYPES.DATA))
+                offset += length
+
+
+def encode_batch_request(chunk):
+    '''
+    Pack a sequence of `(payload_data, call)` pairs into a batch request
+    packet.
+
+    The batch request payload is the `CMD_BATCH` command code followed by
+    each serialized request, prefixed by its length as a `uint16_t`.
+    '''
+    payload_data = [struct.pack('<H', CMD_BATCH)]
+    for request_data, call in chunk:
+        payload_data.append(struct.pack('<H', len(request_data)))
+        payload_data.append(request_data)
+    return cPacket(data=b''.join(payload_data), type_=PACKET_TYPES.DATA)
+
+
+def encode_fragments(payload_data, max_payload_size):
+    '''
+    Split a serialized request into `CMD_FRAGMENT` request payloads of at
+    most `max_payload_size` bytes each.
+
+    Each fragment payload is the `CMD_FRAGMENT` command code, the offset of
+    the fragment in the request and the total length of the request (both as
+    `uint32_t`), followed by the fragment data.
+
+    .. versionadded:: 1.17
+    '''
+    chunk_size = max_payload_size - FRAGMENT_HEADER_SIZE
+    if chunk_size <= 0:
+        raise ValueError('Maximum payload size must be larger than the '
+                         'fragment header (%d bytes).' % FRAGMENT_HEADER_SIZE)
+    view = memoryview(payload_data)
+    total_length = len(payload_data)
+    for offset in range(0, total_length, chunk_size):
+        yield (struct.pack('<HII', CMD_FRAGMENT, offset, total_length) +
+               view[offset:offset + chunk_size].tobytes())
+
+
+def _read_byte(serial, receiver, timeout_s):
+    '''
+    Read up to one byte from a serial port into a packet receiver, waiting up
+    to `timeout_s` seconds.  The timeout of the port is left unchanged.
+    '''
+    timeout = serial.timeout
+    if timeout == timeout_s:
+        return receiver.read_from(serial, 1)
+    serial.timeout = timeout_s
+    try:
+        return receiver.read_from(serial, 1)
+    finally:
+        serial.timeout = timeout
+
+
+def _fragments_response(calls):
+    '''
+    Return the response to the last of the fragments of a request (see
+    `ProxyBase._submit_fragmented`).
+
+    Raises `FragmentError` if the device rejected any fragment.
+    '''
+    response = None
+    for call in calls:
+        response = call.result()
+        if response.type_ == PACKET_TYPES.NACK:
+            raise FragmentError('Device rejected request fragment.')
+    return response
 
 
 class ProxyBase(object):
-    def _send_command(self, packet):
-        self._serial.write(packet.tostring())
-        parser = cPacketParser()
-        result = None
+    #: Default number of seconds to wait for a command response (`None`
+    #: waits indefinitely).  May be overridden per instance, or per call using
+    #: the `timeout_s` keyword argument of `_send_command`.
+    response_timeout_s = None
+    #: Upper bound on a single blocking read for ports that do not expose a
+    #: file descriptor (e.g., on Windows).
+    _read_interval_s = 0.1
+    #: Default maximum number of outstanding requests in pipelined mode.
+    pipeline_window = 4
+    #: Default maximum number of outstanding request bytes in pipelined mode
+    #: (`None` for no limit).  The default matches the receive buffer size of
+    #: the AVR Arduino `HardwareSerial` implementation.
+    pipeline_window_bytes = 64
+    #: Size of the packet buffer of the device (i.e., `PACKET_SIZE`, as set by
+    #: `arduino_rpc.rpc_data_frame.generate_rpc_buffer_header`).
+    packet_size = 80
+    #: Maximum request payload size (in bytes) the device accepts in a single
+    #: packet.  Longer requests are sent as a sequence of fragments.  If
+    #: `None`, `packet_size` is used.  Set by `negotiate_link`.
+    max_request_payload_size = None
+    #: Size of the staging buffer of the device (see `CMD_FRAGMENT`), or
+    #: `None` if unknown (e.g., before `negotiate_link`).
+    staging_size = None
+    #: Maximum number of request fragments in flight (see `_send_fragmented`).
+    #: With two fragments in flight, the next fragment arrives while the
+    #: device processes the previous one.
+    fragment_window = 2
+    #: I/O thread serializing access to the serial port (see
+    #: `start_io_thread`), or `None` if calls run in the calling thread.
+    _io_thread = None
+    #: Per-method call statistics (see `enable_stats`), or `None` if
+    #: disabled.
+    _stats = None
+    #: Result cache (see `enable_cache`), or `None` if disabled.
+    _cache = None
+    #: Default cache policy (see `enable_cache`); overridden by generated
+    #: proxies.
+    _CACHE_POLICY = {}
+    #: Setter call coalescer (see `enable_coalescing`), or `None` if
+    #: disabled.
+    _coalescer = None
+    #: Array compressor (see `enable_compression`), or `None` if disabled.
+    _compressor = None
+    #: Array arguments and results of each method (see `enable_compression`);
+    #: overridden by generated proxies.
+    _ARRAY_ARGS = {}
+    _ARRAY_RESULTS = {}
+    #: Argument names of each method (e.g., to bind keyword arguments of
+    #: cached calls); overridden by generated proxies.
+    _ARG_NAMES = {}
+    #: Retry engine (see `enable_retries`), or `None` if disabled.
+    _retrier = None
+    #: Names of methods which may safely be retried by default (see
+    #: `enable_retries`); overridden by generated proxies.
+    _IDEMPOTENT_METHODS = ()
+
+    @property
+    def _packet_receiver(self):
+        '''
+        Persistent receive engine for this proxy, created on first use.
+
+        .. versionadded:: 1.17
+        '''
+        try:
+            return self._receiver
+        except AttributeError:
+            self._receiver = PacketReceiver()
+            return self._receiver
+
+    @property
+    def buffer_pool(self):
+        '''
+        Pool of arrays for decoded array responses, created on first use.
+
+        Arrays returned by a method of the proxy (without an `out` keyword
+        argument) may be returned to the pool once no longer needed, to be
+        reused for subsequent responses:
+
+            data = proxy.read_samples()
+            ...
+            proxy.buffer_pool.release(data)
+
+        .. versionadded:: 1.17
+        '''
+        try:
+            return self._buffer_pool
+        except AttributeError:
+            # Imported on first use, so proxies generated for the `struct`
+            # runtime do not import `numpy`.
+            from .codec import BufferPool
+
+            self._buffer_pool = BufferPool()
+            return self._buffer_pool
+
+    def _deadline(self, timeout_s=None):
+        if timeout_s is None:
+            timeout_s = self.response_timeout_s
+        return None if timeout_s is None else _monotonic() + timeout_s
+
+    @property
+    def _pending_calls(self):
+        '''
+        Calls awaiting a response, ordered by sequence ID (i.e., in the order
+        the requests were sent).
+
+        .. versionadded:: 1.17
+        '''
+        try:
+            return self._pending
+        except AttributeError:
+            self._pending = OrderedDict()
+            return self._pending
+
+    def _next_sequence_id(self):
+        sequence_id = getattr(self, '_sequence_id', 0) % MAX_SEQUENCE_ID + 1
+        self._sequence_id = sequence_id
+        return sequence_id
+
+    def _command_packet(self, payload_data):
+        '''
+        Return the request packet for a command without arguments.
+
+        Packets are built on first use and reused by subsequent calls, since
+        only the sequence ID of the packet differs between requests (and is
+        set as the packet is written).
+
+        .. versionadded:: 1.17
+        '''
+        try:
+            packets = self._command_packets
+        except AttributeError:
+            packets = self._command_packets = {}
+        try:
+            return packets[payload_data]
+        except KeyError:
+            packet = packets[payload_data] = cPacket(data=payload_data,
+                                                     type_=PACKET_TYPES.DATA)
+            return packet
+
+    def _call(self, payload_data, decode, timeout_s=None):
+        '''
+        Send a serialized command request and return the decoded response.
+
+        Arguments
+        ---------
+
+         - `payload_data`: Serialized command request (command code followed by
+           the packed request structure).
+         - `decode`: Function to decode the response packet.
+         - `timeout_s`: Seconds to wait for the response (optional).
+
+        .. versionadded:: 1.17
+        '''
+        if len(payload_data) > self._get_max_request_payload_size():
+            return decode(self._send_fragmented(payload_data,
+                                                timeout_s=timeout_s))
+        packet = cPacket(data=payload_data, type_=PACKET_TYPES.DATA)
+        return decode(self._send_command(packet, timeout_s=timeout_s))
+
+    def _get_max_request_payload_size(self):
+        # The device is not queried here, so calls never trigger a hidden
+        # round trip (see `negotiate_link`).
+        if self.max_request_payload_size is None:
+            return self.packet_size
+        return self.max_request_payload_size
+
+    def _send_fragmented(self, payload_data, timeout_s=None):
+        '''
+        Send a request too long for a single packet as a sequence of
+        `CMD_FRAGMENT` requests, keeping up to `fragment_window` fragments in
+        flight.
+
+        If the I/O thread is running, fragments are queued consecutively in
+        its bulk lane (see `arduino_rpc.threaded`).
+
+        Returns
+        -------
+
+        cPacket
+            Response to the complete request (i.e., to the last fragment).
+
+        .. versionadded:: 1.17
+        '''
+        return _fragments_response(self._submit_fragmented(payload_data,
+                                                           timeout_s))
+
+    def _submit_fragmented(self, payload_data, timeout_s=None):
+        '''
+        Send the `CMD_FRAGMENT` requests of a request too long for a single
+        packet (see `_send_fragmented`), without waiting for the response to
+        the last fragment.
+
+        Returns
+        -------
+
+        list
+            Call (i.e., `PendingCall`, or `concurrent.futures.Future` if the
+            I/O thread is running) of each fragment.
+
+        .. versionadded:: 1.17
+        '''
+        fragments = encode_fragments(payload_data,
+                                     self._get_max_request_payload_size())
+        if self._io_thread is not None:
+            packets = [cPacket(data=fragment, type_=PACKET_TYPES.DATA)
+                       for fragment in fragments]
+            return self._io_thread.submit_sequence(packets,
+                                                   timeout_s=timeout_s)
+        pipeline = Pipeline(self, self.fragment_window)
+        return [pipeline.submit(fragment, None, timeout_s=timeout_s)
+                for fragment in fragments]
+
+    def _send_command(self, packet, timeout_s=None):
+        '''
+        Write the serialized packet to the serial port and block until the
+        corresponding response packet is received.
+
+        .. versionchanged:: 1.17
+            Block on the port (rather than polling in a busy loop) while
+            waiting for a response, and raise `CommandTimeoutError` if no
+            response is received within `timeout_s` seconds (or
+            `response_timeout_s` seconds if `timeout_s` is not specified).
+
+            Parse responses using the persistent receive engine of the proxy.
+            Bytes received after a complete response are retained for
+            subsequent calls.
+
+            Tag each request with a sequence ID and discard stale responses
+            (e.g., late responses to timed out requests).
+
+            Queue the request for the I/O thread of the proxy (if running;
+            see `start_io_thread`) and block until the response is received.
+        '''
+        if self._io_thread is not None:
+            return self._io_thread.submit(packet,
+                                          timeout_s=timeout_s).result()
+        return self._submit(packet, timeout_s=timeout_s).result()
+
+    def _submit(self, packet, decode=None, timeout_s=None):
+        '''
+        Tag the packet with the next sequence ID and write it to the serial
+        port *without* waiting for the response.
+
+        Returns
+        -------
+
+        PendingCall
+            Pending result of the call.  If `decode` is `None`, the result is
+            the response packet.
+
+        .. versionadded:: 1.17
+        '''
+        if self._io_thread is not None:
+            raise RuntimeError('Serial port is owned by the I/O thread.  Use '
+                               '`futures` to issue non-blocking calls.')
+        sequence_id = self._next_sequence_id()
+        packet.iuid = sequence_id
+        data = packet.tostring()
+        call = PendingCall(self, sequence_id, decode,
+                           self._deadline(timeout_s), len(data))
+        self._pending_calls[sequence_id] = call
+        try:
+            self._serial.write(data)
+        except Exception:
+            del self._pending_calls[sequence_id]
+            raise
+        return call
+
+    def _wait_for(self, call):
+        '''
+        Process responses from the device until the specified call completes.
+        '''
+        pending = self._pending_calls
+        while not call.done():
+            try:
+                packet = self._receive_packet(call.deadline)
+            except CommandTimeoutError as exception:
+                # Abandon call.  A late response will be discarded, since the
+                # sequence ID is no longer pending.
+                pending.pop(call.sequence_id, None)
+                call._set_exception(exception)
+            except PacketParseError as exception:
+                # Sequence ID of a malformed packet is unknown.  Responses
+                # arrive in request order, so fail the oldest pending call.
+                oldest_id = next(iter(pending))
+                pending.pop(oldest_id)._set_exception(exception)
+            else:
+                self._dispatch_response(packet)
+
+    def _dispatch_response(self, packet):
+        '''
+        Complete the pending call corresponding to a response packet.
+
+        Responses tagged with the ID of a call that is not pending (e.g., a
+        late response to a call that timed out) are discarded.  Untagged
+        responses (i.e., from firmware that does not echo the sequence ID) are
+        matched to the oldest pending call.
+        '''
+        if packet.iuid & PUSH_IUID_FLAG:
+            self._dispatch_push(packet)
+            return
+        pending = self._pending_calls
+        sequence_id = packet.iuid
+        if sequence_id == 0 and pending:
+            sequence_id = next(iter(pending))
+        call = pending.pop(sequence_id, None)
+        if call is not None:
+            call._set_response(packet)
+
+    @property
+    def _streams(self):
+        '''
+        Active streams, keyed by stream ID (see `stream`).
+
+        .. versionadded:: 1.17
+        '''
+        try:
+            return self._active_streams
+        except AttributeError:
+            self._active_streams = {}
+            return self._active_streams
+
+    def _dispatch_push(self, packet):
+        '''
+        Queue a packet pushed by the device for the corresponding stream.
+        Packets of unknown streams (e.g., pushed before a stop request was
+        processed) are discarded.
+        '''
+        stream = self._streams.get(packet.iuid & MAX_SEQUENCE_ID)
+        if stream is not None:
+            stream._push(packet)
+
+    def stream(self, method, *args, **kwargs):
+        '''
+        Request the device to call a method at a fixed rate and push each
+        result to the host, without a request per call.
+
+        Arguments
+        ---------
+
+         - `method`: Name of proxy method (or the method itself).
+         - `*args`: Arguments of method.
+         - `rate`: Calls per second (keyword only).
+         - `block_size`: Number of samples per block (keyword only, default:
+           1).
+         - `timeout_s`: Seconds to wait for each sample (keyword only,
+           optional).
+
+        For example:
+
+            with proxy.stream('analog_read', 0, rate=1000,
+                              block_size=100) as stream:
+                for block in stream:
+                    ...
+
+        The device firmware must call `CommandPacketHandler::poll_stream`
+        regularly (e.g., on every `loop()` iteration).  Other calls may be
+        made while the stream is active.
+
+        Returns
+        -------
+
+        arduino_rpc.stream.Stream
+            Started stream; iterates over `numpy` arrays of samples.
+
+        .. versionadded:: 1.17
+        '''
+        from .stream import Stream
+
+        name = getattr(method, '__name__', method)
+        rate = kwargs.pop('rate')
+        return Stream(self, name, args, rate, **kwargs).start()
+
+    def _resync(self):
+        '''
+        Discard received bytes which have not been parsed into a response yet
+        (e.g., the rest of a corrupted packet), without reopening the serial
+        port.
+
+        Skipped while other calls await a response, while a stream is active,
+        or while the I/O thread owns the serial port, since their packets may
+        still be in the receive buffer.
+
+        Returns
+        -------
+
+        bool
+            `True` if the receive state was reset.
+
+        .. versionadded:: 1.17
+        '''
+        if (self._io_thread is not None or self._pending_calls or
+                getattr(self, '_active_streams', None)):
+            return False
+        port = self._serial
+        reset_input_buffer = (getattr(port, 'reset_input_buffer', None) or
+                              getattr(port, 'flushInput', None))
+        if reset_input_buffer is not None:
+            reset_input_buffer()
+        self._packet_receiver.clear()
+        return True
+
+    def _receive_packet(self, deadline):
+        '''
+        Return the next packet received from the device.
+
+        Raises `PacketParseError` if the next packet is malformed.
+        '''
+        packets = self._packet_receiver.packets
+        while not packets:
+            self._receive_bytes(deadline)
+        packet = packets.popleft()
+        if isinstance(packet, PacketParseError):
+            raise packet
+        return packet
+
+    def pipeline(self, window=None, window_bytes=None):
+        '''
+        Return a context manager to issue calls without waiting for each
+        response before sending the next request.
+
+        Arguments
+        ---------
+
+         - `window`: Maximum number of outstanding requests (default:
+           `pipeline_window`).
+         - `window_bytes`: Maximum number of serialized request bytes
+           outstanding (default: `pipeline_window_bytes`).  Set to (at most)
+           the receive buffer size of the device to avoid overrunning it.
+
+        For example:
+
+            with proxy.pipeline(window=8) as pipeline:
+                calls = [pipeline.str_echo(data) for data in chunks]
+            results = [call.result() for call in calls]
+
+        Each method of the proxy is available on the pipeline and returns a
+        `PendingCall`.  All pending calls are completed when the context
+        exits.
+
+        .. versionadded:: 1.17
+        '''
+        if window is None:
+            window = self.pipeline_window
+        if window_bytes is None:
+            window_bytes = self.pipeline_window_bytes
+        return Pipeline(self, window, window_bytes)
+
+    def _receive_bytes(self, deadline):
+        '''
+        Block until at least one byte is available on the serial port (or the
+        deadline passes) and read all available bytes into the receive engine.
+
+        Arguments
+        ---------
+
+         - `deadline`: Monotonic clock time after which to give up waiting, or
+           `None` to wait indefinitely.
+
+        Returns
+        -------
+
+        int
+            Number of bytes read.
+        '''
+        serial = self._serial
+        receiver = self._packet_receiver
+        try:
+            fd = serial.fileno()
+        except (AttributeError, IOError, ValueError):
+            # Port does not expose a file descriptor (e.g., Windows, or
+            # `pyserial` URL handlers).
+            fd = None
 
         while True:
-            response = self._serial.read(self._serial.inWaiting())
-            if response == '':
-                continue
-            result = parser.parse(np.fromstring(response, dtype='uint8'))
-            if parser.message_completed:
-                break
-            elif parser.error:
-                raise IOError('Error parsing.')
-        return result
+            waiting = serial.inWaiting()
+            if waiting:
+                return receiver.read_from(serial, waiting)
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    raise CommandTimeoutError('No response received before '
+                                              'deadline.')
+            if fd is not None:
+                # Sleep in the kernel until the port becomes readable.
+                select.select([fd], [], [], remaining)
+            else:
+                # Block in a single-byte read, bounded by the read interval so
+                # the deadline is still honoured.
+                interval = (self._read_interval_s if remaining is None
+                            else min(remaining, self._read_interval_s))
+                if _read_byte(serial, receiver, interval):
+                    return 1 + receiver.read_from(serial, serial.inWaiting())
+
+    def batch(self, packet_size=None, timeout_s=None):
+        '''
+        Return a context manager which collects calls and sends them packed
+        into batch command packets when the context exits.
+
+        The device runs the calls of each batch in order and returns the
+        responses in a single packet.  Calls are split across as many batch
+        packets as necessary to fit each request and response in
+        `packet_size` bytes (default: `packet_size` of the proxy).
+
+        For example:
+
+            with proxy.batch() as batch:
+                batch.set_x(1)
+                y = batch.y()
+            print(y.result())
+
+        Each method of the proxy is available on the batch and returns a
+        `PendingCall`.
+
+        .. versionadded:: 1.17
+        '''
+        if packet_size is None:
+            packet_size = self.packet_size
+        return Batch(self, packet_size, timeout_s=timeout_s)
+
+    def start_io_thread(self, window=None, window_bytes=None, priorities=None,
+                        queue_size=None, block=True):
+        '''
+        Start a dedicated I/O thread for the proxy, making calls thread-safe.
+
+        Once started, the I/O thread is the only thread to access the serial
+        port.  Requests from any thread are queued for the I/O thread, which
+        keeps up to `window` requests (and `window_bytes` request bytes) in
+        flight and completes each call as its response arrives.  Proxy
+        methods block until their response is received (as before), while
+        methods of `futures` return a `concurrent.futures.Future`:
+
+            proxy.start_io_thread()
+            future = proxy.futures.ram_free()
+            ...
+            print(future.result())
+
+        Queued requests are sent in priority order (see
+        `arduino_rpc.threaded`).  Requests too long for a single packet are
+        sent in the bulk lane, one packet at a time, so urgent commands wait
+        for at most the packets already in flight:
+
+            from arduino_rpc.threaded import PRIORITY_HIGH
+
+            proxy.start_io_thread(priorities={'emergency_stop':
+                                              PRIORITY_HIGH})
+
+        Arguments
+        ---------
+
+         - `window`: Maximum number of outstanding requests (default:
+           `pipeline_window`).
+         - `window_bytes`: Maximum number of serialized request bytes
+           outstanding (default: `pipeline_window_bytes`).
+         - `priorities`: Mapping from method name to priority lane (default:
+           `PRIORITY_NORMAL`).  The lane of a `futures` call may also be set
+           with a `priority` keyword argument.
+         - `queue_size`: Maximum number of queued requests per lane (`None`
+           for no limit).
+         - `block`: If `True`, calls to a full lane block until there is
+           room; otherwise, they raise `arduino_rpc.threaded.QueueFullError`.
+
+        Returns
+        -------
+
+        arduino_rpc.threaded.ProxyIoThread
+            Running I/O thread.
+
+        .. versionadded:: 1.17
+        '''
+        from .threaded import ProxyIoThread
+
+        if self._io_thread is not None:
+            raise RuntimeError('I/O thread is already running.')
+        if self._pending_calls:
+            raise RuntimeError('Cannot start I/O thread with calls pending.')
+        io_thread = ProxyIoThread(self, window=window,
+                                  window_bytes=window_bytes,
+                                  priorities=priorities,
+                                  queue_size=queue_size, block=block)
+        io_thread.start()
+        self._io_thread = io_thread
+        return io_thread
+
+    def stop_io_thread(self):
+        '''
+        Wait for outstanding calls to complete and stop the I/O thread (see
+        `start_io_thread`).
+
+        .. versionadded:: 1.17
+        '''
+        io_thread = self._io_thread
+        if io_thread is not None:
+            io_thread.stop()
+            self._io_thread = None
+
+    def enable_stats(self):
+        '''
+        Start collecting per-method call statistics (see `stats`).
+
+        Encoders, decoders and send methods of this proxy instance are
+        wrapped to time each call, adding a few microseconds per call.
+        Proxies with statistics disabled are not affected.
+
+        .. versionadded:: 1.17
+        '''
+        from .stats import ProxyStats
+
+        if self._stats is None:
+            self._stats = ProxyStats(self)
+            self._stats.install(self)
+
+    def disable_stats(self):
+        '''
+        Stop collecting call statistics and discard collected statistics.
+
+        .. versionadded:: 1.17
+        '''
+        if self._stats is not None:
+            self._stats.uninstall(self)
+            self._stats = None
+
+    def stats(self, reset=False):
+        '''
+        Return per-method call statistics collected since `enable_stats` was
+        called.
+
+        Arguments
+        ---------
+
+         - `reset`: Reset statistics after reading them.
+
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per called method, with call count, request/response
+            bytes, mean encode/round-trip/decode times (in microseconds),
+            NACK, error, parse error, timeout and retry counts (see
+            `enable_retries`), and a round-trip latency histogram
+            (`latency_<edge>us` columns count calls up to each edge).
+
+        .. versionadded:: 1.17
+        '''
+        if self._stats is None:
+            raise RuntimeError('Call statistics are disabled.  Call '
+                               '`enable_stats()` first.')
+        df_stats = self._stats.to_frame()
+        if reset:
+            self._stats.reset()
+        return df_stats
+
+    def enable_cache(self, policy=None, ttl_s=None, max_results=128):
+        '''
+        Cache results of read-only methods, to avoid a round trip to the
+        device for each call (see `arduino_rpc.cache`).
+
+        A call to a cached method with the same arguments as a previous call
+        returns the previous result until the result expires, or until a
+        method which invalidates the result is called *through this proxy*.
+        Calls with an `out` argument always call the device.
+
+        Arguments
+        ---------
+
+         - `policy`: Mapping from method name to `(ttl_s, invalidated_by)`,
+           where `ttl_s` is the time to live of a cached result (`None` for
+           no expiry) and `invalidated_by` is a list of names of methods
+           which invalidate cached results (`None` for any method which is
+           not cached).  Overrides the default policy of the proxy (i.e., the
+           `const` methods of the device class); a value of `None` disables
+           caching of the method.
+         - `ttl_s`: Time to live of results cached according to the default
+           policy.
+         - `max_results`: Maximum number of cached results (i.e., distinct
+           arguments) per method.
+
+        .. versionadded:: 1.17
+        '''
+        from .cache import ResultCache
+
+        self.disable_cache()
+        cache_policy = dict((name, (ttl_s if method_ttl_s is None
+                                    else method_ttl_s, invalidated_by))
+                            for name, (method_ttl_s, invalidated_by) in
+                            self._CACHE_POLICY.items())
+        for name, method_policy in (policy or {}).items():
+            if method_policy is None:
+                cache_policy.pop(name, None)
+            else:
+                cache_policy[name] = method_policy
+        self._cache = ResultCache(cache_policy, max_results=max_results)
+        self._cache.install(self)
+
+    def disable_cache(self):
+        '''
+        Stop caching results and discard cached results.
+
+        .. versionadded:: 1.17
+        '''
+        if self._cache is not None:
+            self._cache.uninstall(self)
+            self._cache = None
+
+    def cache_stats(self, reset=False):
+        '''
+        Return result cache statistics.
+
+        Arguments
+        ---------
+
+         - `reset`: Reset counters after reading them.
+
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per cached method, with time to live, hit, miss and
+            invalidation counts, hit rate and number of cached results.
+
+        .. versionadded:: 1.17
+        '''
+        if self._cache is None:
+            raise RuntimeError('Result cache is disabled.  Call '
+                               '`enable_cache()` first.')
+        df_cache = self._cache.to_frame()
+        if reset:
+            self._cache.reset()
+        return df_cache
+
+    def enable_coalescing(self, methods=None):
+        '''
+        Coalesce rapid calls to setters (see `arduino_rpc.coalesce`).
+
+        A call to a coalesced method returns immediately (without waiting for
+        the device), and replaces any request to the same method which has
+        not been sent yet.  Pending requests are sent by a background thread
+        in the order of the last call to each method, and before any call to
+        another method of this proxy.
+
+        Note that pipelined, batched and streamed calls bypass the queue; call
+        `flush_coalesced` first.
+
+        Arguments
+        ---------
+
+         - `methods`: Names of methods to coalesce (default: each method which
+           takes arguments and returns nothing).
+
+        Returns
+        -------
+
+        arduino_rpc.coalesce.CallCoalescer
+            Coalescer, with `calls`, `sent` and `coalesced` counters.
+
+        .. versionadded:: 1.17
+        '''
+        from .coalesce import CallCoalescer
+
+        self.disable_coalescing()
+        self._coalescer = CallCoalescer(self, methods=methods).install()
+        return self._coalescer
+
+    def flush_coalesced(self):
+        '''
+        Send all pending coalesced requests (see `enable_coalescing`).
+
+        .. versionadded:: 1.17
+        '''
+        if self._coalescer is not None:
+            self._coalescer.flush()
+
+    def disable_coalescing(self):
+        '''
+        Send all pending coalesced requests and stop coalescing calls.
+
+        .. versionadded:: 1.17
+        '''
+        coalescer = self._coalescer
+        if coalescer is not None:
+            self._coalescer = None
+            coalescer.uninstall()
+
+    def enable_compression(self, methods=None, results=True):
+        '''
+        Send array arguments (and receive array results) compressed, using
+        the smallest of the encodings in `arduino_rpc.compression` for each
+        array of each call.
+
+        A request is sent compressed if smaller than the raw request, and if
+        the device has room to decode it (see `packet_size` and
+        `staging_size`, as set by `negotiate_link`).  If the device rejects
+        compressed requests (see `ENABLE_ENCODED_REQUESTS`), calls are sent
+        uncompressed.
+
+        Arguments
+        ---------
+
+         - `methods`: Names of methods to compress (default: each method with
+           an array argument or result).
+         - `results`: If `True`, ask the device to encode array results.
+           Results must fit in the packet (or staging) buffer of the device
+           once encoded.
+
+        Returns
+        -------
+
+        arduino_rpc.compression.Compressor
+            Compressor.
+
+        .. versionadded:: 1.17
+        '''
+        from .compression import Compressor
+
+        self.disable_compression()
+        self._compressor = Compressor(self, methods=methods,
+                                      results=results).install()
+        return self._compressor
+
+    def disable_compression(self):
+        '''
+        Stop compressing array transfers.
+
+        .. versionadded:: 1.17
+        '''
+        if self._compressor is not None:
+            self._compressor.uninstall()
+            self._compressor = None
+
+    def compression_stats(self):
+        '''
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per compressed method, with call counts, raw and encoded
+            request/result bytes and compression ratios.
+
+        .. versionadded:: 1.17
+        '''
+        if self._compressor is None:
+            raise RuntimeError('Compression is disabled.  Call '
+                               '`enable_compression()` first.')
+        return self._compressor.to_frame()
+
+    def enable_retries(self, idempotency=None, max_retries=3, backoff_s=0.005,
+                       max_backoff_s=0.1, retry_timeouts=True):
+        '''
+        Retry calls to idempotent methods which fail with a `NACK`, a
+        corrupted response (e.g., CRC error) or, optionally, a timeout (see
+        `arduino_rpc.retry`).
+
+        Before each retry, the proxy waits with exponential backoff (from
+        `backoff_s`, doubling up to `max_backoff_s`) and resynchronizes its
+        receive state.  Retries are counted in `stats` (if enabled).  Calls
+        which succeed on the first attempt only pay for a `try` block.
+
+        Arguments
+        ---------
+
+         - `idempotency`: Mapping from method name to idempotency class
+           (`arduino_rpc.retry.IDEMPOTENT` or `arduino_rpc.retry.UNSAFE`),
+           overriding the default classes (i.e., methods in
+           `_IDEMPOTENT_METHODS`, the getters of the device class, are
+           idempotent).
+         - `max_retries`: Maximum number of retries per call.
+         - `backoff_s`: Seconds to wait before the first retry.
+         - `max_backoff_s`: Maximum seconds to wait before a retry.
+         - `retry_timeouts`: If `False`, calls which time out are not
+           retried.
+
+        Returns
+        -------
+
+        arduino_rpc.retry.Retrier
+            Retry engine, with per-method retry counters.
+
+        .. versionadded:: 1.17
+        '''
+        from .retry import Retrier
+
+        self.disable_retries()
+        self._retrier = Retrier(self, idempotency=idempotency,
+                                max_retries=max_retries, backoff_s=backoff_s,
+                                max_backoff_s=max_backoff_s,
+                                retry_timeouts=retry_timeouts).install()
+        return self._retrier
+
+    def disable_retries(self):
+        '''
+        Stop retrying failed calls.
+
+        .. versionadded:: 1.17
+        '''
+        if self._retrier is not None:
+            self._retrier.uninstall()
+            self._retrier = None
+
+    def negotiate_link(self, baud_rates=None, **kwargs):
+        '''
+        Negotiate packet size and baud rate with the device, and optionally
+        cache the negotiated settings per device serial number (see
+        `arduino_rpc.link.negotiate_link`).
+
+        The packet size of the proxy is set to the packet buffer size of the
+        device, and both sides are switched to the fastest baud rate
+        supported by the device (and by the host, if `baud_rates` is set)
+        which passes an echo test.
+
+        Returns
+        -------
+
+        arduino_rpc.link.LinkSettings or None
+            Negotiated settings, or `None` if the device does not support
+            link negotiation (in which case only `max_request_payload_size`
+            is set, if the device has a `max_payload_size` method).
+
+        .. versionadded:: 1.17
+        '''
+        from .link import negotiate_link
+
+        return negotiate_link(self, baud_rates=baud_rates, **kwargs)
+
+    def fetch_manifest(self, timeout_s=None):
+        '''
+        Read the signature manifest embedded in the firmware of the device
+        (see `arduino_rpc.manifest.fetch_manifest`).
+
+        Returns
+        -------
+
+        dict
+            Manifest of the device, e.g., to build a matching proxy class
+            with `arduino_rpc.manifest.proxy_class`, or to check that a
+            generated proxy matches the firmware.
+
+        .. versionadded:: 1.17
+        '''
+        from .manifest import fetch_manifest
+
+        return fetch_manifest(self, timeout_s=timeout_s)
+
+    def start_trace(self, path):
+        '''
+        Record every byte written to and read from the serial port to a
+        binary trace file (see `arduino_rpc.trace`), e.g., to replay a field
+        session offline.
+
+        Records are queued by the calling thread and written to the file by a
+        background thread, so tracing does not block calls on file I/O.
+
+        Returns
+        -------
+
+        arduino_rpc.trace.TraceWriter
+            Trace writer.
+
+        .. versionadded:: 1.17
+        '''
+        from .trace import TraceWriter, TracingPort
+
+        if isinstance(self._serial, TracingPort):
+            raise RuntimeError('Trace is already running.')
+        writer = TraceWriter(path)
+        self._serial = TracingPort(self._serial, writer)
+        return writer
+
+    def stop_trace(self):
+        '''
+        Stop recording (see `start_trace`) and close the trace file.
+
+        .. versionadded:: 1.17
+        '''
+        from .trace import TracingPort
+
+        port = self._serial
+        if isinstance(port, TracingPort):
+            self._serial = port.port
+            port.writer.close()
+
+    @property
+    def futures(self):
+        '''
+        Proxy methods which queue the call for the I/O thread and return a
+        `concurrent.futures.Future` (see `start_io_thread`).
+
+        .. versionadded:: 1.17
+        '''
+        from .threaded import FutureMethods
+
+        return FutureMethods(self)
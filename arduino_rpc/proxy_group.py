@@ -0,0 +1,161 @@
+'''
+Call the same method on many devices at once.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+import pandas as pd
+
+from .proxy import _bind_out, _fragments_response, _get_codec
+
+
+class _FragmentedCall(object):
+    # Pending fragments of a request (see `ProxyBase._submit_fragmented`).
+    def __init__(self, calls, decode):
+        self._calls = calls
+        self._decode = decode
+
+    def result(self):
+        return self._decode(_fragments_response(self._calls))
+
+
+class _CompletedCall(object):
+    # Result of a call which has already completed.
+    def __init__(self, function, *args, **kwargs):
+        self._result = None
+        self._exception = None
+        try:
+            self._result = function(*args, **kwargs)
+        except Exception as exception:
+            self._exception = exception
+
+    def result(self):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class ProxyGroup(object):
+    '''
+    Group of proxies (e.g., one per board in a rack of identical boards).
+
+    Calling a method on the group sends the request to *every* device before
+    waiting for any response, so the wall time of a call is roughly that of
+    the slowest device, rather than the sum over all devices.
+
+    For example:
+
+        def open_proxy(port):
+            proxy = Proxy()
+            proxy._serial = Serial(port)
+            return proxy
+
+        group = ProxyGroup([open_proxy(port) for port in ports],
+                           index=ports)
+        group.set_x(1.5)
+        df_ram = group.ram_free()
+
+    Each call returns a `pandas.DataFrame` indexed by device, with a `result`
+    column holding the decoded response of each device and an `error` column
+    holding the exception raised for each device (or `None`).  A failure
+    (e.g., a timeout or disconnected port) only affects the row of the
+    corresponding device.
+
+    Requests are sent through the I/O thread of a proxy, if running (see
+    `ProxyBase.futures`), and requests longer than the maximum request payload
+    size of a device are sent as `CMD_FRAGMENT` requests.  A method wrapped
+    per proxy instance (e.g., by `enable_cache`, `enable_coalescing`,
+    `enable_compression` or `enable_retries`) is called through the wrapper
+    instead, which waits for the response of that device before the request
+    is sent to the next device.
+
+    Arguments
+    ---------
+
+     - `proxies`: Sequence of `ProxyBase` instances.
+     - `index`: Device labels (default: position in `proxies`).
+    '''
+    def __init__(self, proxies, index=None):
+        self.proxies = list(proxies)
+        if index is None:
+            index = range(len(self.proxies))
+        self.index = pd.Index(index, name='device')
+        if len(self.index) != len(self.proxies):
+            raise ValueError('Expected one index label per proxy.')
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def _submit(self, proxy, name, args, kwargs, timeout_s):
+        if name in proxy.__dict__:
+            # Method is wrapped per instance.
+            return _CompletedCall(getattr(proxy, name), *args,
+                                  timeout_s=timeout_s, **kwargs)
+        if getattr(proxy, '_io_thread', None) is not None:
+            return getattr(proxy.futures, name)(*args, timeout_s=timeout_s,
+                                                **kwargs)
+        encode, decode = _get_codec(proxy, name)
+        decode = _bind_out(decode, kwargs)
+        payload_data = encode(*args, **kwargs)
+        if len(payload_data) > proxy._get_max_request_payload_size():
+            return _FragmentedCall(proxy._submit_fragmented(payload_data,
+                                                            timeout_s),
+                                   decode)
+        packet = cPacket(data=payload_data, type_=PACKET_TYPES.DATA)
+        return proxy._submit(packet, decode, timeout_s=timeout_s)
+
+    def call(self, name, *args, **kwargs):
+        '''
+        Call the named method with the same arguments on every device.
+
+        Arguments
+        ---------
+
+         - `name`: Name of proxy method.
+         - `timeout_s`: Seconds to wait for each response (keyword only,
+           optional).
+
+        Returns
+        -------
+
+        pandas.DataFrame
+            Indexed by device, with `result` and `error` columns.
+        '''
+        timeout_s = kwargs.pop('timeout_s', None)
+        calls = []
+        errors = []
+
+        # Send the request to every device before waiting for any response.
+        for proxy in self.proxies:
+            try:
+                calls.append(self._submit(proxy, name, args, dict(kwargs),
+                                          timeout_s))
+                errors.append(None)
+            except Exception as exception:
+                calls.append(None)
+                errors.append(exception)
+
+        results = []
+        for i, call in enumerate(calls):
+            result = None
+            if call is not None:
+                try:
+                    result = call.result()
+                except Exception as exception:
+                    errors[i] = exception
+            results.append(result)
+        return pd.DataFrame({'result': pd.Series(results, index=self.index),
+                             'error': pd.Series(errors, index=self.index,
+                                                dtype=object)},
+                            columns=['result', 'error'])
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not self.proxies:
+            raise AttributeError(name)
+
+        def _fanned_out(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        _fanned_out.__name__ = name
+        return _fanned_out
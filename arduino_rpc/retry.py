@@ -0,0 +1,181 @@
+'''
+Retry failed calls to idempotent methods (see `ProxyBase.enable_retries`).
+
+Each method of a proxy belongs to an idempotency class:
+
+ - `IDEMPOTENT`: Calling the method twice has the same effect as calling it
+   once (e.g., a getter, or a setter of an absolute value), so a failed call
+   may be repeated, even if the device processed the failed request.
+ - `UNSAFE`: Repeating the call may change the outcome (e.g., appending to a
+   buffer, or toggling an output), so a failed call is never repeated.
+
+By default, the methods in `_IDEMPOTENT_METHODS` of a generated proxy (i.e.,
+the getters of the device class; see
+`arduino_rpc.rpc_data_frame.get_idempotent_methods`) are idempotent, and all
+other methods are unsafe.
+
+A call to an idempotent method is retried after a `NACK`
+(`CommandNackError`), a corrupted response (`PacketParseError`, e.g., a CRC
+error) or a timeout (`CommandTimeoutError`).  Before each retry, the retrier
+waits with bounded exponential backoff, and resynchronizes the receive state
+of the proxy (see `ProxyBase._resync`) without reopening the serial port.
+
+Like call statistics (see `arduino_rpc.stats`), retries wrap methods of a
+proxy *instance*, and only idempotent methods are wrapped.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import threading
+import time
+
+from .packet_stream import PacketParseError
+from .proxy import CommandNackError, CommandTimeoutError
+
+
+#: Idempotency class of methods which may be retried.
+IDEMPOTENT = 'idempotent'
+#: Idempotency class of methods which are never retried.
+UNSAFE = 'unsafe'
+
+
+class MethodRetries(object):
+    '''
+    Retry counters of a single method.
+    '''
+    __slots__ = ('retries', 'recovered', 'failures')
+
+    def __init__(self):
+        #: Number of retried attempts.
+        self.retries = 0
+        #: Number of calls which succeeded after at least one retry.
+        self.recovered = 0
+        #: Number of calls which failed after `max_retries` retries.
+        self.failures = 0
+
+
+class Retrier(object):
+    '''
+    Retry engine of a proxy.
+
+    Arguments
+    ---------
+
+     - `proxy`: Generated proxy.
+     - `idempotency`: Mapping from method name to idempotency class, which
+       overrides the default classes.
+     - `max_retries`: Maximum number of retries per call.
+     - `backoff_s`: Seconds to wait before the first retry (doubled for each
+       subsequent retry of the same call).
+     - `max_backoff_s`: Maximum seconds to wait before a retry.
+     - `retry_timeouts`: If `False`, calls which time out are not retried.
+    '''
+    def __init__(self, proxy, idempotency=None, max_retries=3,
+                 backoff_s=0.005, max_backoff_s=0.1, retry_timeouts=True):
+        self.proxy = proxy
+        classes = dict((name, IDEMPOTENT)
+                       for name in proxy._IDEMPOTENT_METHODS)
+        for name, class_ in (idempotency or {}).items():
+            if class_ not in (IDEMPOTENT, UNSAFE):
+                raise ValueError('Unknown idempotency class `%s` of method '
+                                 '`%s`.' % (class_, name))
+            classes[name] = class_
+        self.idempotency = classes
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.retry_on = ((CommandNackError, PacketParseError,
+                          CommandTimeoutError) if retry_timeouts
+                         else (CommandNackError, PacketParseError))
+        #: Retry counters of each idempotent method.
+        self.methods = dict((name, MethodRetries())
+                            for name, class_ in classes.items()
+                            if class_ == IDEMPOTENT)
+        self._lock = threading.Lock()
+        # `(name, previous instance attribute)` of each wrapped method.
+        self._wrapped = []
+
+    def install(self):
+        '''
+        Wrap the idempotent methods of the proxy instance.
+        '''
+        proxy = self.proxy
+        for name in sorted(self.methods):
+            method = getattr(proxy, name, None)
+            if method is None:
+                continue
+            wrapper = self._retrying(name, method)
+            wrapper.__name__ = method.__name__
+            wrapper.__doc__ = method.__doc__
+            # Wrappers installed earlier (e.g., by `enable_cache`) are
+            # restored on `uninstall`.
+            self._wrapped.append((name, proxy.__dict__.get(name)))
+            setattr(proxy, name, wrapper)
+        return self
+
+    def uninstall(self):
+        for name, previous in self._wrapped:
+            if previous is None:
+                self.proxy.__dict__.pop(name, None)
+            else:
+                setattr(self.proxy, name, previous)
+        self._wrapped = []
+
+    def delay(self, retry):
+        '''
+        Returns
+        -------
+
+        float
+            Seconds to wait before the specified retry (starting at 1).
+        '''
+        return min(self.backoff_s * (1 << (retry - 1)), self.max_backoff_s)
+
+    def _retrying(self, name, method):
+        proxy = self.proxy
+        command = getattr(proxy, '_CMD_' + name.upper())
+        counters = self.methods[name]
+        retry_on = self.retry_on
+
+        def _retrying_method(*args, **kwargs):
+            retry = 0
+            while True:
+                try:
+                    result = method(*args, **kwargs)
+                except retry_on:
+                    if retry >= self.max_retries:
+                        with self._lock:
+                            counters.failures += 1
+                        raise
+                    retry += 1
+                    with self._lock:
+                        counters.retries += 1
+                    if proxy._stats is not None:
+                        proxy._stats.record_retry(command)
+                    time.sleep(self.delay(retry))
+                    proxy._resync()
+                    continue
+                if retry:
+                    with self._lock:
+                        counters.recovered += 1
+                return result
+        return _retrying_method
+
+    def to_frame(self):
+        '''
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per idempotent method, indexed by method name, with
+            retry, recovered call and failed call counts.
+        '''
+        import pandas as pd
+
+        columns = list(MethodRetries.__slots__)
+        with self._lock:
+            index = sorted(self.methods)
+            rows = [[getattr(self.methods[name], column)
+                     for column in columns] for name in index]
+        return pd.DataFrame(rows, columns=columns,
+                            index=pd.Index(index, name='method'))
@@ -1,15 +1,17 @@
 from __future__ import absolute_import
 from __future__ import print_function
 from collections import OrderedDict
+import struct
 
 import jinja2
 import numpy as np
 from . import get_library_directory
-from .dtypes import NP_STD_INT_TYPE, STD_ARRAY_TYPES
+from .commands import RESERVED_COMMANDS
+from .dtypes import NP_STD_INT_TYPE, NP_STRUCT_FORMATS, STD_ARRAY_TYPES
 
 
 def get_c_commands_header_code(df_sig_info, namespace, extra_header=None,
-                               extra_footer=None, **kwargs):
+                               extra_footer=None, manifest=None, **kwargs):
     # TODO: Update doc string to reflect generating commands header
     '''
     Generate C++ command processor header code, which decodes a command from an
@@ -24,12 +26,26 @@ def get_c_commands_header_code(df_sig_info, namespace, extra_header=None,
      - `namespace`: Namespace to wrap `CommandProcessor` header in.
      - `extra_header`: Extra text to insert before the namespace (optional).
      - `extra_footer`: Extra text to insert after the namespace (optional).
+     - `manifest`: Signature manifest to embed in the firmware, and serve
+       with the built-in `CMD_MANIFEST` command (optional; see
+       `arduino_rpc.manifest.get_manifest`).  On AVR, the manifest is stored
+       in program memory.
+
+    .. versionchanged:: 1.17
+        Add `manifest` argument.
     '''
     template = jinja2.Template(r'''
 #ifndef ___{{ namespace.upper() }}__COMMANDS___
 #define ___{{ namespace.upper() }}__COMMANDS___
 
 #include "CArrayDefs.h"
+{%- if manifest_data is not none %}
+#ifdef __AVR__
+#include <avr/pgmspace.h>
+#elif !defined(PROGMEM)
+#define PROGMEM
+#endif
+{%- endif %}
 
 {% if extra_header is not none %}
 {{ extra_header }}
@@ -55,6 +71,23 @@ typedef struct __attribute__((packed)) {
 static const int CMD_{{ method_name.upper() }} = {{ '0x%02x' % method_i }};
 {%- endfor %}
 
+/* Built-in commands. */
+{%- for name, code in reserved_commands.items() %}
+static const int CMD_{{ name }} = {{ '0x%04x' % code }};
+{%- endfor %}
+{%- if manifest_data is not none %}
+
+/* Signature manifest (see `arduino_rpc.manifest`), served by the built-in
+ * `CMD_MANIFEST` command. */
+#define {{ namespace.upper() }}__HAS_MANIFEST
+static const uint32_t MANIFEST_LENGTH = {{ manifest_data|length }};
+static const uint8_t MANIFEST[] PROGMEM = {
+{%- for i in range(0, manifest_data|length, 12) %}
+  {{ manifest_data[i:i + 12]|map('string')|join(', ') }},
+{%- endfor %}
+};
+{%- endif %}
+
 }  // namespace {{ namespace }}
 
 {% if extra_footer is not none %}
@@ -63,9 +96,17 @@ static const int CMD_{{ method_name.upper() }} = {{ '0x%02x' % method_i }};
 
 #endif  // ifndef ___{{ namespace.upper() }}__COMMANDS___
 '''.strip())
+    if isinstance(manifest, dict):
+        from .manifest import dumps_manifest
+
+        manifest = dumps_manifest(manifest)
     return template.render(df_sig_info=df_sig_info, namespace=namespace,
                            extra_header=extra_header,
-                           extra_footer=extra_footer, **kwargs)
+                           extra_footer=extra_footer,
+                           reserved_commands=RESERVED_COMMANDS,
+                           manifest_data=None if manifest is None
+                           else list(bytearray(manifest.encode('utf8'))),
+                           **kwargs)
 
 
 def get_c_command_processor_header_code(df_sig_info, namespace,
@@ -85,11 +126,20 @@ def get_c_command_processor_header_code(df_sig_info, namespace,
      - `namespace`: Namespace to wrap `CommandProcessor` header in.
      - `extra_header`: Extra text to insert before the namespace (optional).
      - `extra_footer`: Extra text to insert after the namespace (optional).
+
+    .. versionchanged:: 1.17
+        Handle built-in `CMD_BATCH`, `CMD_FRAGMENT`, `CMD_STREAM`,
+        `CMD_LINK`, `CMD_ENCODED` and `CMD_MANIFEST` commands (see
+        `arduino_rpc.commands`).  `CMD_LINK` and `CMD_ENCODED` requests
+        are only handled if `ENABLE_LINK_NEGOTIATION` and
+        `ENABLE_ENCODED_REQUESTS` are defined, respectively.
     '''
     template = jinja2.Template(r'''
 #ifndef ___{{ namespace.upper() }}__COMMAND_PROCESSOR___
 #define ___{{ namespace.upper() }}__COMMAND_PROCESSOR___
 
+#include <stdint.h>
+#include <string.h>
 #include "CArrayDefs.h"
 #include "Commands.h"
 
@@ -97,6 +147,33 @@ def get_c_command_processor_header_code(df_sig_info, namespace,
 {{ extra_header }}
 {% endif %}
 
+#ifndef STREAM_REQUEST_SIZE
+/* Longest request which may be streamed (see `CMD_STREAM`).  Also bounds the
+ * length of a scalar response to a streamed request.
+ *
+ * Streaming is disabled by default, since the stream buffers take
+ * `2 * STREAM_REQUEST_SIZE` bytes of RAM.  Define as non-zero (e.g., 32) to
+ * enable streaming. */
+#define STREAM_REQUEST_SIZE 0
+#endif  // #ifndef STREAM_REQUEST_SIZE
+
+/* Define `ENABLE_LINK_NEGOTIATION` to handle `CMD_LINK` requests (i.e., to
+ * let the host query the buffer sizes and change the baud rate).  Link
+ * negotiation is disabled by default, to save program memory and RAM, in
+ * which case every `CMD_LINK` request fails. */
+#ifdef ENABLE_LINK_NEGOTIATION
+#ifndef LINK_CONFIRM_TIMEOUT_US
+/* Time for the host to confirm a new baud rate (see `CMD_LINK`) before the
+ * previous baud rate is restored. */
+#define LINK_CONFIRM_TIMEOUT_US 500000
+#endif  // #ifndef LINK_CONFIRM_TIMEOUT_US
+#endif  // #ifdef ENABLE_LINK_NEGOTIATION
+
+/* Define `ENABLE_ENCODED_REQUESTS` to handle `CMD_ENCODED` requests (i.e.,
+ * compressed array arguments and results).  Encoded requests are disabled by
+ * default, to save program memory, in which case every `CMD_ENCODED` request
+ * fails (and the host sends uncompressed requests instead). */
+
 namespace {{ namespace }} {
 
 template <typename Obj>
@@ -109,10 +186,399 @@ class CommandProcessor {
    * a response.  If the integer return value of the call is zero, the call is
    * assumed to have no response required.  Otherwise, the arguments contain
    * must contain response values. */
+public:
+  /* Callback to process request fragments (see `set_fragment_callback`). */
+  typedef UInt8Array (*fragment_callback_t)(uint32_t offset,
+                                            uint32_t total_length,
+                                            UInt8Array fragment,
+                                            UInt8Array buffer);
+  /* Callback to switch the serial port to a baud rate (see
+   * `set_baud_rates`). */
+  typedef void (*baud_rate_callback_t)(uint32_t baud_rate);
+  /* Operations of `CMD_LINK` requests. */
+  enum { LINK_QUERY = 0, LINK_SET_BAUD_RATE = 1, LINK_CONFIRM = 2,
+         LINK_ECHO = 3 };
+  /* Array encodings of `CMD_ENCODED` requests (see
+   * `arduino_rpc.compression`). */
+  enum { ENCODING_NONE = 0, ENCODING_DELTA = 1, ENCODING_RLE = 2,
+         ENCODING_OVERFLOW = 0xFF };
 protected:
   Obj &obj_;
+  UInt8Array staging_buffer_;
+  uint32_t staged_length_;
+  fragment_callback_t fragment_callback_;
+#if STREAM_REQUEST_SIZE > 0
+  /* Request to run on every stream period (see `CMD_STREAM`). */
+  uint8_t stream_request_[STREAM_REQUEST_SIZE];
+  /* Copy of the stream request to process (processing a request may modify
+   * it in place), which also holds the response. */
+  uint8_t stream_buffer_[STREAM_REQUEST_SIZE];
+  uint16_t stream_request_length_;
+  uint16_t stream_id_;
+  uint32_t stream_period_us_;
+  uint32_t stream_next_us_;
+  bool stream_restart_;
+#endif  // #if STREAM_REQUEST_SIZE > 0
+#ifdef ENABLE_LINK_NEGOTIATION
+  /* Baud rates the host may select (see `CMD_LINK`). */
+  UInt32Array baud_rates_;
+  baud_rate_callback_t baud_rate_callback_;
+  uint32_t baud_rate_;
+  /* Baud rate to restore if the current baud rate is not confirmed. */
+  uint32_t confirmed_baud_rate_;
+  /* Baud rate to switch to once the response to the request is sent. */
+  uint32_t pending_baud_rate_;
+  uint32_t link_deadline_us_;
+  bool link_restart_;
+#endif  // #ifdef ENABLE_LINK_NEGOTIATION
 public:
-  CommandProcessor(Obj &obj) : obj_(obj) {}
+  CommandProcessor(Obj &obj) : obj_(obj), staged_length_(0),
+                               fragment_callback_(NULL)
+#if STREAM_REQUEST_SIZE > 0
+                               , stream_request_length_(0), stream_id_(0),
+                               stream_period_us_(0), stream_next_us_(0),
+                               stream_restart_(false)
+#endif  // #if STREAM_REQUEST_SIZE > 0
+#ifdef ENABLE_LINK_NEGOTIATION
+                               , baud_rate_callback_(NULL), baud_rate_(0),
+                               confirmed_baud_rate_(0), pending_baud_rate_(0),
+                               link_deadline_us_(0), link_restart_(false)
+#endif  // #ifdef ENABLE_LINK_NEGOTIATION
+                               {
+    staging_buffer_.data = NULL;
+    staging_buffer_.length = 0;
+#ifdef ENABLE_LINK_NEGOTIATION
+    baud_rates_.data = NULL;
+    baud_rates_.length = 0;
+#endif  // #ifdef ENABLE_LINK_NEGOTIATION
+  }
+
+  void set_staging_buffer(UInt8Array staging_buffer) {
+    /* Set buffer to assemble requests which are too long to fit in a single
+     * packet (see `CMD_FRAGMENT`).  Requests up to the length of the staging
+     * buffer are supported. */
+    staging_buffer_ = staging_buffer;
+    staged_length_ = 0;
+  }
+
+  void set_fragment_callback(fragment_callback_t fragment_callback) {
+    /* Set function to pass each request fragment to, as it is received, if
+     * no staging buffer is set (e.g., to stream bulk data to external
+     * memory).  The value returned by the callback is the response to the
+     * fragment. */
+    fragment_callback_ = fragment_callback;
+  }
+
+#ifdef ENABLE_LINK_NEGOTIATION
+  void set_baud_rates(UInt32Array baud_rates, uint32_t baud_rate,
+                      baud_rate_callback_t baud_rate_callback) {
+    /* Set the baud rates the host may select (see `CMD_LINK`), the current
+     * baud rate, and the function to switch the serial port to a baud rate
+     * (e.g., `Serial.flush(); Serial.begin(baud_rate);`).  The callback is
+     * called once the response to the request has been written. */
+    baud_rates_ = baud_rates;
+    baud_rate_ = confirmed_baud_rate_ = baud_rate;
+    baud_rate_callback_ = baud_rate_callback;
+  }
+
+  void apply_baud_rate() {
+    /* Switch to the baud rate selected by the last request, if any.  The
+     * new baud rate is restored to the previous baud rate by `poll_link`
+     * unless confirmed by the host within `LINK_CONFIRM_TIMEOUT_US`. */
+    if (pending_baud_rate_ == 0) { return; }
+    baud_rate_ = pending_baud_rate_;
+    pending_baud_rate_ = 0;
+    link_restart_ = true;
+    baud_rate_callback_(baud_rate_);
+  }
+
+  void poll_link(uint32_t now_us) {
+    /* Restore the previous baud rate if the host did not confirm the current
+     * baud rate in time (e.g., the link is unreliable at the new rate). */
+    if (baud_rate_ == confirmed_baud_rate_) { return; }
+    if (link_restart_) {
+      link_deadline_us_ = now_us + LINK_CONFIRM_TIMEOUT_US;
+      link_restart_ = false;
+    }
+    if (static_cast<int32_t>(now_us - link_deadline_us_) >= 0) {
+      baud_rate_ = confirmed_baud_rate_;
+      baud_rate_callback_(baud_rate_);
+    }
+  }
+#else  // #ifdef ENABLE_LINK_NEGOTIATION
+  /* Link negotiation is disabled, i.e., the baud rate is never changed. */
+  void set_baud_rates(UInt32Array baud_rates, uint32_t baud_rate,
+                      baud_rate_callback_t baud_rate_callback) {}
+  void apply_baud_rate() {}
+  void poll_link(uint32_t now_us) {}
+#endif  // #ifdef ENABLE_LINK_NEGOTIATION
+
+#ifdef ENABLE_ENCODED_REQUESTS
+  static bool overlaps(UInt8Array array, const uint8_t *data,
+                       uint32_t length) {
+    return (array.data != NULL && data < array.data + array.length &&
+            array.data < data + length);
+  }
+
+  static bool decode_array(uint8_t encoding, uint8_t type, const uint8_t *in,
+                           uint32_t length, uint8_t *out,
+                           uint32_t out_length) {
+    /* Decode `length` bytes of encoded array data to exactly `out_length`
+     * bytes.  Elements are little-endian. */
+    uint32_t i = 0;
+    uint32_t o = 0;
+    if (encoding == ENCODING_NONE) {
+      if (length != out_length) { return false; }
+      memmove(out, in, length);
+      return true;
+    } else if (encoding == ENCODING_RLE) {
+      while (i < length) {
+        uint8_t control = in[i++];
+        uint32_t count;
+        if (control < 0x80) {
+          count = control + 1;
+          if (i + count > length || o + count > out_length) { return false; }
+          memmove(&out[o], &in[i], count);
+          i += count;
+        } else {
+          count = control - 0x80 + 3;
+          if (i >= length || o + count > out_length) { return false; }
+          memset(&out[o], in[i++], count);
+        }
+        o += count;
+      }
+      return o == out_length;
+    } else if (encoding == ENCODING_DELTA) {
+      uint8_t size = type & 0x7F;
+      if (size == 0 || size > 4 || out_length % size != 0) { return false; }
+      uint32_t value = 0;
+      for (; o < out_length; o += size) {
+        /* Zig-zag encoded difference from previous element (varint). */
+        uint32_t zigzag = 0;
+        uint8_t shift = 0;
+        uint8_t byte;
+        do {
+          if (i >= length || shift > 28) { return false; }
+          byte = in[i++];
+          zigzag |= static_cast<uint32_t>(byte & 0x7F) << shift;
+          shift += 7;
+        } while (byte & 0x80);
+        value += (zigzag >> 1) ^ (0 - (zigzag & 1));
+        memcpy(&out[o], &value, size);
+      }
+      return i == length;
+    }
+    return false;
+  }
+
+  static uint32_t encode_array(uint8_t encoding, uint8_t type,
+                               const uint8_t *in, uint32_t length,
+                               uint8_t *out) {
+    /* Encode array data, or only compute the encoded size if `out` is
+     * `NULL`.  Returns `0xFFFFFFFF` if the encoding does not apply. */
+    uint32_t i = 0;
+    uint32_t o = 0;
+    if (encoding == ENCODING_RLE) {
+      while (i < length) {
+        uint32_t run = 1;
+        while (i + run < length && run < 0x7F + 3 &&
+               in[i + run] == in[i]) { run++; }
+        if (run >= 3) {
+          if (out != NULL) {
+            out[o] = 0x80 + run - 3;
+            out[o + 1] = in[i];
+          }
+          o += 2;
+          i += run;
+        } else {
+          /* Literal bytes, up to the next run of at least 3 bytes. */
+          uint32_t count = 0;
+          while (i + count < length && count < 0x80 &&
+                 !(i + count + 2 < length &&
+                   in[i + count] == in[i + count + 1] &&
+                   in[i + count] == in[i + count + 2])) { count++; }
+          if (out != NULL) {
+            out[o] = count - 1;
+            memcpy(&out[o + 1], &in[i], count);
+          }
+          o += count + 1;
+          i += count;
+        }
+      }
+      return o;
+    } else if (encoding == ENCODING_DELTA) {
+      uint8_t size = type & 0x7F;
+      if (size == 0 || size > 4 || length % size != 0) { return 0xFFFFFFFF; }
+      uint32_t previous = 0;
+      for (; i < length; i += size) {
+        uint32_t value = 0;
+        memcpy(&value, &in[i], size);
+        /* Difference as a signed value of the element width. */
+        int32_t delta = static_cast<int32_t>((value - previous) <<
+                                             (32 - 8 * size)) >>
+            (32 - 8 * size);
+        previous = value;
+        uint32_t zigzag = (static_cast<uint32_t>(delta) << 1) ^
+            static_cast<uint32_t>(delta >> 31);
+        do {
+          if (out != NULL) {
+            out[o] = (zigzag & 0x7F) | (zigzag > 0x7F ? 0x80 : 0);
+          }
+          o++;
+          zigzag >>= 7;
+        } while (zigzag);
+      }
+      return o;
+    }
+    return 0xFFFFFFFF;
+  }
+
+  UInt8Array decode_request(UInt8Array request_arr, UInt8Array buffer) {
+    /* Decode a `CMD_ENCODED` request to the staging buffer (if set),
+     * otherwise to `buffer`.  If the request is in the destination buffer,
+     * it is first moved to the end of the destination buffer, so the
+     * decoded request must fit in front of it.  Returns a `NULL` array if
+     * the request is malformed or does not fit. */
+    UInt8Array output;
+    output.data = NULL;
+    output.length = 0;
+    uint16_t header_length;
+    memcpy(&header_length, &request_arr.data[3], 2);
+    uint32_t encoded_length = request_arr.length - 5;
+    const uint8_t *in = &request_arr.data[5];
+    if (header_length < 2 || header_length > encoded_length) {
+      return output;
+    }
+    UInt8Array destination = ((staging_buffer_.data != NULL) ?
+                              staging_buffer_ : buffer);
+    uint8_t *limit = destination.data + destination.length;
+    if (overlaps(destination, request_arr.data, request_arr.length)) {
+      if (encoded_length > destination.length) { return output; }
+      limit -= encoded_length;
+      memmove(limit, in, encoded_length);
+      in = limit;
+    }
+    const uint8_t *end = in + encoded_length;
+    uint8_t *out = destination.data;
+    if (header_length > static_cast<uint32_t>(limit - out)) { return output; }
+    memmove(out, in, header_length);
+    out += header_length;
+    in += header_length;
+    while (in < end) {
+      if (end - in < 10) { return output; }
+      uint32_t decoded_length;
+      uint32_t segment_length;
+      memcpy(&decoded_length, &in[2], 4);
+      memcpy(&segment_length, &in[6], 4);
+      if (segment_length > static_cast<uint32_t>(end - in - 10) ||
+          decoded_length > static_cast<uint32_t>(limit - out) ||
+          !decode_array(in[0], in[1], &in[10], segment_length, out,
+                        decoded_length)) {
+        return output;
+      }
+      out += decoded_length;
+      in += 10 + segment_length;
+    }
+    output.data = destination.data;
+    output.length = out - destination.data;
+    return output;
+  }
+
+  UInt8Array encode_result(UInt8Array result, uint8_t type,
+                           UInt8Array buffer) {
+    /* Encode an array result with the encoding giving the smallest
+     * response, prefixed with the encoding, in the staging buffer (if set
+     * and not holding the result), otherwise in `buffer` (after the result,
+     * if the result is in `buffer`). */
+    UInt8Array region = ((staging_buffer_.data != NULL &&
+                          !overlaps(staging_buffer_, result.data,
+                                    result.length)) ? staging_buffer_
+                         : buffer);
+    uint8_t *start = region.data;
+    if (overlaps(region, result.data, result.length)) {
+      start = result.data + result.length;
+    }
+    uint32_t capacity = ((start < region.data + region.length) ?
+                         region.data + region.length - start : 0);
+    uint8_t encoding = ENCODING_NONE;
+    uint32_t size = result.length;
+    for (uint8_t e = ENCODING_DELTA; e <= ENCODING_RLE; e++) {
+      uint32_t encoded_size = encode_array(e, type, result.data,
+                                           result.length, NULL);
+      if (encoded_size < size && encoded_size < capacity) {
+        encoding = e;
+        size = encoded_size;
+      }
+    }
+    UInt8Array output;
+    if (encoding != ENCODING_NONE) {
+      start[0] = encoding;
+      encode_array(encoding, type, result.data, result.length, &start[1]);
+      output.data = start;
+      output.length = size + 1;
+    } else if (overlaps(buffer, result.data - 1, 1) ||
+               overlaps(staging_buffer_, result.data - 1, 1)) {
+      /* Prefix the result in place (the preceding byte is not in use). */
+      output.data = result.data - 1;
+      output.data[0] = ENCODING_NONE;
+      output.length = result.length + 1;
+    } else if (result.length < capacity) {
+      memmove(&start[1], result.data, result.length);
+      start[0] = ENCODING_NONE;
+      output.data = start;
+      output.length = result.length + 1;
+    } else {
+      buffer.data[0] = ENCODING_OVERFLOW;
+      output.data = buffer.data;
+      output.length = 1;
+    }
+    return output;
+  }
+#endif  // #ifdef ENABLE_ENCODED_REQUESTS
+
+#if STREAM_REQUEST_SIZE > 0
+  uint16_t stream_id() const { return stream_id_; }
+
+  bool stream_due(uint32_t now_us) {
+    /* Return `true` if the stream request (see `CMD_STREAM`) is due to run
+     * at the specified time (e.g., `micros()`). */
+    if (stream_period_us_ == 0) { return false; }
+    if (stream_restart_) {
+      stream_next_us_ = now_us;
+      stream_restart_ = false;
+    }
+    /* Wrap-safe comparison. */
+    return static_cast<int32_t>(now_us - stream_next_us_) >= 0;
+  }
+
+  UInt8Array process_stream(uint32_t now_us) {
+    /* Run the stream request and schedule the next run.  If more than a
+     * period behind (e.g., after a long command), missed runs are skipped
+     * rather than run back-to-back. */
+    stream_next_us_ += stream_period_us_;
+    if (static_cast<int32_t>(now_us - stream_next_us_) >= 0) {
+      stream_next_us_ = now_us + stream_period_us_;
+    }
+    memcpy(stream_buffer_, stream_request_, stream_request_length_);
+    UInt8Array request;
+    request.data = stream_buffer_;
+    request.length = stream_request_length_;
+    UInt8Array buffer;
+    buffer.data = stream_buffer_;
+    buffer.length = sizeof(stream_buffer_);
+    return process_command(request, buffer);
+  }
+#else  // #if STREAM_REQUEST_SIZE > 0
+  /* Streaming is disabled, i.e., a stream request is never due. */
+  uint16_t stream_id() const { return 0; }
+  bool stream_due(uint32_t now_us) { return false; }
+  UInt8Array process_stream(uint32_t now_us) {
+    UInt8Array result;
+    result.data = NULL;
+    result.length = 0xFFFFFFFF;
+    return result;
+  }
+#endif  // #if STREAM_REQUEST_SIZE > 0
 
   UInt8Array process_command(UInt8Array request_arr, UInt8Array buffer) {
     /* ## Call operator ##
@@ -139,7 +605,7 @@ public:
     {% if df_method_i.ndims.max() > 0 %}
             /* Add relative array data offsets to start payload structure. */
     {% for i, array_i in df_method_i[df_method_i.ndims > 0].iterrows() %}
-            request.{{ array_i['arg_name'] }}.data = ({{ array_i.atom_type }} *)((uint8_t *)&request + (unsigned int)request.{{ array_i['arg_name'] }}.data);
+            request.{{ array_i['arg_name'] }}.data = ({{ array_i.atom_type }} *)((uint8_t *)&request + (uintptr_t)request.{{ array_i['arg_name'] }}.data);
     {%- endfor %}
     {%- endif -%}
 
@@ -173,6 +639,316 @@ public:
           }
           break;
 {% endfor %}
+        case CMD_BATCH:
+          {
+            /* Run each length-prefixed request in the batch, in order, and
+             * write the concatenated length-prefixed responses to the start
+             * of the buffer.
+             *
+             * The requests are first moved to the end of the buffer, such
+             * that each response may be written over the requests which have
+             * already been processed. */
+            result.data = NULL;
+            result.length = 0xFFFFFFFF;
+            if (request_arr.length < 2 ||
+                request_arr.length - 2 > buffer.length) {
+              break;
+            }
+            uint32_t requests_length = request_arr.length - 2;
+            uint8_t *requests = &buffer.data[buffer.length - requests_length];
+            memmove(requests, &request_arr.data[2], requests_length);
+
+            uint32_t offset = 0;
+            uint32_t output_length = 0;
+            while (offset + 2 <= requests_length) {
+              uint16_t request_length;
+              memcpy(&request_length, &requests[offset], 2);
+              offset += 2;
+              if (offset + request_length > requests_length) { break; }
+
+              UInt8Array sub_request;
+              sub_request.data = &requests[offset];
+              sub_request.length = request_length;
+              offset += request_length;
+
+              /* Response may use the space up to the start of the next
+               * request. */
+              UInt8Array sub_buffer;
+              sub_buffer.data = &buffer.data[output_length + 2];
+              sub_buffer.length = &requests[offset] - sub_buffer.data;
+
+              uint16_t response_length = 0xFFFF;
+              uint16_t sub_command = CMD_BATCH;
+              if (request_length >= 2) {
+                memcpy(&sub_command, sub_request.data, 2);
+              }
+              if (sub_command != CMD_BATCH) {
+                UInt8Array sub_result = process_command(sub_request,
+                                                        sub_buffer);
+                if (sub_result.data != NULL &&
+                    sub_result.length <= sub_buffer.length) {
+                  memmove(sub_buffer.data, sub_result.data,
+                          sub_result.length);
+                  response_length = sub_result.length;
+                }
+              }
+              memcpy(&buffer.data[output_length], &response_length, 2);
+              output_length += 2;
+              if (response_length != 0xFFFF) {
+                output_length += response_length;
+              }
+            }
+            result.data = buffer.data;
+            result.length = output_length;
+          }
+          break;
+        case CMD_FRAGMENT:
+          {
+            /* Fragment of a request which is too long to fit in a single
+             * packet:
+             *
+             *     uint16_t command;
+             *     uint32_t offset;  // Offset of fragment in request.
+             *     uint32_t total_length;  // Length of complete request.
+             *     uint8_t data[];  // Fragment data.
+             *
+             * Fragments are copied to the staging buffer and the complete
+             * request is processed once the last fragment is received.  Each
+             * other fragment is acknowledged with an empty response. */
+            result.data = NULL;
+            result.length = 0xFFFFFFFF;
+            if (request_arr.length < 10) { break; }
+            uint32_t offset;
+            uint32_t total_length;
+            memcpy(&offset, &request_arr.data[2], 4);
+            memcpy(&total_length, &request_arr.data[6], 4);
+            UInt8Array fragment;
+            fragment.data = &request_arr.data[10];
+            fragment.length = request_arr.length - 10;
+
+            if (staging_buffer_.data == NULL) {
+              if (fragment_callback_ != NULL) {
+                result = fragment_callback_(offset, total_length, fragment,
+                                            buffer);
+              }
+              break;
+            }
+            if (offset == 0) { staged_length_ = 0; }
+            if (offset != staged_length_ ||
+                total_length > staging_buffer_.length ||
+                fragment.length > total_length - offset) {
+              /* Fragment is out of order, or request does not fit. */
+              staged_length_ = 0;
+              break;
+            }
+            memcpy(&staging_buffer_.data[offset], fragment.data,
+                   fragment.length);
+            staged_length_ += fragment.length;
+            if (staged_length_ < total_length) {
+              result.data = buffer.data;
+              result.length = 0;
+            } else {
+              UInt8Array staged_request;
+              staged_request.data = staging_buffer_.data;
+              staged_request.length = total_length;
+              staged_length_ = 0;
+              uint16_t staged_command;
+              memcpy(&staged_command, staged_request.data, 2);
+              if (total_length >= 2 && staged_command != CMD_FRAGMENT) {
+                result = process_command(staged_request, buffer);
+              }
+            }
+          }
+          break;
+        case CMD_STREAM:
+          {
+            /* Start (or stop) running a request periodically:
+             *
+             *     uint16_t command;
+             *     uint16_t stream_id;  // Tag of pushed responses.
+             *     uint32_t period_us;  // Zero to stop the stream.
+             *     uint8_t request[];  // Request to run on every period.
+             *
+             * The response to each run is pushed by
+             * `CommandPacketHandler::poll_stream`.  A single stream is
+             * active at a time, i.e., a new stream replaces the active
+             * stream.
+             *
+             * If streaming is disabled (i.e., `STREAM_REQUEST_SIZE` is zero),
+             * every stream request fails. */
+            result.data = NULL;
+            result.length = 0xFFFFFFFF;
+#if STREAM_REQUEST_SIZE > 0
+            if (request_arr.length < 8) { break; }
+            uint16_t stream_id;
+            uint32_t period_us;
+            memcpy(&stream_id, &request_arr.data[2], 2);
+            memcpy(&period_us, &request_arr.data[4], 4);
+            if (period_us == 0) {
+              if (stream_id == stream_id_) { stream_period_us_ = 0; }
+            } else {
+              uint16_t stream_length = request_arr.length - 8;
+              uint16_t stream_command;
+              if (stream_length < 2 || stream_length > STREAM_REQUEST_SIZE) {
+                break;
+              }
+              memcpy(&stream_command, &request_arr.data[8], 2);
+              if (stream_command >= CMD_BATCH) {
+                /* Built-in commands may not be streamed. */
+                break;
+              }
+              memcpy(stream_request_, &request_arr.data[8], stream_length);
+              stream_request_length_ = stream_length;
+              stream_id_ = stream_id;
+              stream_period_us_ = period_us;
+              stream_restart_ = true;
+            }
+            result.data = buffer.data;
+            result.length = 0;
+#endif  // #if STREAM_REQUEST_SIZE > 0
+          }
+          break;
+        case CMD_LINK:
+          {
+            /* Query or change serial link settings:
+             *
+             *     uint16_t command;
+             *     uint8_t operation;  // `LINK_QUERY`, `LINK_SET_BAUD_RATE`, ...
+             *     uint8_t data[];  // Operation data.
+             *
+             * `LINK_QUERY` responds with the packet buffer size
+             * (`uint16_t`), the staging buffer size (`uint32_t`), the
+             * current baud rate (`uint32_t`), and the supported baud rates
+             * (`uint32_t` each).
+             *
+             * `LINK_SET_BAUD_RATE` (data: `uint32_t` baud rate) switches to
+             * the baud rate once the (empty) response is sent.
+             * `LINK_CONFIRM` confirms the current baud rate and responds with
+             * it (`uint32_t`).  `LINK_ECHO` responds with the request data
+             * (e.g., to test the link at a new baud rate).
+             *
+             * If link negotiation is disabled (i.e.,
+             * `ENABLE_LINK_NEGOTIATION` is not defined), every link request
+             * fails. */
+            result.data = NULL;
+            result.length = 0xFFFFFFFF;
+#ifdef ENABLE_LINK_NEGOTIATION
+            if (request_arr.length < 3) { break; }
+            uint8_t operation = request_arr.data[2];
+            if (operation == LINK_QUERY) {
+              uint32_t length = 10 + 4 * baud_rates_.length;
+              if (length > buffer.length) { break; }
+              uint16_t packet_size = buffer.length;
+              uint32_t staging_size = staging_buffer_.length;
+              memcpy(&buffer.data[0], &packet_size, 2);
+              memcpy(&buffer.data[2], &staging_size, 4);
+              memcpy(&buffer.data[6], &baud_rate_, 4);
+              if (baud_rates_.length > 0) {
+                memcpy(&buffer.data[10], baud_rates_.data,
+                       4 * baud_rates_.length);
+              }
+              result.data = buffer.data;
+              result.length = length;
+            } else if (operation == LINK_SET_BAUD_RATE) {
+              if (request_arr.length < 7 || baud_rate_callback_ == NULL) {
+                break;
+              }
+              uint32_t baud_rate;
+              memcpy(&baud_rate, &request_arr.data[3], 4);
+              for (uint16_t i = 0; i < baud_rates_.length; i++) {
+                if (baud_rates_.data[i] == baud_rate) {
+                  pending_baud_rate_ = baud_rate;
+                  result.data = buffer.data;
+                  result.length = 0;
+                  break;
+                }
+              }
+            } else if (operation == LINK_CONFIRM) {
+              confirmed_baud_rate_ = baud_rate_;
+              memcpy(&buffer.data[0], &baud_rate_, 4);
+              result.data = buffer.data;
+              result.length = 4;
+            } else if (operation == LINK_ECHO) {
+              result.data = &request_arr.data[3];
+              result.length = request_arr.length - 3;
+            }
+#endif  // #ifdef ENABLE_LINK_NEGOTIATION
+          }
+          break;
+        case CMD_ENCODED:
+          {
+            /* Request with compressed array data (see
+             * `arduino_rpc.compression`):
+             *
+             *     uint16_t command;
+             *     uint8_t result_type;  // Encode array result if non-zero.
+             *     uint16_t header_length;
+             *     uint8_t header[header_length];  // Command and structure.
+             *     // One segment per array argument, in order:
+             *     uint8_t encoding;
+             *     uint8_t type;  // Element size (`| 0x80` if signed).
+             *     uint32_t decoded_length;
+             *     uint32_t encoded_length;
+             *     uint8_t data[encoded_length];
+             *
+             * The decoded request may use the staging buffer, so encoded
+             * requests must not be interleaved with fragmented requests.
+             *
+             * If encoded requests are disabled (i.e.,
+             * `ENABLE_ENCODED_REQUESTS` is not defined), every encoded
+             * request fails. */
+            result.data = NULL;
+            result.length = 0xFFFFFFFF;
+#ifdef ENABLE_ENCODED_REQUESTS
+            if (request_arr.length < 5) { break; }
+            uint8_t result_type = request_arr.data[2];
+            UInt8Array decoded = decode_request(request_arr, buffer);
+            if (decoded.data == NULL) { break; }
+            uint16_t decoded_command;
+            memcpy(&decoded_command, decoded.data, 2);
+            if (decoded_command >= CMD_BATCH) {
+              /* Built-in commands may not be encoded. */
+              break;
+            }
+            result = process_command(decoded, buffer);
+            if (result_type != 0 && result.data != NULL) {
+              result = encode_result(result, result_type, buffer);
+            }
+#endif  // #ifdef ENABLE_ENCODED_REQUESTS
+          }
+          break;
+        case CMD_MANIFEST:
+          {
+            /* Read the signature manifest embedded by the commands header
+             * (see `arduino_rpc.manifest`):
+             *
+             *     uint16_t command;
+             *     uint32_t offset;  // Of the first manifest byte to read.
+             *
+             * Responds with the manifest length (`uint32_t`), followed by
+             * as many manifest bytes from `offset` as fit in the buffer. */
+            result.data = NULL;
+            result.length = 0xFFFFFFFF;
+#ifdef {{ namespace.upper() }}__HAS_MANIFEST
+            if (request_arr.length < 6 || buffer.length < 4) { break; }
+            uint32_t offset;
+            memcpy(&offset, &request_arr.data[2], 4);
+            uint32_t length = ((offset < MANIFEST_LENGTH)
+                               ? MANIFEST_LENGTH - offset : 0);
+            if (length > buffer.length - 4) { length = buffer.length - 4; }
+            memcpy(&buffer.data[0], &MANIFEST_LENGTH, 4);
+            if (length > 0) {
+#ifdef __AVR__
+              memcpy_P(&buffer.data[4], &MANIFEST[offset], length);
+#else
+              memcpy(&buffer.data[4], &MANIFEST[offset], length);
+#endif
+            }
+            result.data = buffer.data;
+            result.length = 4 + length;
+#endif  // #ifdef {{ namespace.upper() }}__HAS_MANIFEST
+          }
+          break;
       default:
         result.length = 0xFFFFFFFF;
         result.data = NULL;
@@ -181,6 +957,13 @@ public:
   }
 };
 
+template <typename Obj>
+inline void apply_baud_rate(CommandProcessor<Obj> &processor) {
+  /* Found by argument-dependent lookup from
+   * `CommandPacketHandler::process_packet`. */
+  processor.apply_baud_rate();
+}
+
 }  // namespace {{ namespace }}
 
 {% if extra_footer is not none %}
@@ -195,7 +978,8 @@ public:
 
 
 def get_python_code(df_sig_info, extra_header=None, extra_footer=None,
-                    pointer_width=16):
+                    pointer_width=16, async_proxy=False, cache_policy=None,
+                    idempotent=None, runtime='numpy'):
     '''
     Generate Python `Proxy` class, with one method for each corresponding
     method signature in `df_sig_info`.  Each method on the `Proxy` class:
@@ -205,6 +989,14 @@ def get_python_code(df_sig_info, extra_header=None, extra_footer=None,
      - Sends command to remote device.
      - Decodes the result into Python types.
 
+    The encoding and decoding steps of each method `<name>` are also available
+    separately as `_encode_<name>` and `_decode_<name>`, respectively (used,
+    e.g., to pipeline calls; see `ProxyBase.pipeline`).  These are defined on
+    a `ProxyCodec` class, which is shared by all generated proxy classes.
+
+    Each method also accepts an optional `timeout_s` keyword argument, which
+    overrides the `response_timeout_s` of the proxy for that call.
+
     Arguments
     ---------
 
@@ -212,6 +1004,35 @@ def get_python_code(df_sig_info, extra_header=None, extra_footer=None,
        returned by `arduino_rpc.code_gen.get_multilevel_method_sig_frame`).
      - `extra_header`: Extra text to insert before class definition (optional).
      - `extra_footer`: Extra text to insert after class definition (optional).
+     - `async_proxy`: If `True`, also generate an `AsyncProxy` class, with
+       one coroutine method per command, based on
+       `arduino_rpc.async_proxy.AsyncProxyBase` (requires Python 3.7+).
+     - `cache_policy`: Results which may be cached (see `get_cache_policy`),
+       in addition to the results of `const` methods.
+     - `idempotent`: Methods which may safely be retried (see
+       `get_idempotent_methods`), in addition to `const` methods.
+     - `runtime`: Either `'numpy'` (default), to encode arguments from, and
+       decode results to, `numpy` arrays and scalars, or `'struct'`, to
+       depend only on the standard library (and `nadamq`), using
+       `array.array` for arrays and Python numbers for scalars (see
+       `arduino_rpc.struct_codec`).  Generated modules import
+       `google.protobuf` in neither case.
+
+    .. versionchanged:: 1.17
+        Add `async_proxy`, `cache_policy`, `idempotent` and `runtime`
+        arguments.
+
+        Raise `CommandNackError` when decoding a `NACK` response.
+
+        Encode requests using `struct` layouts computed at generation time
+        (see `get_request_layouts`), rather than building `pandas` and `numpy`
+        structures on each call.  Array data offsets are now computed in
+        bytes (rather than elements).
+
+        Decode responses using `numpy.frombuffer` views.  Methods returning
+        an array accept an optional `out` keyword argument to decode the
+        response into a preallocated array; otherwise, the result array is
+        taken from the `buffer_pool` of the proxy.
     '''
     # TODO: The size of an `*Array` struct depends on the architecture.
     #
@@ -226,17 +1047,32 @@ def get_python_code(df_sig_info, extra_header=None, extra_footer=None,
     # Take a pointer bit-width as an argument, `pointer_width=32`.
     template = jinja2.Template(r'''
 from builtins import bytes
+from functools import partial
+import struct
+import sys
 import types
-import pandas as pd
+{%- if runtime == 'numpy' %}
 import numpy as np
+{%- endif %}
 from nadamq.NadaMq import cPacket, PACKET_TYPES
-from arduino_rpc.proxy import ProxyBase
-try:
-    from google.protobuf.message import Message
-    _translate = (lambda arg: arg.SerializeToString()
-                  if isinstance(arg, Message) else arg)
-except ImportError:
-    _translate = lambda arg: arg
+{%- if runtime == 'numpy' %}
+from arduino_rpc.codec import as_array, decode_array, request_buffer
+{%- else %}
+from arduino_rpc.struct_codec import array_bytes, pack_array, unpack_array
+{%- endif %}
+from arduino_rpc.proxy import CommandNackError, ProxyBase
+{%- if async_proxy %}
+from arduino_rpc.async_proxy import AsyncProxyBase
+{%- endif %}
+
+
+def _translate(arg):
+    # Serialize protocol buffer messages.  `google.protobuf` is not imported
+    # here: an argument may only be a message if the caller imported it.
+    message = sys.modules.get('google.protobuf.message')
+    if message is not None and isinstance(arg, message.Message):
+        return arg.SerializeToString()
+    return arg
 
 
 {% if extra_header is not none %}
@@ -244,84 +1080,367 @@ except ImportError:
 {% endif %}
 
 
-class Proxy(ProxyBase):
+class ProxyCodec(object):
+    """
+    Command codes, request encoders, and response decoders shared by the
+    generated proxy classes.
+    """
 
 {% for i, (method_i, method_name) in df_sig_info.drop_duplicates(subset='method_i')[['method_i', 'method_name']].iterrows() %}
     _CMD_{{ method_name.upper() }} = {{ '0x%02x' % method_i }}
 {%- endfor %}
     MAX_COMMAND_CODE = {{ df_sig_info.method_i.max() }}
 
+    # Size of the response of each method (in bytes), or `None` if the
+    # response is an array.
+    _RESPONSE_SIZES = {
+{%- for method_name, size in response_sizes.items() %}
+        '{{ method_name }}': {{ size }},
+{%- endfor %}
+    }
+
+    # Methods whose results may be cached (see `ProxyBase.enable_cache`):
+    # `(time to live in seconds, names of methods which invalidate the
+    # result)`.  `None` means no expiry, or any method not in the policy,
+    # respectively.
+    _CACHE_POLICY = {
+{%- for method_name, (ttl_s, invalidated_by) in cache_policy.items() %}
+        '{{ method_name }}': ({{ ttl_s }}, {{ invalidated_by }}),
+{%- endfor %}
+    }
+
+    # Offset of the length field in the request, and `numpy` type, of each
+    # array argument, and `numpy` type of each array result (see
+    # `ProxyBase.enable_compression`).
+    _ARRAY_ARGS = {
+{%- for method_name, layout in request_layouts.items() if layout.arrays %}
+        '{{ method_name }}': ({% for arg_name, np_type in layout.arrays %}({{ layout.array_length_offsets[loop.index0] }}, '{{ np_type }}'), {% endfor %}),
+{%- endfor %}
+    }
+    _ARRAY_RESULTS = {
+{%- for method_name, np_type in array_results.items() %}
+        '{{ method_name }}': '{{ np_type }}',
+{%- endfor %}
+    }
+
+    # Argument names of each method (e.g., to bind keyword arguments of cached
+    # calls; see `ProxyBase.enable_cache`).
+    _ARG_NAMES = {
+{%- for (method_i, method_name, arg_count), df_method_i in df_sig_info.groupby(['method_i', 'method_name', 'arg_count']) %}
+        '{{ method_name }}': ({% if arg_count > 0 %}{% for arg_name in df_method_i.arg_name %}'{{ arg_name }}', {% endfor %}{% endif %}),
+{%- endfor %}
+    }
+
+    # Methods which may safely be retried (see `ProxyBase.enable_retries`).
+    _IDEMPOTENT_METHODS = ({% for method_name in idempotent_methods %}'{{ method_name }}', {% endfor %})
+
 {% for (method_i, method_name, camel_name, arg_count), df_method_i in df_sig_info.groupby(['method_i', 'method_name', 'camel_name', 'arg_count']) %}
-    def {{ method_name }}(self{% if arg_count > 0 %}, {{ ', '.join(df_method_i.arg_name) }}{% endif %}):
-        command = np.dtype('uint16').type(self._CMD_{{ method_name.upper() }})
+{%- set layout = request_layouts[method_name] %}
 {%- if arg_count > 0 %}
-        ARG_STRUCT_SIZE = {{ df_method_i.struct_size.sum() }}
-{%- if df_method_i.ndims.max() > 0 %}
-{% for i, array_i in df_method_i[df_method_i.ndims > 0].iterrows() %}
-        {{ array_i['arg_name'] }} = _translate({{ array_i['arg_name'] }})
-        if isinstance({{ array_i['arg_name'] }}, str):
-            {{ array_i['arg_name'] }} = map(ord, {{ array_i['arg_name'] }})
-        elif isinstance({{ array_i['arg_name'] }}, bytes):
-            {{ array_i['arg_name'] }} = list(bytes({{ array_i['arg_name'] }}))
-        # Argument is an array, so cast to appropriate array type.
-        {{ array_i['arg_name'] }} = np.ascontiguousarray({{ array_i['arg_name'] }}, dtype='{{ array_i.atom_np_type }}')
+    _STRUCT_{{ method_name.upper() }} = struct.Struct('{{ layout.struct_format }}')
+{%- else %}
+    _REQUEST_{{ method_name.upper() }} = {{ layout.request }}
+{%- endif %}
+{%- if runtime == 'struct' and df_method_i.return_atom_type.iloc[0] is not none and df_method_i.return_ndims.iloc[0] == 0 %}
+    _RESULT_{{ method_name.upper() }} = struct.Struct('<{{ struct_formats[df_method_i.return_atom_np_type.iloc[0]] }}')
+{%- endif %}
+
+    def _encode_{{ method_name }}(self{% if arg_count > 0 %}, {{ ', '.join(df_method_i.arg_name) }}{% endif %}):
+{%- if arg_count == 0 %}
+        return self._REQUEST_{{ method_name.upper() }}
+{%- elif not layout.arrays %}
+        return self._STRUCT_{{ method_name.upper() }}.pack(self._CMD_{{ method_name.upper() }}, {{ ', '.join(layout.fields) }})
+{%- elif runtime == 'struct' %}
+{%- for arg_name, np_type in layout.arrays %}
+        {{ arg_name }} = pack_array(_translate({{ arg_name }}), '{{ struct_formats[np_type] }}')
 {%- endfor %}
-        array_info = pd.DataFrame([
-{%- for arg_name in df_method_i.loc[df_method_i.ndims > 0, 'arg_name'] -%}
-        {{ arg_name }}.shape[0], {% endfor -%}],
-                                  index=[
-{%- for arg_name in df_method_i.loc[df_method_i.ndims > 0, 'arg_name'] -%}
-        '{{ arg_name }}', {% endfor -%}],
-                                  columns=['length'])
-        array_info['start'] = array_info.length.cumsum() - array_info.length
-        array_data = b''.join([
-{%- for arg_name in df_method_i.loc[df_method_i.ndims > 0, 'arg_name'] -%}
-        {{ arg_name }}.tostring(), {% endfor -%}])
+        # Array data follows the request structure; offsets are relative to
+        # the start of the request structure.
+{%- for arg_name, np_type in layout.arrays %}
+{%- if loop.first %}
+        _{{ arg_name }}_offset = {{ layout.arg_struct_size }}
 {%- else %}
-        array_data = b''
+        _{{ arg_name }}_offset = _{{ loop.previtem[0] }}_offset + len({{ loop.previtem[0] }}) * {{ loop.previtem[0] }}.itemsize
 {%- endif %}
-        payload_size = ARG_STRUCT_SIZE + len(array_data)
-        struct_data = np.array([(
-{%- for i, (arg_name, ndims, np_atom_type) in df_method_i[['arg_name', 'ndims', 'atom_np_type']].iterrows() -%}
-{%- if ndims > 0 -%}
-        array_info.length['{{ arg_name }}'], ARG_STRUCT_SIZE + array_info.start['{{ arg_name }}'], {# #}
-{%- else -%}
-        {{ arg_name }}, {# #}
-{%- endif -%}
-{% endfor %})],
-                               dtype=[
-{%- for i, (arg_name, ndims, np_atom_type) in df_method_i[['arg_name', 'ndims', 'atom_np_type']].iterrows() -%}
-{%- if ndims > 0 -%}
-        ('{{ arg_name }}_length', 'uint32'), ('{{ arg_name }}_data', 'uint{{ pointer_width }}'), {% else -%}
-        ('{{ arg_name }}', '{{ np_atom_type }}'), {% endif %}{% endfor %}])
-        payload_data = struct_data.tostring() + array_data
+{%- endfor %}
+        return b''.join((self._STRUCT_{{ method_name.upper() }}.pack(self._CMD_{{ method_name.upper() }}, {{ ', '.join(layout.fields) }}),
+                         {% for arg_name, np_type in layout.arrays %}array_bytes({{ arg_name }}), {% endfor %}))
+{%- else %}
+{%- for arg_name, np_type in layout.arrays %}
+        {{ arg_name }} = as_array(_translate({{ arg_name }}), '{{ np_type }}')
+{%- endfor %}
+        # Array data follows the request structure; offsets are relative to
+        # the start of the request structure.
+{%- for arg_name, np_type in layout.arrays %}
+{%- if loop.first %}
+        _{{ arg_name }}_offset = {{ layout.arg_struct_size }}
 {%- else %}
-        payload_size = 0
-        payload_data = b''
+        _{{ arg_name }}_offset = _{{ loop.previtem[0] }}_offset + {{ loop.previtem[0] }}.nbytes
+{%- endif %}
+{%- endfor %}
+{%- set last_array = layout.arrays[-1][0] %}
+        _size = 2 + _{{ last_array }}_offset + {{ last_array }}.nbytes
+        _buffer = request_buffer(_size)
+        self._STRUCT_{{ method_name.upper() }}.pack_into(_buffer, 0, self._CMD_{{ method_name.upper() }}, {{ ', '.join(layout.fields) }})
+{%- for arg_name, np_type in layout.arrays %}
+        _buffer[2 + _{{ arg_name }}_offset:2 + _{{ arg_name }}_offset + {{ arg_name }}.nbytes] = {{ arg_name }}.view('uint8')
+{%- endfor %}
+        return _buffer[:_size].tobytes()
 {%- endif %}
 
-        payload_data = command.tostring() + payload_data
-        packet = cPacket(data=payload_data, type_=PACKET_TYPES.DATA)
-        response = self._send_command(packet)
-{% if df_method_i.return_atom_type.iloc[0] is not none %}
-        result = np.fromstring(response.data(), dtype='{{ df_method_i.return_atom_np_type.iloc[0] }}')
-{% if df_method_i.return_ndims.iloc[0] > 0 %}
+    def _decode_{{ method_name }}(self, response{% if df_method_i.return_ndims.iloc[0] > 0 %}, out=None{% endif %}):
+        if response.type_ == PACKET_TYPES.NACK:
+            raise CommandNackError('Device rejected `{{ method_name }}` request.')
+{%- if df_method_i.return_atom_type.iloc[0] is not none %}
+{%- if df_method_i.return_ndims.iloc[0] > 0 and runtime == 'struct' %}
+        return unpack_array(response.data(), '{{ struct_formats[df_method_i.return_atom_np_type.iloc[0]] }}', out=out)
+{%- elif runtime == 'struct' %}
+        return self._RESULT_{{ method_name.upper() }}.unpack_from(response.data())[0]
+{%- elif df_method_i.return_ndims.iloc[0] > 0 %}
         # Return type is an array, so return entire array.
-        return result
-{% else %}
+        return decode_array(response.data(), '{{ df_method_i.return_atom_np_type.iloc[0] }}', out=out,
+                            pool=getattr(self, 'buffer_pool', None))
+{%- else %}
         # Return type is a scalar, so return first entry in array.
-        return result[0]
-{% endif %}{% endif %}
+        return np.frombuffer(response.data(), dtype='{{ df_method_i.return_atom_np_type.iloc[0] }}')[0]
+{%- endif %}
+{%- else %}
+        return None
+{%- endif %}
+{% endfor %}
+
+
+class Proxy(ProxyCodec, ProxyBase):
+{% for (method_i, method_name, camel_name, arg_count), df_method_i in df_sig_info.groupby(['method_i', 'method_name', 'camel_name', 'arg_count']) %}
+{%- set returns_array = df_method_i.return_ndims.iloc[0] > 0 %}
+    def {{ method_name }}(self{% if arg_count > 0 %}, {{ ', '.join(df_method_i.arg_name) }}{% endif %}, timeout_s=None{% if returns_array %}, out=None{% endif %}):
+{%- if arg_count > 0 %}
+{%- if returns_array %}
+        decode = (self._decode_{{ method_name }} if out is None
+                  else partial(self._decode_{{ method_name }}, out=out))
+{%- endif %}
+        return self._call(self._encode_{{ method_name }}({{ ', '.join(df_method_i.arg_name) }}),
+                          {% if returns_array %}decode{% else %}self._decode_{{ method_name }}{% endif %}, timeout_s=timeout_s)
+{%- else %}
+        packet = self._command_packet(self._REQUEST_{{ method_name.upper() }})
+        return self._decode_{{ method_name }}(self._send_command(packet, timeout_s=timeout_s){% if returns_array %}, out=out{% endif %})
+{%- endif %}
 {% endfor %}
+{%- if async_proxy %}
+
+
+class AsyncProxy(ProxyCodec, AsyncProxyBase):
+{% for (method_i, method_name, camel_name, arg_count), df_method_i in df_sig_info.groupby(['method_i', 'method_name', 'camel_name', 'arg_count']) %}
+{%- set returns_array = df_method_i.return_ndims.iloc[0] > 0 %}
+    async def {{ method_name }}(self{% if arg_count > 0 %}, {{ ', '.join(df_method_i.arg_name) }}{% endif %}, timeout_s=None{% if returns_array %}, out=None{% endif %}):
+{%- if arg_count > 0 %}
+{%- if returns_array %}
+        decode = (self._decode_{{ method_name }} if out is None
+                  else partial(self._decode_{{ method_name }}, out=out))
+{%- endif %}
+        return await self._call(self._encode_{{ method_name }}({{ ', '.join(df_method_i.arg_name) }}),
+                                {% if returns_array %}decode{% else %}self._decode_{{ method_name }}{% endif %}, timeout_s=timeout_s)
+{%- else %}
+        packet = self._command_packet(self._REQUEST_{{ method_name.upper() }})
+        return self._decode_{{ method_name }}(await self._send_command(packet, timeout_s=timeout_s){% if returns_array %}, out=out{% endif %})
+{%- endif %}
+{% endfor %}
+{%- endif %}
 
 
 {% if extra_footer is not none %}
 {{ extra_footer }}
 {% endif %}
 '''.strip())
+    if runtime not in ('numpy', 'struct'):
+        raise ValueError('Unknown runtime `%s`.' % runtime)
     return template.render(df_sig_info=df_sig_info, extra_header=extra_header,
                            extra_footer=extra_footer,
-                           pointer_width=pointer_width)
+                           pointer_width=pointer_width, runtime=runtime,
+                           struct_formats=dict(NP_STRUCT_FORMATS),
+                           async_proxy=async_proxy,
+                           request_layouts=get_request_layouts(df_sig_info,
+                                                               pointer_width),
+                           response_sizes=get_response_sizes(df_sig_info),
+                           array_results=OrderedDict(
+                               (method_name,
+                                df_method_i.return_atom_np_type.iloc[0])
+                               for (method_i, method_name), df_method_i in
+                               df_sig_info.groupby(['method_i',
+                                                    'method_name'])
+                               if df_method_i.return_ndims.iloc[0] > 0),
+                           cache_policy=get_cache_policy(df_sig_info,
+                                                         cache_policy),
+                           idempotent_methods=
+                           get_idempotent_methods(df_sig_info, idempotent))
+
+
+def get_request_layouts(df_sig_info, pointer_width=16):
+    '''
+    Return the layout of the serialized request of each method in
+    `df_sig_info`, as used by the generated request encoders.
+
+    Returns
+    -------
+
+    OrderedDict
+        Keyed by method name, each layout is a `dict` with:
+
+         - `struct_format`: `struct` format of the command code followed by
+           the request structure.
+         - `arg_struct_size`: Size of the request structure (in bytes).
+         - `fields`: Python expression for each request structure field (after
+           the command code).
+         - `arrays`: `(argument name, numpy type)` of each array argument,
+           in the order the array data follows the request structure.
+         - `array_length_offsets`: Offset of the length field of each array
+           argument in the serialized request.
+         - `request`: Python literal of the complete serialized request (only
+           for methods without arguments).
+
+    .. versionadded:: 1.17
+    '''
+    pointer_format = NP_STRUCT_FORMATS['uint%d' % pointer_width]
+    layouts = OrderedDict()
+    for (method_i, method_name), df_method_i in (df_sig_info
+                                                 .groupby(['method_i',
+                                                           'method_name'])):
+        struct_format = '<H'
+        fields = []
+        arrays = []
+        array_length_offsets = []
+        if df_method_i.arg_count.iloc[0] > 0:
+            for i, arg_i in df_method_i.iterrows():
+                if arg_i.ndims > 0:
+                    # `*Array` structure: `length`, followed by `data`
+                    # pointer (sent as an offset).
+                    array_length_offsets.append(struct.calcsize(struct_format))
+                    struct_format += 'I' + pointer_format
+                    fields += ['len(%s)' % arg_i.arg_name,
+                               '_%s_offset' % arg_i.arg_name]
+                    arrays.append((arg_i.arg_name, arg_i.atom_np_type))
+                else:
+                    struct_format += NP_STRUCT_FORMATS[arg_i.atom_np_type]
+                    if np.dtype(arg_i.atom_np_type).kind in 'iu':
+                        # Truncate floats (as the previous `numpy` encoding
+                        # did).
+                        fields.append('int(%s)' % arg_i.arg_name)
+                    else:
+                        fields.append(arg_i.arg_name)
+        layout = {'struct_format': struct_format,
+                  'arg_struct_size': struct.calcsize(struct_format) - 2,
+                  'fields': fields, 'arrays': arrays,
+                  'array_length_offsets': array_length_offsets}
+        if not fields:
+            layout['request'] = repr(struct.pack('<H', method_i))
+        layouts[method_name] = layout
+    return layouts
+
+
+def get_cache_policy(df_sig_info, cache_policy=None):
+    '''
+    Return the cache policy of the methods in `df_sig_info`.
+
+    By default, the result of each `const` method (i.e., rows with a true
+    `is_const` value) returning a value may be cached until any non-`const`
+    method is called.
+
+    Arguments
+    ---------
+
+     - `df_sig_info`: Method signature frame.
+     - `cache_policy`: Mapping from method name to `(ttl_s, invalidated_by)`
+       (see below), which overrides the default policy.  A value of `None`
+       disables caching of the method.
+
+    Returns
+    -------
+
+    OrderedDict
+        Mapping from method name to `(ttl_s, invalidated_by)`, where `ttl_s`
+        is the time to live of a cached result (`None` for no expiry), and
+        `invalidated_by` is a tuple of names of the methods which invalidate
+        a cached result (`None` for any method not in the policy).
+
+    .. versionadded:: 1.17
+    '''
+    policy = OrderedDict()
+    if 'is_const' in df_sig_info:
+        for method_name, df_method_i in df_sig_info.groupby('method_name',
+                                                            sort=False):
+            method_i = df_method_i.iloc[0]
+            if method_i.is_const and method_i.return_atom_type is not None:
+                policy[method_name] = (None, None)
+    for method_name, method_policy in (cache_policy or {}).items():
+        if method_policy is None:
+            policy.pop(method_name, None)
+        else:
+            ttl_s, invalidated_by = method_policy
+            policy[method_name] = (ttl_s, None if invalidated_by is None
+                                   else tuple(invalidated_by))
+    return policy
+
+
+def get_idempotent_methods(df_sig_info, idempotent=None):
+    '''
+    Return the names of the methods in `df_sig_info` which may safely be
+    retried after a failed call (see `ProxyBase.enable_retries`).
+
+    By default, getters are idempotent, i.e., `const` methods returning a
+    value, or methods without arguments returning a value if the frame has no
+    `is_const` column.
+
+    Arguments
+    ---------
+
+     - `df_sig_info`: Method signature frame.
+     - `idempotent`: Mapping from method name to `True` if the method is
+       idempotent (e.g., a setter of an absolute value), or `False` if not,
+       which overrides the default.
+
+    Returns
+    -------
+
+    list
+        Names of idempotent methods.
+
+    .. versionadded:: 1.17
+    '''
+    methods = []
+    for method_name, df_method_i in df_sig_info.groupby('method_name',
+                                                        sort=False):
+        method_i = df_method_i.iloc[0]
+        if 'is_const' in df_sig_info:
+            getter = method_i.is_const
+        else:
+            getter = method_i.arg_count == 0
+        if (idempotent or {}).get(method_name,
+                                  getter and
+                                  method_i.return_atom_type is not None):
+            methods.append(method_name)
+    return methods
+
+
+def get_response_sizes(df_sig_info):
+    '''
+    Return the size of the response (in bytes) of each method in
+    `df_sig_info`, or `None` for methods returning an array.
+
+    .. versionadded:: 1.17
+    '''
+    response_sizes = OrderedDict()
+    for (method_i, method_name), df_method_i in (df_sig_info
+                                                 .groupby(['method_i',
+                                                           'method_name'])):
+        method_i = df_method_i.iloc[0]
+        if method_i.return_atom_type is None:
+            response_sizes[method_name] = 0
+        elif method_i.return_ndims > 0:
+            response_sizes[method_name] = None
+        else:
+            response_sizes[method_name] = \
+                np.dtype(method_i.return_atom_np_type).itemsize
+    return response_sizes
 
 
 def get_struct_sig_info_frame(df_sig_info, pointer_width=16):
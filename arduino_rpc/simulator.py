@@ -0,0 +1,427 @@
+'''
+Simulated device on a pseudo-terminal (Linux/macOS).
+
+The simulated device parses request packets with `nadamq`, decodes each
+request according to the same command codes and request structure layouts
+as the generated `CommandProcessor` (i.e., from the method signature frame
+returned by `arduino_rpc.code_gen.get_multilevel_method_sig_frame`), and calls
+the corresponding method of a Python object.  The built-in `CMD_BATCH`,
+`CMD_FRAGMENT`, `CMD_STREAM`, `CMD_LINK`, `CMD_ENCODED` and `CMD_MANIFEST`
+commands are also supported.
+
+For example:
+
+    class Node(object):
+        def add(self, a, b):
+            return a + b
+
+    with SimulatedDevice(df_sig_info, Node(), baud_rate=115200) as device:
+        proxy = Proxy()
+        proxy._serial = serial.Serial(device.port_name)
+        assert proxy.add(1, 2) == 3
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+import numpy as np
+
+from .commands import (BATCH_HEADER_SIZE, BATCH_ITEM_ERROR,
+                       BATCH_ITEM_HEADER_SIZE, CMD_BATCH, CMD_ENCODED,
+                       CMD_FRAGMENT, CMD_LINK, CMD_MANIFEST, CMD_STREAM,
+                       FRAGMENT_HEADER_SIZE, LINK_CONFIRM, LINK_ECHO,
+                       LINK_HEADER_SIZE, LINK_QUERY, LINK_SET_BAUD_RATE,
+                       MANIFEST_HEADER_SIZE, MANIFEST_REQUEST_SIZE,
+                       PUSH_IUID_FLAG, STREAM_HEADER_SIZE)
+from .compression import decode_request, encode_result
+from .packet_stream import PacketReceiver
+from .proxy import _monotonic
+from .rpc_data_frame import get_request_layouts
+
+
+class MethodHandler(object):
+    '''
+    Decode the request of a single method, call the method, and encode the
+    result.
+    '''
+    def __init__(self, name, layout, df_method, return_dtype):
+        self.name = name
+        self.struct = struct.Struct(layout['struct_format'])
+        # `(is_array, numpy type)` of each argument, in order.
+        self.args = []
+        if df_method.arg_count.iloc[0] > 0:
+            self.args = [(arg_i.ndims > 0, np.dtype(arg_i.atom_np_type))
+                         for i, arg_i in df_method.iterrows()]
+        self.return_dtype = return_dtype
+
+    def __call__(self, obj, request):
+        fields = self.struct.unpack_from(request)[1:]
+        args = []
+        i = 0
+        for is_array, dtype in self.args:
+            if is_array:
+                # Array data offset is relative to the request structure
+                # (i.e., after the command code).
+                length, offset = fields[i:i + 2]
+                start = 2 + offset
+                args.append(np.frombuffer(request[start:start + length *
+                                                  dtype.itemsize],
+                                          dtype=dtype))
+                i += 2
+            else:
+                args.append(dtype.type(fields[i]))
+                i += 1
+        result = getattr(obj, self.name)(*args)
+        if self.return_dtype is None:
+            return b''
+        return np.asarray(result, dtype=self.return_dtype).tobytes()
+
+
+class SimulatedDevice(object):
+    '''
+    Simulated device, served by a thread on the master side of a
+    pseudo-terminal.  Open `port_name` (e.g., with `serial.Serial`) to
+    connect.
+
+    Arguments
+    ---------
+
+     - `df_sig_info`: Method signature frame.
+     - `obj`: Object implementing the methods of the device.  A request for
+       a method the object does not implement (or which raises an exception)
+       is answered with a `NACK`.
+     - `pointer_width`: Pointer width of the device, in bits (determines
+       request structure layouts).
+     - `baud_rate`: If set, data is transferred in each direction at most at
+       this baud rate (assuming 10 bits per byte).
+     - `latency_s`: Processing time of each request.
+     - `packet_size`: Size of the packet buffer of the device.  Longer
+       requests are ignored, as by a device.  `None` for no limit.
+     - `staging_size`: Size of the staging buffer for fragmented requests
+       (see `CMD_FRAGMENT`), or `None` to reject fragments.
+     - `baud_rates`: Baud rates the host may switch to (see `CMD_LINK`).
+       A new baud rate applies to the pacing of transfers (if `baud_rate` is
+       set), and is restored to the previous baud rate unless confirmed
+       within `link_confirm_timeout_s`.
+     - `nack_rate`: Fraction of requests answered with a `NACK` without
+       being processed (e.g., to test `ProxyBase.enable_retries`).
+     - `corrupt_rate`: Fraction of responses sent with a corrupted CRC.
+     - `seed`: Seed of the random fault generator.
+     - `manifest`: Signature manifest to serve with `CMD_MANIFEST` (see
+       `arduino_rpc.manifest.get_manifest`), or `None` to reject manifest
+       requests.
+    '''
+    def __init__(self, df_sig_info, obj, pointer_width=16, baud_rate=None,
+                 latency_s=0, packet_size=None, staging_size=4096,
+                 baud_rates=(), link_confirm_timeout_s=0.5, nack_rate=0,
+                 corrupt_rate=0, seed=None, manifest=None):
+        self.obj = obj
+        if isinstance(manifest, dict):
+            from .manifest import dumps_manifest
+
+            manifest = dumps_manifest(manifest)
+        self.manifest = (None if manifest is None
+                         else manifest.encode('utf8'))
+        self.nack_rate = nack_rate
+        self.corrupt_rate = corrupt_rate
+        self._random = random.Random(seed)
+        self.baud_rate = baud_rate
+        self.baud_rates = list(baud_rates)
+        self.link_confirm_timeout_s = link_confirm_timeout_s
+        # Current link baud rate, and the baud rate to restore (and deadline)
+        # if the current baud rate is not confirmed.
+        self.link_baud_rate = self._confirmed_baud_rate = baud_rate or 0
+        self._pending_baud_rate = None
+        self._link_deadline = None
+        self.latency_s = latency_s
+        self.packet_size = packet_size
+        self.staging_size = staging_size
+        self.handlers = {}
+        layouts = get_request_layouts(df_sig_info, pointer_width)
+        for (method_i, method_name), df_method_i in (df_sig_info
+                                                     .groupby(['method_i',
+                                                               'method_name'])):
+            row = df_method_i.iloc[0]
+            return_dtype = (None if row.return_atom_type is None
+                            else np.dtype(row.return_atom_np_type))
+            self.handlers[method_i] = MethodHandler(method_name,
+                                                    layouts[method_name],
+                                                    df_method_i,
+                                                    return_dtype)
+        self._staging = bytearray()
+        self._stream = None
+        self._master, self._slave = pty.openpty()
+        # Pass bytes through unaltered (e.g., no echo or newline mapping).
+        tty.setraw(self._slave)
+        self.port_name = os.ttyname(self._slave)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='Simulated device')
+        self._thread.daemon = True
+        self._rx_time = self._tx_time = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _transfer_time(self, size):
+        return 0 if self.baud_rate is None else size * 10. / self.baud_rate
+
+    def _sleep_until(self, deadline):
+        remaining = deadline - _monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _write(self, data):
+        if self.baud_rate is None:
+            os.write(self._master, data)
+            return
+        # Pace writes to the baud rate, a millisecond of data at a time.
+        chunk_size = max(1, self.baud_rate // 10000)
+        self._tx_time = max(self._tx_time, _monotonic())
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i + chunk_size]
+            self._tx_time += self._transfer_time(len(chunk))
+            self._sleep_until(self._tx_time)
+            os.write(self._master, chunk)
+
+    def _run(self):
+        receiver = PacketReceiver()
+        while not self._stopping.is_set():
+            timeout = 0.05
+            if self._stream is not None:
+                timeout = max(0, min(timeout, self._stream[2] -
+                                     _monotonic()))
+            if select.select([self._master], [], [], timeout)[0]:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError:
+                    break
+                # Bytes arrive no faster than the baud rate.
+                self._rx_time = (max(self._rx_time, _monotonic()) +
+                                 self._transfer_time(len(data)))
+                receiver.feed(data)
+            if receiver.packets:
+                self._sleep_until(self._rx_time)
+            while receiver.packets:
+                request = receiver.packets.popleft()
+                if isinstance(request, IOError):
+                    continue
+                if (self.packet_size is not None and
+                        len(request.data()) > self.packet_size):
+                    continue
+                if self.latency_s:
+                    time.sleep(self.latency_s)
+                if self.nack_rate and self._random.random() < self.nack_rate:
+                    self._respond(request.iuid, None)
+                    continue
+                self._respond(request.iuid,
+                              self.process_command(request.data()))
+                self._apply_baud_rate()
+            self._poll_stream()
+            self._poll_link()
+
+    def _set_link_baud_rate(self, baud_rate):
+        self.link_baud_rate = baud_rate
+        if self.baud_rate is not None:
+            self.baud_rate = baud_rate
+
+    def _apply_baud_rate(self):
+        if self._pending_baud_rate is None:
+            return
+        # Wait for the response to be sent at the previous baud rate.
+        self._sleep_until(self._tx_time)
+        self._set_link_baud_rate(self._pending_baud_rate)
+        self._pending_baud_rate = None
+        self._link_deadline = _monotonic() + self.link_confirm_timeout_s
+
+    def _poll_link(self):
+        if self._link_deadline is not None and _monotonic() >= \
+                self._link_deadline:
+            self._link_deadline = None
+            self._set_link_baud_rate(self._confirmed_baud_rate)
+
+    def _respond(self, iuid, result):
+        if result is None:
+            packet = cPacket(data=b'', type_=PACKET_TYPES.NACK, iuid=iuid)
+        else:
+            packet = cPacket(data=result, type_=PACKET_TYPES.DATA, iuid=iuid)
+        data = packet.tostring()
+        if (result is not None and self.corrupt_rate and
+                self._random.random() < self.corrupt_rate):
+            # Flip the bits of the last CRC byte.
+            data = bytearray(data)
+            data[-1] ^= 0xFF
+            data = bytes(data)
+        self._write(data)
+
+    def _poll_stream(self):
+        if self._stream is None:
+            return
+        stream_id, period_s, next_time, request = self._stream
+        now = _monotonic()
+        if now < next_time:
+            return
+        # Skip missed periods rather than running them back-to-back.
+        next_time = max(next_time + period_s, now)
+        self._stream = stream_id, period_s, next_time, request
+        result = self.process_command(request)
+        if result is not None:
+            self._respond(PUSH_IUID_FLAG | stream_id, result)
+
+    def process_command(self, request):
+        '''
+        Returns
+        -------
+
+        bytes or None
+            Response to a serialized request, or `None` if the request could
+            not be processed.
+        '''
+        if len(request) < 2:
+            return None
+        command = struct.unpack_from('<H', request)[0]
+        if command == CMD_BATCH:
+            return self._process_batch(request)
+        elif command == CMD_FRAGMENT:
+            return self._process_fragment(request)
+        elif command == CMD_STREAM:
+            return self._process_stream(request)
+        elif command == CMD_LINK:
+            return self._process_link(request)
+        elif command == CMD_ENCODED:
+            return self._process_encoded(request)
+        elif command == CMD_MANIFEST:
+            return self._process_manifest(request)
+        handler = self.handlers.get(command)
+        if handler is None:
+            return None
+        try:
+            return handler(self.obj, request)
+        except Exception:
+            return None
+
+    def _process_batch(self, request):
+        offset = BATCH_HEADER_SIZE
+        output = []
+        while offset + BATCH_ITEM_HEADER_SIZE <= len(request):
+            length = struct.unpack_from('<H', request, offset)[0]
+            offset += BATCH_ITEM_HEADER_SIZE
+            if offset + length > len(request):
+                break
+            sub_request = request[offset:offset + length]
+            offset += length
+            result = (None if sub_request[:2] == request[:2]
+                      else self.process_command(sub_request))
+            if result is None:
+                output.append(struct.pack('<H', BATCH_ITEM_ERROR))
+            else:
+                output.append(struct.pack('<H', len(result)) + result)
+        return b''.join(output)
+
+    def _process_fragment(self, request):
+        if len(request) < FRAGMENT_HEADER_SIZE or self.staging_size is None:
+            return None
+        offset, total_length = struct.unpack_from('<II', request, 2)
+        fragment = request[FRAGMENT_HEADER_SIZE:]
+        if offset == 0:
+            self._staging = bytearray()
+        if (offset != len(self._staging) or
+                total_length > self.staging_size or
+                len(fragment) > total_length - offset):
+            self._staging = bytearray()
+            return None
+        self._staging += fragment
+        if len(self._staging) < total_length:
+            return b''
+        staged = bytes(self._staging)
+        self._staging = bytearray()
+        if staged[:2] == request[:2]:
+            return None
+        return self.process_command(staged)
+
+    def _process_stream(self, request):
+        if len(request) < STREAM_HEADER_SIZE:
+            return None
+        stream_id, period_us = struct.unpack_from('<HI', request, 2)
+        if period_us == 0:
+            if self._stream is not None and self._stream[0] == stream_id:
+                self._stream = None
+            return b''
+        stream_request = request[STREAM_HEADER_SIZE:]
+        if (len(stream_request) < 2 or
+                struct.unpack_from('<H', stream_request)[0] >= CMD_BATCH):
+            return None
+        self._stream = (stream_id, period_us * 1e-6, _monotonic(),
+                        stream_request)
+        return b''
+
+    def _process_link(self, request):
+        if len(request) < LINK_HEADER_SIZE:
+            return None
+        operation = bytearray(request[2:3])[0]
+        data = request[LINK_HEADER_SIZE:]
+        if operation == LINK_QUERY:
+            packet_size = min(self.packet_size or 0xFFFF, 0xFFFF)
+            return (struct.pack('<HII', packet_size, self.staging_size or 0,
+                                self.link_baud_rate) +
+                    struct.pack('<%dI' % len(self.baud_rates),
+                                *self.baud_rates))
+        elif operation == LINK_SET_BAUD_RATE:
+            if len(data) < 4:
+                return None
+            baud_rate = struct.unpack_from('<I', data)[0]
+            if baud_rate not in self.baud_rates:
+                return None
+            self._pending_baud_rate = baud_rate
+            return b''
+        elif operation == LINK_CONFIRM:
+            self._confirmed_baud_rate = self.link_baud_rate
+            self._link_deadline = None
+            return struct.pack('<I', self.link_baud_rate)
+        elif operation == LINK_ECHO:
+            return data
+        return None
+
+    def _process_encoded(self, request):
+        try:
+            decoded, result_type = decode_request(request)
+        except (IOError, struct.error):
+            return None
+        if len(decoded) < 2 or struct.unpack_from('<H', decoded)[0] >= \
+                CMD_BATCH:
+            return None
+        result = self.process_command(decoded)
+        if result is None or not result_type:
+            return result
+        return encode_result(result, result_type)
+
+    def _process_manifest(self, request):
+        if len(request) < MANIFEST_REQUEST_SIZE or self.manifest is None:
+            return None
+        offset = struct.unpack_from('<I', request, 2)[0]
+        chunk = self.manifest[offset:]
+        if self.packet_size is not None:
+            chunk = chunk[:max(self.packet_size - MANIFEST_HEADER_SIZE, 0)]
+        return struct.pack('<I', len(self.manifest)) + chunk
@@ -0,0 +1,208 @@
+'''
+Per-method call statistics of a proxy (see `ProxyBase.enable_stats`).
+
+Statistics are collected by wrapping the request encoders, response decoders
+and send methods of a proxy *instance*, so a proxy with statistics disabled
+runs exactly the same code as before.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from bisect import bisect_right
+import struct
+import threading
+
+from nadamq.NadaMq import PACKET_TYPES
+
+from .commands import RESERVED_COMMANDS
+from .packet_stream import PacketParseError
+from .proxy import CommandTimeoutError
+
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    # Python 2.
+    from timeit import default_timer as _clock
+
+
+#: Upper edges (in microseconds) of round-trip latency histogram buckets.  The
+#: last bucket counts calls slower than the last edge.
+LATENCY_BUCKETS_US = (100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000,
+                      100000)
+
+_COMMAND_CODE = struct.Struct('<H')
+
+
+class MethodStats(object):
+    '''
+    Counters of calls to a single command.
+    '''
+    __slots__ = ('calls', 'request_bytes', 'response_bytes', 'encode_s',
+                 'encodes', 'wire_s', 'decode_s', 'decodes', 'nacks',
+                 'errors', 'parse_errors', 'timeouts', 'retries', 'histogram')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+        self.histogram = [0] * (len(LATENCY_BUCKETS_US) + 1)
+
+
+class ProxyStats(object):
+    '''
+    Per-command statistics of a proxy, keyed by command code.
+
+    Round-trip (i.e., wire) statistics are collected for blocking calls.
+    Encode and decode times are also collected for pipelined, batched and
+    future-based calls.
+    '''
+    def __init__(self, proxy):
+        self._lock = threading.Lock()
+        self.methods = {}
+        self._wrapped = []
+        self.names = dict((code, name.lower()) for name, code in
+                          RESERVED_COMMANDS.items())
+        for attr in dir(type(proxy)):
+            if attr.startswith('_CMD_'):
+                self.names[getattr(proxy, attr)] = attr[len('_CMD_'):].lower()
+
+    def _method(self, command):
+        try:
+            return self.methods[command]
+        except KeyError:
+            return self.methods.setdefault(command, MethodStats())
+
+    def install(self, proxy):
+        '''
+        Wrap encoders, decoders and send methods of proxy instance.
+        '''
+        for command, name in self.names.items():
+            for prefix, record in (('_encode_', self.record_encode),
+                                   ('_decode_', self.record_decode)):
+                method = getattr(proxy, prefix + name, None)
+                if method is not None:
+                    self._wrap(proxy, prefix + name,
+                               self._timed(method, command, record))
+        self._wrap(proxy, '_send_command',
+                   self._wire(proxy._send_command,
+                              lambda packet: packet.data()))
+        self._wrap(proxy, '_send_fragmented',
+                   self._wire(proxy._send_fragmented, lambda data: data))
+
+    def _wrap(self, proxy, name, wrapper):
+        # Wrappers installed earlier (e.g., by `enable_compression`) are
+        # restored on `uninstall`.
+        self._wrapped.append((name, proxy.__dict__.get(name)))
+        setattr(proxy, name, wrapper)
+
+    def uninstall(self, proxy):
+        for name, previous in reversed(self._wrapped):
+            if previous is None:
+                proxy.__dict__.pop(name, None)
+            else:
+                setattr(proxy, name, previous)
+        self._wrapped = []
+
+    def _timed(self, method, command, record):
+        def _timed_method(*args, **kwargs):
+            start = _clock()
+            result = method(*args, **kwargs)
+            record(command, _clock() - start)
+            return result
+        _timed_method.__name__ = method.__name__
+        return _timed_method
+
+    def _wire(self, send, get_data):
+        def _timed_send(request, timeout_s=None):
+            data = get_data(request)
+            command = _COMMAND_CODE.unpack_from(data)[0]
+            start = _clock()
+            try:
+                response = send(request, timeout_s=timeout_s)
+            except Exception as exception:
+                self.record_error(command, exception)
+                raise
+            self.record_wire(command, len(data), response, _clock() - start)
+            return response
+        return _timed_send
+
+    def record_encode(self, command, duration_s):
+        with self._lock:
+            method = self._method(command)
+            method.encodes += 1
+            method.encode_s += duration_s
+
+    def record_decode(self, command, duration_s):
+        with self._lock:
+            method = self._method(command)
+            method.decodes += 1
+            method.decode_s += duration_s
+
+    def record_wire(self, command, request_bytes, response, duration_s):
+        bucket = bisect_right(LATENCY_BUCKETS_US, duration_s * 1e6)
+        response_bytes = len(response.data())
+        with self._lock:
+            method = self._method(command)
+            method.calls += 1
+            method.request_bytes += request_bytes
+            method.response_bytes += response_bytes
+            method.wire_s += duration_s
+            method.histogram[bucket] += 1
+            if response.type_ == PACKET_TYPES.NACK:
+                method.nacks += 1
+
+    def record_error(self, command, exception):
+        with self._lock:
+            method = self._method(command)
+            method.errors += 1
+            if isinstance(exception, PacketParseError):
+                method.parse_errors += 1
+            elif isinstance(exception, CommandTimeoutError):
+                method.timeouts += 1
+
+    def record_retry(self, command):
+        with self._lock:
+            self._method(command).retries += 1
+
+    def reset(self):
+        with self._lock:
+            self.methods.clear()
+
+    def to_frame(self):
+        '''
+        Returns
+        -------
+
+        pandas.DataFrame
+            One row per called command, indexed by method name, with counts
+            (`calls` counts completed blocking calls, `errors` counts failed
+            ones, `retries` counts retried calls), mean encode, round-trip
+            and decode times (in microseconds), and one `latency_<edge>us`
+            column per round-trip histogram bucket.
+        '''
+        import pandas as pd
+
+        histogram_columns = (['latency_%dus' % edge
+                              for edge in LATENCY_BUCKETS_US] +
+                             ['latency_inf'])
+        rows = []
+        index = []
+        with self._lock:
+            for command, method in sorted(self.methods.items()):
+                index.append(self.names.get(command, command))
+                row = [command, method.calls, method.request_bytes,
+                       method.response_bytes,
+                       _mean_us(method.encode_s, method.encodes),
+                       _mean_us(method.wire_s, method.calls),
+                       _mean_us(method.decode_s, method.decodes),
+                       method.nacks, method.errors, method.parse_errors,
+                       method.timeouts, method.retries]
+                rows.append(row + list(method.histogram))
+        columns = ['command', 'calls', 'request_bytes', 'response_bytes',
+                   'encode_us', 'wire_us', 'decode_us', 'nacks', 'errors',
+                   'parse_errors', 'timeouts', 'retries'] + histogram_columns
+        return pd.DataFrame(rows, columns=columns,
+                            index=pd.Index(index, name='method'))
+
+
+def _mean_us(total_s, count):
+    return total_s / count * 1e6 if count else float('nan')
@@ -0,0 +1,157 @@
+'''
+Device-push streams (see `ProxyBase.stream`).
+
+A stream is started with a `CMD_STREAM` request holding a stream ID, a push
+period, and the serialized request of a proxy method.  The device then runs
+the request once per period and pushes each response in an unsolicited
+`DATA` packet, tagged with an `iuid` of `PUSH_IUID_FLAG | stream_id`.  Pushed
+packets are routed to the corresponding `Stream` by the receive path of the
+proxy, so other calls may be made while a stream is active.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import struct
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+import numpy as np
+from six.moves import queue
+
+from .commands import CMD_STREAM
+from .packet_stream import PacketParseError
+from .proxy import CommandTimeoutError, _get_codec
+
+
+class StreamError(IOError):
+    '''
+    Raised when the device rejects a stream request (e.g., the request of the
+    streamed method does not fit in the stream buffer of the device).
+    '''
+    pass
+
+
+def encode_stream_request(stream_id, period_us, request_data=b''):
+    '''
+    Returns
+    -------
+
+    bytes
+        `CMD_STREAM` request payload.  A period of zero stops the stream.
+    '''
+    return (struct.pack('<HHI', CMD_STREAM, stream_id, period_us) +
+            request_data)
+
+
+class Stream(object):
+    '''
+    Iterator over blocks of samples pushed by the device.
+
+    Each block is a `numpy` array of `block_size` samples (i.e., decoded
+    responses of the streamed method), stacked along the first axis.
+
+    Pushed samples are queued until read.  Once `max_queued` samples are
+    queued, further samples are dropped (and counted in `dropped`).
+
+    The stream is stopped when the iterator is closed (or the context
+    exits).
+    '''
+    def __init__(self, proxy, name, args, rate, block_size=1,
+                 max_queued=1 << 16, timeout_s=None):
+        self._proxy = proxy
+        self.name = name
+        self.rate = rate
+        self.block_size = block_size
+        self.timeout_s = timeout_s
+        self.dropped = 0
+        encode, self._decode = _get_codec(proxy, name)
+        self._request_data = encode(*args)
+        self._samples = queue.Queue(maxsize=max_queued)
+        self.stream_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def _send(self, period_us):
+        packet = cPacket(data=encode_stream_request(self.stream_id, period_us,
+                                                    self._request_data
+                                                    if period_us else b''),
+                         type_=PACKET_TYPES.DATA)
+        response = self._proxy._send_command(packet,
+                                             timeout_s=self.timeout_s)
+        if response.type_ == PACKET_TYPES.NACK:
+            raise StreamError('Device rejected stream request.')
+
+    def start(self):
+        '''
+        Request the device to start pushing samples.
+
+        Raises `StreamError` if another stream of the proxy is active, since
+        the device runs a single stream at a time.
+        '''
+        streams = self._proxy._streams
+        if streams:
+            raise StreamError('Another stream is active.  Close it before '
+                              'starting a new stream.')
+        self.stream_id = 1
+        streams[self.stream_id] = self
+        try:
+            self._send(max(1, int(round(1e6 / self.rate))))
+        except Exception:
+            del streams[self.stream_id]
+            raise
+        return self
+
+    def close(self):
+        '''
+        Request the device to stop pushing samples.  Samples pushed after the
+        stream is closed are discarded.
+        '''
+        if self.stream_id is None:
+            return
+        try:
+            self._send(0)
+        finally:
+            self._proxy._streams.pop(self.stream_id, None)
+            self.stream_id = None
+
+    def _push(self, packet):
+        try:
+            self._samples.put_nowait(self._decode(packet))
+        except queue.Full:
+            self.dropped += 1
+
+    def _next_sample(self):
+        proxy = self._proxy
+        if proxy._io_thread is not None:
+            # Pushed packets are routed by the I/O thread.
+            try:
+                return self._samples.get(timeout=self.timeout_s)
+            except queue.Empty:
+                raise CommandTimeoutError('No sample received before '
+                                          'deadline.')
+        deadline = proxy._deadline(self.timeout_s)
+        while self._samples.empty():
+            try:
+                packet = proxy._receive_packet(deadline)
+            except PacketParseError as exception:
+                pending = proxy._pending_calls
+                if pending:
+                    pending.pop(next(iter(pending)))._set_exception(exception)
+            else:
+                proxy._dispatch_response(packet)
+        return self._samples.get_nowait()
+
+    def __next__(self):
+        if self.stream_id is None:
+            raise StopIteration
+        return np.array([self._next_sample()
+                         for i in range(self.block_size)])
+
+    next = __next__
+
@@ -0,0 +1,113 @@
+'''
+Runtime helpers for the request encoders and response decoders of generated
+proxy classes which depend only on the standard library (see
+`arduino_rpc.rpc_data_frame.get_python_code(..., runtime='struct')`).
+
+Arrays are `array.array` instances, with the `struct` format character of the
+element type as the type code.  Unlike `arduino_rpc.codec`, this module does
+not import `numpy`, which is the bulk of the import time and memory use of a
+generated proxy on small hosts.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+import array
+import sys
+
+
+#: Text string type (i.e., `unicode` on Python 2).
+_TEXT_TYPE = type(u'')
+#: `True` if array data must be byte swapped to/from the (little-endian) wire
+#: format.
+_SWAP = sys.byteorder == 'big'
+
+
+def _frombytes(array_, data):
+    try:
+        array_.frombytes(data)
+    except AttributeError:
+        # Python 2.
+        array_.fromstring(bytes(data))
+
+
+def pack_array(arg, typecode):
+    '''
+    Return an `array.array` of the specified type code.
+
+    Byte strings (and text strings, with one element per character) are
+    converted to one element per byte.  No copy is made if `arg` is already
+    an array of the specified type code.
+    '''
+    if isinstance(arg, array.array) and arg.typecode == typecode:
+        return arg
+    if isinstance(arg, _TEXT_TYPE):
+        arg = arg.encode('latin-1')
+    if isinstance(arg, (bytes, bytearray)):
+        if typecode == 'B':
+            result = array.array(typecode)
+            _frombytes(result, arg)
+            return result
+        arg = bytearray(arg)
+    try:
+        view = memoryview(arg)
+    except TypeError:
+        view = None
+    if (view is not None and view.format.lstrip('<=@') == typecode and
+            view.ndim == 1 and view.c_contiguous and not _SWAP):
+        # Buffer of the same element type (e.g., a `numpy` array).
+        result = array.array(typecode)
+        _frombytes(result, view.tobytes())
+        return result
+    return array.array(typecode, arg)
+
+
+def array_bytes(array_):
+    '''
+    Returns
+    -------
+
+    bytes
+        Array data in wire (i.e., little-endian) byte order.
+    '''
+    if _SWAP:
+        array_ = array.array(array_.typecode, array_)
+        array_.byteswap()
+    try:
+        return array_.tobytes()
+    except AttributeError:
+        # Python 2.
+        return array_.tostring()
+
+
+def unpack_array(data, typecode, out=None):
+    '''
+    Decode an array response.
+
+    Arguments
+    ---------
+
+     - `data`: Response data.
+     - `typecode`: Array element type code.
+     - `out`: Writable buffer of the same element type to decode into
+       (optional, Python 3 only).  Must have room for at least as many
+       elements as the response.
+
+    Returns
+    -------
+
+    array.array
+        Array holding the response, or `out` (holding the response in its
+        leading elements) if specified.
+    '''
+    result = array.array(typecode)
+    _frombytes(result, data)
+    if _SWAP:
+        result.byteswap()
+    if out is None:
+        return result
+    target = memoryview(out).cast('B')
+    if len(target) < len(data):
+        raise ValueError('Output buffer has %d bytes, but response has %d '
+                         'bytes.' % (len(target), len(data)))
+    target[:len(data)] = memoryview(result).cast('B')
+    return out
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+
+import pytest
+from serial import Serial
+
+from arduino_rpc.benchmarks.encode import example_sig_frame, generate_module
+from arduino_rpc.benchmarks.suite import ExampleNode
+
+
+class RecordingNode(ExampleNode):
+    '''
+    `ExampleNode` which records the name and arguments of each call.
+    '''
+    def __init__(self):
+        super(RecordingNode, self).__init__()
+        self.calls = []
+        self.ram_free_calls = 0
+
+    def ram_free(self):
+        # Changes on each call, to tell cached results from device results.
+        self.ram_free_calls += 1
+        return 1024 - self.ram_free_calls
+
+    def set_x(self, x):
+        self.calls.append(('set_x', float(x)))
+        super(RecordingNode, self).set_x(x)
+
+    def add(self, a, b):
+        self.calls.append(('add', int(a), int(b)))
+        return super(RecordingNode, self).add(a, b)
+
+    def set_waveform(self, times, values):
+        self.calls.append(('set_waveform', len(times)))
+
+
+@pytest.fixture(scope='session')
+def df_sig_info():
+    return example_sig_frame()
+
+
+@pytest.fixture(scope='session')
+def proxy_class(df_sig_info):
+    return generate_module(df_sig_info).Proxy
+
+
+@pytest.fixture
+def simulated(df_sig_info, proxy_class):
+    '''
+    Returns a function which starts a simulated device (keyword arguments
+    are passed to `SimulatedDevice`) and returns `(proxy, node)`, where
+    `proxy` is connected to the device.  Each device is stopped at the end of
+    the test.
+
+    Tests using the simulated device are skipped on platforms without
+    pseudo-terminals (e.g., Windows).
+    '''
+    pytest.importorskip('pty')
+    from arduino_rpc.simulator import SimulatedDevice
+
+    devices = []
+    proxies = []
+
+    def _simulated(node=None, **kwargs):
+        if node is None:
+            node = RecordingNode()
+        device = SimulatedDevice(df_sig_info, node, **kwargs).start()
+        devices.append(device)
+        proxy = proxy_class()
+        proxy._serial = Serial(device.port_name)
+        proxy.response_timeout_s = 1
+        proxies.append(proxy)
+        return proxy, node
+
+    yield _simulated
+    for proxy in proxies:
+        proxy.stop_io_thread()
+        proxy.disable_coalescing()
+        proxy._serial.close()
+    for device in devices:
+        device.stop()
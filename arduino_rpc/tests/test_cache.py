@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+
+import numpy as np
+
+
+def test_cache_invalidation(simulated):
+    proxy, node = simulated()
+    proxy.enable_cache(policy={'ram_free': (None, None)})
+    first = proxy.ram_free()
+    assert proxy.ram_free() == first
+    assert node.ram_free_calls == 1
+    # Any method which is not cached invalidates the cached result.
+    proxy.set_x(1)
+    assert proxy.ram_free() == first - 1
+    assert node.ram_free_calls == 2
+    df_stats = proxy.cache_stats()
+    assert df_stats.loc['ram_free', 'hits'] == 1
+    assert df_stats.loc['ram_free', 'misses'] == 2
+
+
+def test_cached_array_copied(simulated):
+    proxy, node = simulated()
+    proxy.enable_cache(policy={'scale': (None, ['set_x'])})
+    values = np.arange(4, dtype='int16')
+    result = proxy.scale(values, 2)
+    result[:] = 0
+    np.testing.assert_array_equal(proxy.scale(values, 2), 2 * values)
@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+
+import numpy as np
+
+
+def test_pipeline_round_trip(simulated):
+    proxy, node = simulated()
+    with proxy.pipeline(window=4) as pipeline:
+        calls = [pipeline.add(i, 1) for i in range(20)]
+    assert [call.result() for call in calls] == list(range(1, 21))
+    assert node.calls == [('add', i, 1) for i in range(20)]
+
+
+def test_batch_round_trip(simulated):
+    proxy, node = simulated(packet_size=80)
+    with proxy.batch() as batch:
+        batch.set_x(1.5)
+        sums = [batch.add(i, i) for i in range(10)]
+        echo = batch.str_echo(b'hello')
+    assert [call.result() for call in sums] == list(range(0, 20, 2))
+    assert echo.result().tobytes() == b'hello'
+    assert node.x == 1.5
+
+
+def test_fragment_round_trip(simulated):
+    proxy, node = simulated(packet_size=80, staging_size=4096)
+    array = np.arange(1000, dtype='uint8')
+    # The request is longer than a packet, so it is sent in fragments.
+    assert proxy.array_length(array) == 1000
+    values = np.arange(-300, 300, dtype='int16')
+    np.testing.assert_array_equal(proxy.scale(values, 2), 2 * values)
@@ -0,0 +1,23 @@
+from __future__ import absolute_import
+
+import numpy as np
+
+
+def test_coalescing_order(simulated):
+    proxy, node = simulated(latency_s=0.005)
+    coalescer = proxy.enable_coalescing()
+    for x in range(10):
+        proxy.set_x(x)
+    proxy.set_waveform(np.arange(4, dtype='uint32'),
+                       np.zeros(4, dtype='float32'))
+    proxy.set_x(10)
+    # A call to another method first sends the pending requests.
+    assert proxy.add(1, 2) == 3
+    assert node.calls[-3:] == [('set_waveform', 4), ('set_x', 10),
+                               ('add', 1, 2)]
+    # Every request sent to the device is in order of the calls.
+    set_x = [call[1] for call in node.calls if call[0] == 'set_x']
+    assert set_x == sorted(set_x)
+    assert coalescer.calls == 12
+    assert coalescer.sent + coalescer.coalesced == coalescer.calls
+    assert coalescer.coalesced > 0
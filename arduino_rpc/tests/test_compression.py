@@ -0,0 +1,24 @@
+from __future__ import absolute_import
+
+import numpy as np
+
+from arduino_rpc.commands import ENCODING_DELTA
+from arduino_rpc.compression import decode_result, encode_result, type_code
+
+
+def test_float_result_round_trip():
+    # Consecutive `float32` values, i.e., consecutive bit patterns, so the
+    # delta encoding is the smallest.
+    array = np.arange(0x3F800000, 0x3F800000 + 64,
+                      dtype='uint32').view('float32')
+    data = encode_result(array.tobytes(), type_code(array.dtype))
+    assert bytearray(data[:1])[0] == ENCODING_DELTA
+    decoded = np.frombuffer(decode_result(data, array.dtype), dtype='float32')
+    np.testing.assert_array_equal(decoded, array)
+
+
+def test_int_result_round_trip():
+    array = np.cumsum(np.arange(-32, 32, dtype='int16')).astype('int16')
+    data = encode_result(array.tobytes(), type_code(array.dtype))
+    decoded = np.frombuffer(decode_result(data, array.dtype), dtype='int16')
+    np.testing.assert_array_equal(decoded, array)
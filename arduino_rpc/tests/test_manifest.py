@@ -0,0 +1,29 @@
+from __future__ import absolute_import
+
+import numpy as np
+import pytest
+
+from arduino_rpc.manifest import connect, get_manifest, proxy_class
+
+
+@pytest.mark.parametrize('runtime', ['numpy', 'struct'])
+def test_manifest_proxy_class(simulated, df_sig_info, runtime):
+    manifest = get_manifest(df_sig_info)
+    Proxy = proxy_class(manifest, runtime=runtime)
+    assert Proxy._ARG_NAMES['add'] == ('a', 'b')
+    generated_proxy, node = simulated()
+    # Same requests as the generated proxy.
+    proxy = Proxy()
+    proxy._serial = generated_proxy._serial
+    assert proxy.add(1, b=2) == 3
+    assert list(proxy.scale(np.arange(3, dtype='int16'), 2)) == [0, 2, 4]
+    with pytest.raises(TypeError):
+        proxy.add(1)
+
+
+def test_connect_fetches_manifest(simulated, df_sig_info):
+    manifest = get_manifest(df_sig_info)
+    generated_proxy, node = simulated(manifest=manifest)
+    proxy = connect(generated_proxy._serial)
+    assert proxy.manifest == manifest
+    assert proxy.add(1, 2) == 3
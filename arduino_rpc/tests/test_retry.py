@@ -0,0 +1,14 @@
+from __future__ import absolute_import
+
+from arduino_rpc.retry import IDEMPOTENT
+
+
+def test_retry_corrupt_responses(simulated):
+    proxy, node = simulated(corrupt_rate=0.3, seed=0)
+    retrier = proxy.enable_retries(idempotency={'add': IDEMPOTENT},
+                                   max_retries=10, backoff_s=0.001)
+    assert [proxy.add(i, i) for i in range(30)] == list(range(0, 60, 2))
+    retries = retrier.methods['add']
+    assert retries.retries > 0
+    assert retries.recovered > 0
+    assert retries.failures == 0
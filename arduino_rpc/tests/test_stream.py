@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+
+import pytest
+
+from arduino_rpc.stream import StreamError
+
+
+def test_stream_start_stop(simulated):
+    proxy, node = simulated()
+    proxy.set_x(2)
+    with proxy.stream('add', 3, 4, rate=1000, block_size=10,
+                      timeout_s=1) as stream:
+        block = next(stream)
+        # Other calls may be made while the stream is active.
+        assert proxy.add(1, 1) == 2
+        assert block.shape == (10, )
+        assert set(block) == set([7])
+    assert not proxy._streams
+    # A closed stream stops iterating.
+    with pytest.raises(StopIteration):
+        next(stream)
+
+
+def test_second_stream_rejected(simulated):
+    proxy, node = simulated()
+    with proxy.stream('add', 1, 2, rate=100, timeout_s=1) as stream:
+        with pytest.raises(StreamError):
+            proxy.stream('add', 3, 4, rate=100)
+        assert next(stream)[0] == 3
+    # Once the first stream is closed, a new stream may be started.
+    with proxy.stream('add', 3, 4, rate=100, timeout_s=1) as stream:
+        assert next(stream)[0] == 7
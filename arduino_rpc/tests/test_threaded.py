@@ -0,0 +1,26 @@
+from __future__ import absolute_import
+
+from arduino_rpc.threaded import PRIORITY_HIGH
+
+
+def test_priority_lanes(simulated):
+    proxy, node = simulated(latency_s=0.01)
+    proxy.start_io_thread(window=1, priorities={'set_x': PRIORITY_HIGH})
+    futures = [proxy.futures.add(i, 0) for i in range(10)]
+    high = proxy.futures.set_x(5)
+    assert [future.result() for future in futures] == list(range(10))
+    high.result()
+    # The high priority request is sent before the queued normal requests.
+    names = [call[0] for call in node.calls]
+    assert names.index('set_x') < 5
+    assert node.x == 5
+
+
+def test_futures_priority_argument(simulated):
+    proxy, node = simulated(latency_s=0.01)
+    proxy.start_io_thread(window=1)
+    futures = [proxy.futures.add(i, 0) for i in range(10)]
+    high = proxy.futures.add(100, 0, priority=PRIORITY_HIGH)
+    assert high.result() == 100
+    assert [future.result() for future in futures] == list(range(10))
+    assert node.calls.index(('add', 100, 0)) < 5
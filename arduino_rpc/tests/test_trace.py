@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+
+import pytest
+
+from arduino_rpc.trace import ReplayMismatchError, TraceReplayer
+
+
+def test_trace_replay(simulated, proxy_class, tmpdir):
+    path = str(tmpdir.join('session.trace'))
+    proxy, node = simulated()
+    proxy.start_trace(path)
+    proxy.set_x(1)
+    assert proxy.add(2, 3) == 5
+    assert proxy.str_echo(b'abc').tobytes() == b'abc'
+    proxy.stop_trace()
+
+    replayer = TraceReplayer(path)
+    assert len(replayer) == 3
+    assert replayer.parse_errors == 0
+    results = list(replayer.decode(proxy))
+    assert [name for name, result in results] == ['set_x', 'add',
+                                                  'str_echo']
+    assert results[1][1] == 5
+
+    # Replay the session without the device.
+    replay_proxy = proxy_class()
+    replay_proxy._serial = replayer.port()
+    replay_proxy.set_x(1)
+    assert replay_proxy.add(2, 3) == 5
+    assert replay_proxy.str_echo(b'abc').tobytes() == b'abc'
+
+
+def test_replay_mismatch(simulated, proxy_class, tmpdir):
+    path = str(tmpdir.join('session.trace'))
+    proxy, node = simulated()
+    proxy.start_trace(path)
+    proxy.add(2, 3)
+    proxy.stop_trace()
+
+    replay_proxy = proxy_class()
+    replay_proxy._serial = TraceReplayer(path).port()
+    with pytest.raises(ReplayMismatchError):
+        replay_proxy.add(2, 4)
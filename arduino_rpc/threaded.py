@@ -0,0 +1,462 @@
+'''
+Dedicated I/O thread for thread-safe access to a proxy.
+
+Once `ProxyBase.start_io_thread` is called, every command request is queued
+for the I/O thread of the proxy, which is the only thread to touch the serial
+port.  Any number of threads (e.g., GUI, logger, control) may then call the
+proxy concurrently, either through the usual blocking methods, or through
+`proxy.futures.<method>(...)`, which returns a `concurrent.futures.Future`.
+
+Queued requests are scheduled in priority lanes (`PRIORITY_HIGH`,
+`PRIORITY_NORMAL` and `PRIORITY_BULK`): the next request sent is always the
+oldest request of the highest priority lane.  A request too long for a single
+packet is sent as a sequence of `CMD_FRAGMENT` packets (see
+`ProxyBase._send_fragmented`) in the bulk lane, so higher priority requests
+(e.g., an emergency stop) are sent between fragments, rather than after the
+whole transfer.  Each lane holds at most `queue_size` requests; a call to a
+full lane either blocks until there is room, or raises `QueueFullError`.
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import OrderedDict
+from concurrent.futures import Future
+import select
+import socket
+import struct
+import threading
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+from six.moves import queue
+
+from .commands import CMD_ENCODED, CMD_FRAGMENT, PUSH_IUID_FLAG
+from .packet_stream import PacketParseError
+from .proxy import (CommandTimeoutError, FragmentError, _bind_out,
+                    _get_codec, _monotonic, _read_byte, encode_fragments)
+
+
+#: Priority lanes, highest priority first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK)
+
+#: Commands which write to the staging buffer of the device, and must
+#: therefore not be sent between the fragments of a request: fragments, and
+#: encoded requests (decoded to the staging buffer).
+_BULK_COMMANDS = (CMD_FRAGMENT, CMD_ENCODED)
+
+_COMMAND_CODE = struct.Struct('<H')
+
+
+class QueueFullError(IOError):
+    '''
+    Raised when a request is submitted to a full priority lane of a
+    non-blocking I/O thread (see `ProxyIoThread`).
+    '''
+    pass
+
+
+class _PendingRequest(object):
+    __slots__ = ('packet', 'decode', 'future', 'deadline', 'size')
+
+    def __init__(self, packet, decode, future, deadline):
+        self.packet = packet
+        self.decode = decode
+        self.future = future
+        self.deadline = deadline
+        self.size = 0
+
+
+class ProxyIoThread(threading.Thread):
+    '''
+    Thread which serializes all access to the serial port of a proxy.
+
+    Up to `window` requests (and `window_bytes` request bytes) are kept in
+    flight, and responses are matched to requests by sequence ID.
+
+    Arguments
+    ---------
+
+     - `proxy`: Proxy.
+     - `window`: Maximum number of outstanding requests (default:
+       `pipeline_window` of the proxy).
+     - `window_bytes`: Maximum number of outstanding request bytes (default:
+       `pipeline_window_bytes` of the proxy).
+     - `priorities`: Mapping from method name to priority lane (default:
+       `PRIORITY_NORMAL`).  Fragments and encoded requests are always sent in
+       the bulk lane.
+     - `queue_size`: Maximum number of queued requests per lane (`None` for
+       no limit).
+     - `block`: If `True`, block calls to a full lane until there is room;
+       otherwise, raise `QueueFullError`.
+    '''
+    #: Longest wait for ports that do not expose a file descriptor (e.g., on
+    #: Windows); bounds the latency of newly queued requests on such ports.
+    poll_interval_s = 0.005
+
+    def __init__(self, proxy, window=None, window_bytes=None,
+                 priorities=None, queue_size=None, block=True):
+        super(ProxyIoThread, self).__init__(name='%s I/O' %
+                                            type(proxy).__name__)
+        self.daemon = True
+        self._proxy = proxy
+        self.window = proxy.pipeline_window if window is None else window
+        self.window_bytes = (proxy.pipeline_window_bytes
+                             if window_bytes is None else window_bytes)
+        #: Priority lane of each command code.
+        self.priorities = dict((getattr(proxy, '_CMD_' + name.upper()),
+                                priority)
+                               for name, priority in
+                               (priorities or {}).items())
+        for command in _BULK_COMMANDS:
+            self.priorities[command] = PRIORITY_BULK
+        self.block = block
+        # Held while queueing to the bulk lane, so the fragments of a request
+        # are never interleaved with other requests using the staging buffer.
+        self._bulk_lock = threading.RLock()
+        # Queued requests of each lane.
+        self._lanes = [queue.Queue(queue_size or 0) for priority in
+                       PRIORITIES]
+        self._pending = OrderedDict()
+        self._stopping = False
+        # Writing to the socket pair wakes the I/O thread from `select`.
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+
+    def submit(self, packet, decode=None, timeout_s=None, priority=None,
+               block=None):
+        '''
+        Queue a packet to send to the device.
+
+        Arguments
+        ---------
+
+         - `packet`: Request packet.
+         - `decode`: Function to decode the response packet (optional).
+         - `timeout_s`: Seconds to wait for the response (optional).
+         - `priority`: Priority lane (default: lane of the command, see
+           `priorities`).
+         - `block`: Block until there is room in the lane (default: `block`
+           of the thread).
+
+        Returns
+        -------
+
+        concurrent.futures.Future
+            Result of `decode(response)` (or the response packet if `decode`
+            is `None`).
+        '''
+        if self._stopping or not self.is_alive():
+            raise RuntimeError('I/O thread is not running.')
+        if priority is None:
+            priority = self.priorities.get(_COMMAND_CODE
+                                           .unpack_from(packet.data())[0],
+                                           PRIORITY_NORMAL)
+        future = Future()
+        request = _PendingRequest(packet, decode, future,
+                                  self._proxy._deadline(timeout_s))
+        if block is None:
+            block = self.block
+        try:
+            if priority == PRIORITY_BULK:
+                with self._bulk_lock:
+                    self._lanes[priority].put(request, block)
+            else:
+                self._lanes[priority].put(request, block)
+        except queue.Full:
+            raise QueueFullError('Priority lane %d is full.' % priority)
+        self._wake()
+        return future
+
+    def submit_sequence(self, packets, timeout_s=None):
+        '''
+        Queue packets to be sent consecutively in the bulk lane (e.g., the
+        fragments of a request), i.e., without other bulk requests in
+        between.
+
+        Only the first packet is subject to the `block` setting of the
+        thread; once the first packet is queued, the remaining packets wait
+        for room in the lane.
+
+        Returns
+        -------
+
+        list
+            Future response packet of each packet.
+        '''
+        with self._bulk_lock:
+            futures = [self.submit(packets[0], timeout_s=timeout_s,
+                                   priority=PRIORITY_BULK)]
+            futures += [self.submit(packet, timeout_s=timeout_s,
+                                    priority=PRIORITY_BULK, block=True)
+                        for packet in packets[1:]]
+        return futures
+
+    def queued(self):
+        '''
+        Returns
+        -------
+
+        list
+            Number of queued (i.e., not yet sent) requests in each lane,
+            highest priority first.
+        '''
+        return [lane.qsize() for lane in self._lanes]
+
+    def stop(self):
+        '''
+        Stop the thread once all queued and in-flight requests complete.
+        '''
+        self._stopping = True
+        self._wake()
+        if threading.current_thread() is not self:
+            self.join()
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b'\0')
+        except socket.error:
+            # Socket buffer is full, i.e., a wake up is already pending.
+            pass
+
+    def _clear_wake(self):
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def run(self):
+        try:
+            while not (self._stopping and not self._pending and
+                       not any(self.queued())):
+                self._send_requests()
+                self._wait()
+                self._receive()
+                self._expire()
+        except Exception as exception:
+            self._fail_all(exception)
+        finally:
+            self._fail_all(RuntimeError('I/O thread stopped.'))
+            self._wake_recv.close()
+            self._wake_send.close()
+
+    def _fail_all(self, exception):
+        requests = list(self._pending.values())
+        self._pending.clear()
+        for lane in self._lanes:
+            while True:
+                try:
+                    requests.append(lane.get_nowait())
+                except queue.Empty:
+                    break
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(exception)
+
+    def _window_full(self, size):
+        if not self._pending:
+            return False
+        return (len(self._pending) >= self.window or
+                (self.window_bytes is not None and
+                 sum(request.size for request in self._pending.values()) +
+                 size > self.window_bytes))
+
+    def _send_requests(self):
+        proxy = self._proxy
+        while True:
+            # Oldest request of the highest priority lane.
+            for lane in self._lanes:
+                try:
+                    request = lane.queue[0]
+                    break
+                except IndexError:
+                    continue
+            else:
+                return
+            expired = (request.deadline is not None and
+                       request.deadline <= _monotonic())
+            data_size = len(request.packet.data()) + 10
+            if not expired and self._window_full(data_size):
+                return
+            request = lane.get_nowait()
+            if not request.future.set_running_or_notify_cancel():
+                # Request was cancelled before it was sent.
+                continue
+            if expired:
+                # Deadline passed while the request was queued (e.g., behind
+                # a full window), so the caller has given up on it.
+                request.future.set_exception(
+                    CommandTimeoutError('Deadline passed before request '
+                                        'was sent.'))
+                continue
+            sequence_id = proxy._next_sequence_id()
+            request.packet.iuid = sequence_id
+            request.size = data_size
+            self._pending[sequence_id] = request
+            proxy._serial.write(request.packet.tostring())
+
+    def _queued_requests(self):
+        requests = []
+        for lane in self._lanes:
+            with lane.mutex:
+                requests.extend(lane.queue)
+        return requests
+
+    def _timeout(self):
+        deadlines = [request.deadline for request in
+                     list(self._pending.values()) + self._queued_requests()
+                     if request.deadline is not None]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - _monotonic())
+
+    def _wait(self):
+        serial = self._proxy._serial
+        if serial.inWaiting():
+            return
+        timeout = self._timeout()
+        try:
+            fd = serial.fileno()
+        except (AttributeError, IOError, ValueError):
+            fd = None
+        if fd is not None:
+            readable = select.select([fd, self._wake_recv], [], [],
+                                     timeout)[0]
+            if self._wake_recv in readable:
+                self._clear_wake()
+        else:
+            self._clear_wake()
+            interval = (self.poll_interval_s if timeout is None
+                        else min(timeout, self.poll_interval_s))
+            _read_byte(serial, self._proxy._packet_receiver, interval)
+
+    def _receive(self):
+        serial = self._proxy._serial
+        receiver = self._proxy._packet_receiver
+        receiver.read_from(serial, serial.inWaiting())
+        while receiver.packets:
+            packet = receiver.packets.popleft()
+            if isinstance(packet, PacketParseError):
+                # Sequence ID of a malformed packet is unknown.  Responses
+                # arrive in request order, so fail the oldest pending call.
+                if self._pending:
+                    self._pending.popitem(last=False)[1].future\
+                        .set_exception(packet)
+                continue
+            if packet.iuid & PUSH_IUID_FLAG:
+                self._proxy._dispatch_push(packet)
+                continue
+            sequence_id = packet.iuid
+            if sequence_id == 0 and self._pending:
+                sequence_id = next(iter(self._pending))
+            request = self._pending.pop(sequence_id, None)
+            if request is None:
+                # Late response to a request which timed out.
+                continue
+            try:
+                result = (packet if request.decode is None
+                          else request.decode(packet))
+            except Exception as exception:
+                request.future.set_exception(exception)
+            else:
+                request.future.set_result(result)
+
+    def _expire(self):
+        now = _monotonic()
+        for sequence_id, request in list(self._pending.items()):
+            if request.deadline is not None and request.deadline <= now:
+                del self._pending[sequence_id]
+                request.future.set_exception(
+                    CommandTimeoutError('No response received before '
+                                        'deadline.'))
+        # Requests still queued (e.g., behind a full window) when their
+        # deadline passes are never sent.
+        for lane in self._lanes:
+            with lane.mutex:
+                expired = [request for request in lane.queue
+                           if request.deadline is not None and
+                           request.deadline <= now]
+                for request in expired:
+                    lane.queue.remove(request)
+                    lane.not_full.notify()
+            for request in expired:
+                if request.future.set_running_or_notify_cancel():
+                    request.future.set_exception(
+                        CommandTimeoutError('Deadline passed before request '
+                                            'was sent.'))
+
+
+def _gather_fragments(futures, decode=None):
+    '''
+    Returns
+    -------
+
+    concurrent.futures.Future
+        Result of `decode(response)` (or the response packet if `decode` is
+        `None`), where `response` is the response to the last of the
+        fragments of a request, once the responses to all fragments are
+        received.
+    '''
+    result = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(future):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            for future in futures:
+                response = future.result()
+                if response.type_ == PACKET_TYPES.NACK:
+                    raise FragmentError('Device rejected request fragment.')
+            result.set_result(response if decode is None
+                              else decode(response))
+        except Exception as exception:
+            result.set_exception(exception)
+
+    for future in futures:
+        future.add_done_callback(_done)
+    return result
+
+
+class FutureMethods(object):
+    '''
+    Proxy methods which return a `concurrent.futures.Future` instead of
+    blocking (see `ProxyBase.futures`).
+    '''
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def __getattr__(self, name):
+        encode, decode = _get_codec(self._proxy, name)
+
+        def _future(*args, **kwargs):
+            timeout_s = kwargs.pop('timeout_s', None)
+            io_thread = self._proxy._io_thread
+            if io_thread is None:
+                raise RuntimeError('I/O thread is not running.  Call '
+                                   '`start_io_thread()` first.')
+            priority = kwargs.pop('priority', None)
+            decode_ = _bind_out(decode, kwargs)
+            payload_data = encode(*args, **kwargs)
+            max_payload_size = self._proxy._get_max_request_payload_size()
+            if len(payload_data) > max_payload_size:
+                # Send as `CMD_FRAGMENT` requests, as `ProxyBase._call` does
+                # (always in the bulk lane).
+                packets = [cPacket(data=fragment, type_=PACKET_TYPES.DATA)
+                           for fragment in encode_fragments(payload_data,
+                                                            max_payload_size)]
+                return _gather_fragments(io_thread
+                                         .submit_sequence(packets,
+                                                          timeout_s=timeout_s),
+                                         decode_)
+            packet = cPacket(data=payload_data, type_=PACKET_TYPES.DATA)
+            return io_thread.submit(packet, decode_, timeout_s=timeout_s,
+                                    priority=priority)
+        _future.__name__ = name
+        return _future
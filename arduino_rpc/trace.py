@@ -0,0 +1,359 @@
+'''
+Record the raw bytes exchanged with a device to a binary trace file, and
+replay traces offline (e.g., to analyze field throughput problems or to
+benchmark decoders without hardware).
+
+A trace file starts with `MAGIC`, followed by one record per read from or
+write to the serial port:
+
+    double timestamp;  // Monotonic clock time (seconds).
+    uint8_t direction;  // `HOST_TO_DEVICE` or `DEVICE_TO_HOST`.
+    uint32_t length;
+    uint8_t data[length];
+
+(all little-endian).
+
+.. versionadded:: 1.17
+'''
+from __future__ import absolute_import
+from collections import deque
+import struct
+import threading
+
+from nadamq.NadaMq import cPacket, PACKET_TYPES
+
+from .commands import PUSH_IUID_FLAG
+from .packet_stream import MAX_PAYLOAD_SIZE, PacketReceiver
+from .proxy import _monotonic
+
+
+MAGIC = b'ARPCTRC1'
+HOST_TO_DEVICE = 0
+DEVICE_TO_HOST = 1
+RECORD_HEADER = struct.Struct('<dBI')
+
+
+class ReplayMismatchError(IOError):
+    '''
+    Raised when a request sent to a `ReplayPort` differs from the request
+    recorded in the trace.
+    '''
+    pass
+
+
+class TraceWriter(object):
+    '''
+    Append-only trace file writer.
+
+    Records are queued by the calling thread (which never blocks on the file)
+    and written by a background thread every `flush_interval_s` seconds.
+    '''
+    def __init__(self, path, flush_interval_s=0.05):
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        self._records = deque()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='Trace writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, direction, data):
+        self._records.append((_monotonic(), direction, data))
+
+    def _write_records(self):
+        records = self._records
+        while records:
+            timestamp, direction, data = records.popleft()
+            self._file.write(RECORD_HEADER.pack(timestamp, direction,
+                                                len(data)))
+            self._file.write(data)
+        self._file.flush()
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval_s):
+            self._write_records()
+
+    def close(self):
+        '''
+        Write all queued records and close the trace file.
+        '''
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        self._write_records()
+        self._file.close()
+
+
+class TracingPort(object):
+    '''
+    Serial port wrapper which records every read and write to a
+    `TraceWriter` (see `ProxyBase.start_trace`).
+    '''
+    def __init__(self, port, writer):
+        self.port = port
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    @property
+    def timeout(self):
+        return self.port.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.port.timeout = value
+
+    def write(self, data):
+        self.writer.record(HOST_TO_DEVICE, bytes(data))
+        return self.port.write(data)
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        if data:
+            self.writer.record(DEVICE_TO_HOST, bytes(data))
+        return data
+
+    def readinto(self, buffer_):
+        readinto = getattr(self.port, 'readinto', None)
+        if readinto is None:
+            data = self.read(len(buffer_))
+            buffer_[:len(data)] = data
+            return len(data)
+        count = readinto(buffer_) or 0
+        if count:
+            self.writer.record(DEVICE_TO_HOST, bytes(buffer_[:count]))
+        return count
+
+
+def read_trace(path):
+    '''
+    Iterate over the records of a trace file.
+
+    Yields
+    ------
+
+    tuple
+        `(timestamp, direction, data)`.
+    '''
+    with open(path, 'rb') as input_:
+        if input_.read(len(MAGIC)) != MAGIC:
+            raise IOError('Not a trace file: %s' % path)
+        while True:
+            header = input_.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # End of file (or record truncated while being written).
+                break
+            timestamp, direction, length = RECORD_HEADER.unpack(header)
+            data = input_.read(length)
+            if len(data) < length:
+                break
+            yield timestamp, direction, data
+
+
+class Exchange(object):
+    '''
+    Request recorded in a trace and the packets received in response (device
+    pushes received before the response are included).
+    '''
+    __slots__ = ('timestamp', 'request', 'responses', 'latency_s')
+
+    def __init__(self, timestamp, request):
+        self.timestamp = timestamp
+        self.request = request
+        self.responses = []
+        self.latency_s = None
+
+
+class TraceReplayer(object):
+    '''
+    Parse a trace file into request/response exchanges.
+
+    Both directions are parsed with the same receive engine as `ProxyBase`
+    (i.e., `cPacketParser`), and responses are matched to requests by
+    sequence ID.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.exchanges = []
+        self.parse_errors = 0
+        receivers = {HOST_TO_DEVICE: PacketReceiver(),
+                     DEVICE_TO_HOST: PacketReceiver()}
+        pending = {}
+        pushes = []
+        for timestamp, direction, data in read_trace(path):
+            receiver = receivers[direction]
+            receiver.feed(data)
+            while receiver.packets:
+                packet = receiver.packets.popleft()
+                if isinstance(packet, IOError):
+                    self.parse_errors += 1
+                elif direction == HOST_TO_DEVICE:
+                    exchange = Exchange(timestamp, packet)
+                    pending[packet.iuid] = exchange
+                    self.exchanges.append(exchange)
+                elif packet.iuid & PUSH_IUID_FLAG:
+                    pushes.append(packet)
+                else:
+                    iuid = packet.iuid
+                    if iuid == 0 and pending:
+                        # Untagged response; match the oldest request.
+                        iuid = min(pending, key=lambda k:
+                                   pending[k].timestamp)
+                    exchange = pending.pop(iuid, None)
+                    if exchange is None:
+                        continue
+                    exchange.responses = pushes + [packet]
+                    exchange.latency_s = timestamp - exchange.timestamp
+                    pushes = []
+
+    def __len__(self):
+        return len(self.exchanges)
+
+    def decode(self, proxy):
+        '''
+        Decode each recorded response using the decoders of a proxy.
+
+        Yields
+        ------
+
+        tuple
+            `(name, result)`, where `name` is the name of the method
+            corresponding to the command code of the request.  `result` is
+            `None` for NACK responses.
+        '''
+        names = dict((getattr(proxy, attr), attr[len('_CMD_'):].lower())
+                     for attr in dir(type(proxy)) if attr.startswith('_CMD_'))
+        for exchange in self.exchanges:
+            if not exchange.responses:
+                continue
+            request_data = exchange.request.data()
+            command = struct.unpack_from('<H', request_data)[0]
+            name = names.get(command)
+            response = exchange.responses[-1]
+            if name is None or response.type_ == PACKET_TYPES.NACK:
+                yield name, None
+            else:
+                yield name, getattr(proxy, '_decode_' + name)(response)
+
+    def port(self, realtime=False, check=True):
+        '''
+        Returns
+        -------
+
+        ReplayPort
+            Serial port which responds to requests like the recorded device.
+        '''
+        return ReplayPort(self.exchanges, realtime=realtime, check=check)
+
+
+def _encode_response(packet, iuid):
+    '''
+    Serialize a response packet, split into `STREAM` packets followed by a
+    `DATA` packet if necessary (as `CommandPacketHandler` does).
+    '''
+    if packet.type_ not in (PACKET_TYPES.DATA, PACKET_TYPES.STREAM):
+        return cPacket(data=b'', type_=packet.type_, iuid=iuid).tostring()
+    data = packet.data()
+    frames = []
+    while len(data) > MAX_PAYLOAD_SIZE:
+        frames.append(cPacket(data=data[:MAX_PAYLOAD_SIZE],
+                              type_=PACKET_TYPES.STREAM,
+                              iuid=iuid).tostring())
+        data = data[MAX_PAYLOAD_SIZE:]
+    frames.append(cPacket(data=data, type_=packet.type_,
+                          iuid=iuid).tostring())
+    return b''.join(frames)
+
+
+class ReplayPort(object):
+    '''
+    Serial port which acts as the device recorded in a trace.
+
+    Each request written to the port is answered with the responses to the
+    corresponding (i.e., next) recorded request, tagged with the sequence ID
+    of the new request.
+
+    Arguments
+    ---------
+
+     - `exchanges`: Recorded exchanges (see `TraceReplayer`).
+     - `realtime`: If `True`, each response becomes available after the
+       recorded latency.  Otherwise, responses are available immediately.
+     - `check`: If `True`, raise `ReplayMismatchError` if a request differs
+       from the recorded request.
+    '''
+    def __init__(self, exchanges, realtime=False, check=True):
+        self._exchanges = deque(exchanges)
+        self.realtime = realtime
+        self.check = check
+        self.timeout = None
+        self._receiver = PacketReceiver()
+        # `(available_time, data)` of each response not yet read.
+        self._responses = deque()
+        self._lock = threading.Condition()
+
+    def write(self, data):
+        self._receiver.feed(data)
+        while self._receiver.packets:
+            request = self._receiver.packets.popleft()
+            if isinstance(request, IOError) or not self._exchanges:
+                continue
+            exchange = self._exchanges.popleft()
+            if self.check and request.data() != exchange.request.data():
+                raise ReplayMismatchError('Request differs from recorded '
+                                          'request.')
+            available = _monotonic()
+            if self.realtime and exchange.latency_s is not None:
+                available += exchange.latency_s
+            response = b''.join(_encode_response(packet, packet.iuid
+                                                 if packet.iuid &
+                                                 PUSH_IUID_FLAG
+                                                 else request.iuid)
+                                for packet in exchange.responses)
+            with self._lock:
+                self._responses.append((available, bytearray(response)))
+                self._lock.notify_all()
+        return len(data)
+
+    def inWaiting(self):
+        now = _monotonic()
+        with self._lock:
+            return sum(len(data) for available, data in self._responses
+                       if available <= now)
+
+    in_waiting = property(inWaiting)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else (_monotonic() +
+                                                      self.timeout)
+        with self._lock:
+            while True:
+                now = _monotonic()
+                if self._responses and self._responses[0][0] <= now:
+                    break
+                if deadline is not None and now >= deadline:
+                    return b''
+                wait_s = [t - now for t in (deadline,
+                                            self._responses[0][0]
+                                            if self._responses else None)
+                          if t is not None]
+                if wait_s:
+                    self._lock.wait(min(wait_s))
+                else:
+                    self._lock.wait()
+            output = bytearray()
+            while (self._responses and size > len(output) and
+                   self._responses[0][0] <= now):
+                data = self._responses[0][1]
+                count = min(size - len(output), len(data))
+                output += data[:count]
+                del data[:count]
+                if not data:
+                    self._responses.popleft()
+            return bytes(output)
+
@@ -44,13 +44,19 @@ options(
                install_requires=['arduino-helpers>=0.3.post18',
                                  'arduino-memory>=0.1.post3',
                                  'c-array-defs>=0.2', 'clang-helpers>=0.3',
-                                 'jinja2', 'nadamq>=0.8.post1',
+                                 'futures; python_version < "3.0"', 'jinja2',
+                                 'nadamq>=0.8.post1',
                                  'nanopb-helpers>=0.4.post1', 'pandas>=0.15',
                                  'path-helpers>=0.2', 'serial-device>=0.2'],
+               entry_points={'console_scripts':
+                             ['arduino-rpc-benchmark = '
+                              'arduino_rpc.benchmarks.suite:main']},
                # Install data listed in `MANIFEST.in`
                include_package_data=True,
                license='GPLv2',
-               packages=[properties['package_name']]))
+               packages=[properties['package_name'],
+                         properties['package_name'] + '.benchmarks',
+                         properties['package_name'] + '.tests']))
 
 
 @task